@@ -0,0 +1,314 @@
+"""
+Benchmarks for the ingestion and dashboard query paths
+
+Everything runs against the local DuckDB stand-in (local_bigquery), so no
+GCP project is needed. A synthetic population of users, leagues and daily
+step history is seeded with dummy_ingestion's vectorised generator, pushed through
+compaction and the rollup refresh, and then the ingestion functions and the
+page-level queries of the Streamlit data layer are timed.
+
+Run from the repository root:
+
+    pip install -r local_bigquery/requirements.txt
+    python benchmarks/run.py --users 2000 --leagues 50 --days 365 --output results.json
+
+The JSON written to --output (or stdout) has the run configuration, the
+environment and git commit, ingestion rows/sec, p50/p95/p99 latency per
+query, and peak memory per phase, so results can be diffed across changes.
+"""
+import argparse
+import contextlib
+import gc
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_ID = "step_lotto"
+
+def load_module(name, path):
+    """Import a Cloud Function's main.py under a unique module name"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def latency_summary(samples):
+    """Summarise latency samples (in seconds) as milliseconds"""
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = samples[0]
+    return {
+        "iterations": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+class PhaseMemory:
+    """Record peak Python heap allocation for a phase of the benchmark"""
+
+    def __init__(self, results, phase):
+        self.results = results
+        self.phase = phase
+
+    def __enter__(self):
+        gc.collect()
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.results[self.phase] = {"peak_traced_mb": round(peak / 2**20, 2)}
+        return False
+
+def seed_population(client, dummy, ingestion, rollups, args):
+    """Write users, leagues, memberships and step history, then compact and roll up"""
+    population = dummy.Population(
+        args.users,
+        args.leagues,
+        leagues_per_user=args.leagues_per_user,
+        start_date=date.today() - timedelta(days=args.days - 1),
+        end_date=date.today(),
+        seed=args.seed
+    )
+
+    # History goes through the staging table so compaction is measured too
+    started = time.perf_counter()
+    written = dummy.write_population(population, dummy.BigQuerySink(client, DATASET_ID), date.today(),
+                                     steps_table="user_steps_input")
+    seed_seconds = time.perf_counter() - started
+    history_rows = written["user_steps_input"]
+
+    started = time.perf_counter()
+    ingestion.compact_staging_rows(datetime.now(timezone.utc))
+    compaction_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rollups.refresh_rollups()
+    rollup_seconds = time.perf_counter() - started
+
+    names = [name for start, stop in population.blocks() for name in population.user_names(start, stop).tolist()]
+    leagues = population.league_names().tolist()
+    return names, leagues, {
+        "users": len(names),
+        "leagues": len(leagues),
+        "memberships": written["league_memberships"],
+        "history_rows": history_rows,
+        "seed_seconds": round(seed_seconds, 3),
+        "seed_rows_per_sec": round(history_rows / seed_seconds, 1),
+        "compaction_seconds": round(compaction_seconds, 3),
+        "compaction_rows_per_sec": round(history_rows / compaction_seconds, 1),
+        "rollup_refresh_seconds": round(rollup_seconds, 3),
+    }
+
+def shortcut_payloads(names, days_per_payload, rng):
+    """Build Apple Shortcut style payloads, one per user"""
+    today = date.today().isoformat()
+    return [
+        {"name": name, "steps": [rng.randint(0, 25000) for _ in range(days_per_payload)], "date": today}
+        for name in names
+    ]
+
+def bench_ingestion(ingestion, names, args):
+    """Measure record building and the single and batch HTTP insert paths"""
+    from flask import Flask, request
+    from table_cache import coerce_row
+
+    rng = random.Random(args.seed + 1)
+    app = Flask(__name__)
+    results = {}
+
+    # Pure parsing and record construction, no I/O. Multi-year backfill
+    # payloads are measured alongside the usual week-long syncs
+    payloads = shortcut_payloads(names[:args.ingest_requests], args.payload_days, rng)
+    backfill_payloads = shortcut_payloads(names[:args.ingest_requests], args.backfill_days, rng)
+    rows = sum(len(payload["steps"]) for payload in payloads)
+    schema = ingestion.table_cache.get().schema
+    for label, sample in (("sync", payloads), ("backfill", backfill_payloads)):
+        sample_rows = sum(len(payload["steps"]) for payload in sample)
+        bodies = [json.dumps(payload).encode("utf-8") for payload in sample]
+        builders = {
+            "parse_stdlib_json": lambda body: json.loads(body),
+            "parse_fast_json": lambda body: ingestion.loads(body),
+            "json_to_columns": lambda body: ingestion.json_to_columns(ingestion.loads(body)),
+            "json_to_records": lambda body: ingestion.json_to_records(ingestion.loads(body)),
+            # Validation as the endpoints do it (a column at a time), against
+            # checking every row on its own
+            "validated_records": lambda body: ingestion.validated_records(ingestion.loads(body)),
+            "validated_records_per_row": lambda body: [
+                coerce_row(record, schema) for record in ingestion.json_to_records(ingestion.loads(body))
+            ],
+        }
+        for name, build in builders.items():
+            started = time.perf_counter()
+            for body in bodies:
+                build(body)
+            elapsed = time.perf_counter() - started
+            results[f"{name}.{label}"] = {"rows": sample_rows, "rows_per_sec": round(sample_rows / elapsed, 1)}
+
+    # One HTTP request per user, as the phones send them
+    latencies = []
+    for payload in payloads:
+        with app.test_request_context("/", method="POST", json=payload):
+            started = time.perf_counter()
+            body, status, _ = ingestion.insert_to_bigquery(request)
+            latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"insert_to_bigquery failed: {body}")
+    results["insert_to_bigquery"] = {
+        "rows_per_sec": round(rows / sum(latencies), 1),
+        **latency_summary(latencies),
+    }
+
+    # The same users through the batch endpoint, with fresh step counts so
+    # insert-ID deduplication does not drop them
+    payloads = shortcut_payloads(names[:args.ingest_requests], args.payload_days, rng)
+    latencies = []
+    for start in range(0, len(payloads), args.batch_size):
+        body = "\n".join(json.dumps(payload) for payload in payloads[start:start + args.batch_size])
+        with app.test_request_context("/", method="POST", data=body):
+            started = time.perf_counter()
+            response, status, _ = ingestion.insert_batch_to_bigquery(request)
+            latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"insert_batch_to_bigquery failed: {response}")
+    results["insert_batch_to_bigquery"] = {
+        "batch_size": args.batch_size,
+        "rows_per_sec": round(rows / sum(latencies), 1),
+        **latency_summary(latencies),
+    }
+
+    return results
+
+def page_queries(queries, names, leagues, rng):
+    """
+    Page-level queries to time, keyed by page and query
+
+    Each entry is a (function, argument factory) pair. Cached functions are
+    cleared before every call so each sample is a real query. The all-time
+    leaderboard is served from the in-memory leaderboard index instead.
+    """
+    return {
+        "login.user_exists": (queries.user_exists, lambda: (rng.choice(names),)),
+        "homepage.snapshot_90d": (queries.homepage_snapshot, lambda: (rng.choice(names), date.today() - timedelta(days=89), date.today())),
+        "homepage.snapshot_2y": (queries.homepage_snapshot, lambda: (rng.choice(names), date.today() - timedelta(days=729), date.today())),
+        "homepage.snapshot_all_time": (queries.homepage_snapshot, lambda: (rng.choice(names), None, date.today())),
+        "homepage.snapshot_all_time_lttb": (queries.homepage_snapshot, lambda: (rng.choice(names), None, date.today(), "lttb")),
+        "join.league_exists": (queries.league_exists, lambda: (rng.choice(leagues),)),
+        "join.is_league_member": (queries.is_league_member, lambda: (rng.choice(names), rng.choice(leagues))),
+        "league.leaderboard_all_time": (queries.league_leaderboard, lambda: (rng.choice(leagues), None, None, 0, 25)),
+        "league.leaderboard_this_week": (queries.league_window_leaderboard, lambda: (rng.choice(leagues), date.today() - timedelta(days=date.today().weekday()), date.today(), 0, 25)),
+        "league.leaderboard_30d": (queries.league_window_leaderboard, lambda: (rng.choice(leagues), date.today() - timedelta(days=29), date.today(), 0, 25)),
+    }
+
+def bench_queries(names, leagues, args):
+    """Time each page-level query of the Streamlit data layer"""
+    sys.path.insert(0, os.path.join(REPO_ROOT, "website_streamlit"))
+    from data import queries
+
+    # Outside `streamlit run` every cached call logs a "no runtime" warning
+    logging.getLogger("streamlit.runtime.caching.cache_data_api").setLevel(logging.ERROR)
+
+    rng = random.Random(args.seed + 2)
+    results = {}
+    for name, (function, make_args) in page_queries(queries, names, leagues, rng).items():
+        latencies = []
+        for _ in range(args.query_iterations):
+            call_args = make_args()
+            if hasattr(function, "clear"):
+                function.clear()
+            started = time.perf_counter()
+            function(*call_args)
+            latencies.append(time.perf_counter() - started)
+        results[name] = latency_summary(latencies)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--leagues", type=int, default=20)
+    parser.add_argument("--leagues-per-user", type=int, default=2)
+    parser.add_argument("--days", type=int, default=365, help="Days of step history to seed")
+    parser.add_argument("--payload-days", type=int, default=7, help="Days in each Shortcut payload")
+    parser.add_argument("--backfill-days", type=int, default=1095, help="Days in each backfill payload")
+    parser.add_argument("--ingest-requests", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--query-iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", help="DuckDB file to use, defaults to a fresh temporary file")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="steplotto-bench-")
+    os.environ["STEPLOTTO_BACKEND"] = "local"
+    os.environ["STEPLOTTO_LOCAL_DB"] = args.database or os.path.join(workdir, "bench.duckdb")
+    sys.path.insert(0, REPO_ROOT)
+
+    from local_bigquery.client import LocalClient
+    from schema.migrate import migrate
+
+    client = LocalClient()
+    # Keep stdout clean for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        migrate(client)
+    sys.path.insert(0, os.path.join(REPO_ROOT, "dummy_ingestion"))
+    dummy = load_module("bench_dummy_ingestion", "dummy_ingestion/main.py")
+    sys.path.insert(0, os.path.join(REPO_ROOT, "ingestion"))
+    ingestion = load_module("bench_ingestion", "ingestion/main.py")
+    rollups = load_module("bench_rollups", "rollups/main.py")
+
+    memory = {}
+    with PhaseMemory(memory, "seed"):
+        names, leagues, population = seed_population(client, dummy, ingestion, rollups, args)
+    with PhaseMemory(memory, "ingestion"):
+        ingestion_results = bench_ingestion(ingestion, names, args)
+    with PhaseMemory(memory, "queries"):
+        query_results = bench_queries(names, leagues, args)
+    memory["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+    results = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "population": population,
+        "ingestion": ingestion_results,
+        "queries": query_results,
+        "memory": memory,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import functions_framework
+from google.cloud import bigquery
+import numpy as np
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from sampler import AliasSampler, SegmentedAliasSampler, draw_seed
+
+# Initialize BigQuery client, or the local stand-in when STEPLOTTO_BACKEND=local
+if os.environ.get("STEPLOTTO_BACKEND") == "local":
+    from local_bigquery.client import LocalClient
+    client = LocalClient()
+else:
+    client = bigquery.Client()
+
+# Configure your BigQuery details
+PROJECT_ID = "my-project-1706650764881"
+DATASET_ID = "step_lotto"
+MEMBERSHIPS_TABLE_ID = "league_memberships"
+DAILY_TABLE_ID = "daily_user_steps"
+DRAWS_TABLE_ID = "draws"
+
+# Every full STEPS_PER_TICKET steps in the period earns one ticket
+STEPS_PER_TICKET = 1000
+
+# Winners drawn per league per period
+WINNERS_PER_DRAW = int(os.environ.get("WINNERS_PER_DRAW", "1"))
+
+# Leagues written per load job. A run normally fits in one; larger runs are
+# split so an interrupted run keeps the leagues it already wrote
+MAX_LEAGUES_PER_WRITE = 50000
+
+DRAWS_SCHEMA = [
+    bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("period_start", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("period_end", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("winner_rank", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("winner_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("winner_tickets", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("total_tickets", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("entrants", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("seed", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("drawn_at", "TIMESTAMP", mode="REQUIRED"),
+]
+
+def table_path(table_id):
+    """Fully qualified, quoted table name for use in queries"""
+    return f"`{PROJECT_ID}.{DATASET_ID}.{table_id}`"
+
+def ensure_draws_table():
+    """Create the draws table if it does not exist yet"""
+    draws = bigquery.Table(f"{PROJECT_ID}.{DATASET_ID}.{DRAWS_TABLE_ID}", schema=DRAWS_SCHEMA)
+    draws.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="period_end"
+    )
+    draws.clustering_fields = ["league_id"]
+    client.create_table(draws, exists_ok=True)
+
+def last_full_week(today=None):
+    """The most recent Monday to Sunday week that has finished"""
+    today = today or date.today()
+    period_end = today - timedelta(days=today.weekday() + 1)
+    return period_end - timedelta(days=6), period_end
+
+def get_period_totals(period_start, period_end, league_id=None, undrawn_only=False):
+    """
+    Get every member's step total over the period, for one league or all of them
+    
+    Rows are ordered by league and player so a draw always sees its entrants
+    in the same order, which is what makes it reproducible from its seed.
+    
+    Args:
+        period_start (date): First day of the period
+        period_end (date): Last day of the period
+        league_id (str): Only this league, instead of every league
+        undrawn_only (bool): Skip leagues that already have a draw for the period
+    
+    Returns:
+        DataFrame: league_id, player_id, total_steps
+    """
+    filters = []
+    if league_id is not None:
+        filters.append("lm.league_id = @league_id")
+    if undrawn_only:
+        filters.append(f"""lm.league_id NOT IN (
+            SELECT league_id
+            FROM {table_path(DRAWS_TABLE_ID)}
+            WHERE period_start = @period_start AND period_end = @period_end
+        )""")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    
+    query = f"""
+    SELECT
+        lm.league_id,
+        lm.player_id,
+        COALESCE(SUM(d.total_steps), 0) AS total_steps
+    FROM {table_path(MEMBERSHIPS_TABLE_ID)} lm
+    LEFT JOIN {table_path(DAILY_TABLE_ID)} d
+        ON d.name = lm.player_id AND d.day BETWEEN @period_start AND @period_end
+    {where}
+    GROUP BY lm.league_id, lm.player_id
+    ORDER BY lm.league_id, lm.player_id
+    """
+    
+    query_parameters = [
+        bigquery.ScalarQueryParameter("period_start", "DATE", period_start),
+        bigquery.ScalarQueryParameter("period_end", "DATE", period_end)
+    ]
+    if league_id is not None:
+        query_parameters.append(bigquery.ScalarQueryParameter("league_id", "STRING", league_id))
+    
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    return client.query(query, job_config=job_config).result().to_dataframe()
+
+def draw_winners(league_id, player_ids, total_steps, period_start, period_end, winners=WINNERS_PER_DRAW):
+    """
+    Draw a league's winners for a period, with tickets in proportion to steps
+    
+    Args:
+        league_id (str): League being drawn
+        player_ids (sequence): Members, in a stable order
+        total_steps (sequence): Each member's steps over the period
+        period_start (date): First day of the period
+        period_end (date): Last day of the period
+        winners (int): Number of distinct winners to draw
+    
+    Returns:
+        list: One draws-table row per winner, empty if nobody earned a ticket
+    """
+    tickets = np.asarray(total_steps, dtype=np.int64) // STEPS_PER_TICKET
+    total_tickets = int(tickets.sum())
+    if total_tickets == 0:
+        return []
+    
+    seed = draw_seed(league_id, period_start, period_end)
+    sampler = AliasSampler(tickets)
+    chosen = sampler.sample_distinct(np.random.default_rng(seed), winners)
+    
+    drawn_at = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            'league_id': league_id,
+            'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(),
+            'winner_rank': rank,
+            'winner_id': player_ids[index],
+            'winner_tickets': int(tickets[index]),
+            'total_tickets': total_tickets,
+            'entrants': sampler.entrants,
+            'seed': seed,
+            'drawn_at': drawn_at,
+        }
+        for rank, index in enumerate(chosen, start=1)
+    ]
+
+def write_draws(rows):
+    """Append draw rows with a load job"""
+    if rows:
+        table_ref = client.dataset(DATASET_ID).table(DRAWS_TABLE_ID)
+        client.load_table_from_json(rows, table_ref).result()
+
+def draw_league(league_id, period_start, period_end, winners=WINNERS_PER_DRAW):
+    """Run and record one league's draw for a period"""
+    totals = get_period_totals(period_start, period_end, league_id)
+    rows = draw_winners(
+        league_id,
+        totals['player_id'].tolist(),
+        totals['total_steps'].to_numpy(),
+        period_start,
+        period_end,
+        winners
+    )
+    write_draws(rows)
+    return rows
+
+def draw_all_leagues(totals, period_start, period_end, winners=WINNERS_PER_DRAW):
+    """
+    Draw every league in a period totals DataFrame at once
+    
+    Each league's first round of uniforms comes from its own seeded generator,
+    sized as AliasSampler.sample_distinct would size it, and leagues are then
+    sampled in one vectorised lookup per round size. The winners are exactly
+    those draw_winners would pick for the league on its own. Leagues whose
+    first round has too few distinct winners finish on the single-league
+    sampler, which replays the same round and carries on.
+    
+    Returns:
+        list: draws-table rows for every league with at least one ticket
+    """
+    if totals.empty:
+        return []
+    
+    league_ids = totals['league_id'].to_numpy()
+    player_ids = totals['player_id'].to_numpy()
+    tickets = totals['total_steps'].to_numpy(dtype=np.int64) // STEPS_PER_TICKET
+    
+    # Rows are ordered by league, so each league is one contiguous segment
+    starts = np.flatnonzero(np.r_[True, league_ids[1:] != league_ids[:-1]])
+    ends = np.append(starts[1:], len(tickets))
+    total_tickets = np.add.reduceat(tickets, starts)
+    entrants = np.add.reduceat((tickets > 0).astype(np.int64), starts)
+    drawable = np.flatnonzero(total_tickets > 0)
+    if len(drawable) == 0:
+        return []
+    
+    sampler = SegmentedAliasSampler(tickets, starts)
+    seeds = dict(zip(
+        drawable.tolist(),
+        (draw_seed(league_ids[starts[segment]], period_start, period_end) for segment in drawable)
+    ))
+    
+    # AliasSampler.sample_distinct sizes its rounds from the winners it can
+    # actually draw, so leagues with fewer entrants than winners use smaller
+    # rounds. Leagues sharing a round size are sampled in one lookup
+    counts = np.minimum(winners, entrants[drawable])
+    round_sizes = np.maximum(counts * 2, 8)
+    first_round = {}
+    for round_size in np.unique(round_sizes).tolist():
+        group = drawable[round_sizes == round_size]
+        
+        # Same stream AliasSampler.sample consumes: column uniforms, then coin uniforms
+        uniforms = np.stack([np.random.default_rng(seeds[segment]).random(2 * round_size) for segment in group.tolist()])
+        picks = sampler.lookup(
+            np.repeat(group, round_size),
+            uniforms[:, :round_size].ravel(),
+            uniforms[:, round_size:].ravel()
+        ).reshape(len(group), round_size)
+        first_round.update(zip(group.tolist(), picks.tolist()))
+    
+    drawn_at = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for segment, count in zip(drawable.tolist(), counts.tolist()):
+        start, end = starts[segment], ends[segment]
+        seed = seeds[segment]
+        chosen = list(dict.fromkeys(first_round[segment]))[:count]
+        if len(chosen) < count:
+            local = AliasSampler(tickets[start:end]).sample_distinct(np.random.default_rng(seed), count)
+            chosen = [start + index for index in local]
+        
+        for rank, index in enumerate(chosen, start=1):
+            rows.append({
+                'league_id': league_ids[start],
+                'period_start': period_start.isoformat(),
+                'period_end': period_end.isoformat(),
+                'winner_rank': rank,
+                'winner_id': player_ids[index],
+                'winner_tickets': int(tickets[index]),
+                'total_tickets': int(total_tickets[segment]),
+                'entrants': int(entrants[segment]),
+                'seed': seed,
+                'drawn_at': drawn_at,
+            })
+    
+    return rows
+
+def run_all_draws(period_start, period_end, winners=WINNERS_PER_DRAW):
+    """
+    Draw every league that has not been drawn for the period yet
+    
+    All leagues' period totals come from one set-based query and are drawn
+    in-process together, then written with one load job. Leagues already in
+    the draws table are skipped, so an interrupted or repeated run only picks
+    up what is missing. Because seeds are deterministic, a league drawn
+    twice would get the same winners anyway.
+    
+    Returns:
+        dict: Number of leagues drawn and winners recorded
+    """
+    ensure_draws_table()
+    totals = get_period_totals(period_start, period_end, undrawn_only=True)
+    rows = draw_all_leagues(totals, period_start, period_end, winners)
+    
+    # Rows are grouped by league, so chunks never split one
+    league_ids = sorted({row['league_id'] for row in rows})
+    for start in range(0, len(league_ids), MAX_LEAGUES_PER_WRITE):
+        chunk_leagues = set(league_ids[start:start + MAX_LEAGUES_PER_WRITE])
+        write_draws([row for row in rows if row['league_id'] in chunk_leagues])
+    
+    return {'leagues_drawn': len(league_ids), 'winners': len(rows)}
+
+@functions_framework.cloud_event
+def run_league_draws(cloud_event):
+    """Cloud Function triggered by Cloud Scheduler to draw every league for the week just finished"""
+    
+    try:
+        period_start, period_end = last_full_week()
+        counts = run_all_draws(period_start, period_end)
+        
+        print(f"Ran draws for {period_start} to {period_end}: {counts}")
+        return f"Drew {counts['winners']} winners across {counts['leagues_drawn']} leagues"
+    
+    except Exception as e:
+        print(f"Error running league draws: {str(e)}")
+        raise e
@@ -0,0 +1,137 @@
+"""
+Weighted sampling for league draws
+
+AliasSampler implements Vose's alias method: building the tables is O(n) in
+the number of entrants and every sample after that is O(1), however large
+the league. Randomness always comes from a numpy Generator passed in by the
+caller, so a draw is fully reproducible from its seed.
+"""
+import hashlib
+import numpy as np
+
+def draw_seed(league_id, period_start, period_end):
+    """
+    Deterministic 63-bit seed for one league's draw over one period
+
+    Anyone with the league's period totals can re-run the draw from this seed
+    and get the same winners.
+    """
+    key = f"{league_id}|{period_start.isoformat()}|{period_end.isoformat()}".encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big") >> 1
+
+def vose_tables(weights):
+    """
+    Build alias tables for one weight vector with a positive sum
+
+    Returns:
+        tuple: (acceptance probabilities, alias indexes)
+    """
+    n = len(weights)
+    prob = weights * n / weights.sum()
+    alias = np.arange(n, dtype=np.int64)
+
+    small = np.flatnonzero(prob < 1.0).tolist()
+    large = np.flatnonzero(prob >= 1.0).tolist()
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        alias[less] = more
+        prob[more] -= 1.0 - prob[less]
+        if prob[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # Whatever is left over is 1 up to floating point error
+    prob[small] = 1.0
+    prob[large] = 1.0
+    return prob, alias
+
+class AliasSampler:
+    """Sample indexes in proportion to a weight vector in O(1) per sample"""
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or len(weights) == 0 or weights.sum() <= 0 or (weights < 0).any():
+            raise ValueError("weights must be a non-empty vector of non-negative values with a positive sum")
+
+        self.prob, self.alias = vose_tables(weights)
+        self.entrants = int(np.count_nonzero(weights))
+
+    def __len__(self):
+        return len(self.prob)
+
+    def lookup(self, column_u, coin_u):
+        """Map pairs of uniform [0, 1) draws to sampled indexes"""
+        n = len(self.prob)
+        columns = np.minimum((column_u * n).astype(np.int64), n - 1)
+        return np.where(coin_u < self.prob[columns], columns, self.alias[columns])
+
+    def sample(self, rng, size):
+        """Draw size indexes with replacement"""
+        column_u = rng.random(size)
+        return self.lookup(column_u, rng.random(size))
+
+    def sample_distinct(self, rng, count, max_rounds=100):
+        """
+        Draw up to count distinct indexes, in draw order
+
+        Repeats are discarded and drawn again, which is cheap while count is
+        small next to the number of entrants with weight.
+        """
+        count = min(count, self.entrants)
+        if count == 0:
+            return []
+        chosen = []
+        seen = set()
+        for _ in range(max_rounds):
+            for index in self.sample(rng, max(count * 2, 8)).tolist():
+                if index not in seen:
+                    seen.add(index)
+                    chosen.append(index)
+                    if len(chosen) == count:
+                        return chosen
+        return chosen
+
+class SegmentedAliasSampler:
+    """
+    Alias tables for many independent weight vectors laid end to end
+
+    Used to draw every league at once: segment i is one league's members,
+    starting at starts[i]. Building the tables is not vectorised: Vose's
+    method pairs columns one at a time, so each segment's tables are built
+    by the same Python loop AliasSampler uses, which keeps past draws
+    reproducible. Sampling is a single vectorised lookup across all
+    segments, and a segment given the same uniforms picks exactly what
+    AliasSampler would.
+    """
+
+    def __init__(self, weights, starts):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.diff(np.append(self.starts, len(weights)))
+        self.prob = np.ones(len(weights))
+        self.alias = np.arange(len(weights), dtype=np.int64)
+
+        for start, length in zip(self.starts.tolist(), self.lengths.tolist()):
+            segment = weights[start:start + length]
+            if segment.sum() > 0:
+                prob, alias = vose_tables(segment)
+                self.prob[start:start + length] = prob
+                self.alias[start:start + length] = alias + start
+
+    def lookup(self, segments, column_u, coin_u):
+        """
+        Map pairs of uniform [0, 1) draws to sampled indexes
+
+        Args:
+            segments (array): Segment to sample from, one per draw
+            column_u (array): Uniform draws choosing the column
+            coin_u (array): Uniform draws choosing between column and alias
+
+        Returns:
+            array: Indexes into the full weight vector
+        """
+        lengths = self.lengths[segments]
+        columns = self.starts[segments] + np.minimum((column_u * lengths).astype(np.int64), lengths - 1)
+        return np.where(coin_u < self.prob[columns], columns, self.alias[columns])
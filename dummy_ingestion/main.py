@@ -1,23 +1,83 @@
 import functions_framework
 from google.cloud import bigquery
-import random
-from datetime import datetime, date
-import json
+import os
+import numpy as np
+from datetime import datetime, date, timedelta, timezone
 
-# Initialize BigQuery client
-client = bigquery.Client()
+from population import Population, BigQuerySink, NdjsonSink, ParquetSink
+
+# Initialize BigQuery client, or the local stand-in when STEPLOTTO_BACKEND=local
+if os.environ.get("STEPLOTTO_BACKEND") == "local":
+    from local_bigquery.client import LocalClient
+    client = LocalClient()
+else:
+    client = bigquery.Client()
 
 # Configure your BigQuery details
 PROJECT_ID = "my-project-1706650764881"
 DATASET_ID = "step_lotto"
-TABLE_ID = "steps"
+TABLE_ID = "user_steps_input"
+
+# Size of the synthetic population the scheduled function tops up each day.
+# Backfills of larger populations are run from the command line, see below
+POPULATION_USERS = int(os.environ.get("DUMMY_POPULATION_USERS", "15"))
+POPULATION_LEAGUES = int(os.environ.get("DUMMY_POPULATION_LEAGUES", "3"))
+POPULATION_SEED = int(os.environ.get("DUMMY_POPULATION_SEED", "0"))
+
+# The scheduled population's signups are spread over a fixed year, so the
+# same seed keeps the same users and signup days from one day to the next
+POPULATION_START_DATE = date.fromisoformat(os.environ.get("DUMMY_POPULATION_START_DATE", "2024-01-01"))
+POPULATION_END_DATE = POPULATION_START_DATE + timedelta(days=365)
+
+# Rows per write when backfilling
+CHUNK_ROWS = 500000
+
+def write_population(population, sink, end_date, include_entities=True, steps_table=TABLE_ID):
+    """
+    Stream a population's users, leagues, memberships and step history to a sink
+    
+    Step rows go to the staging table by default, so compaction merges them
+    into user_steps one row per (name, date) and re-running a backfill
+    updates its days rather than duplicating them.
+    
+    Args:
+        population (Population): Population to generate
+        sink: BigQuerySink, NdjsonSink or ParquetSink
+        end_date (date): Last day of step history
+        include_entities (bool): Also write user_ids, leagues and league_memberships
+        steps_table (str): Table the step rows go to
+    
+    Returns:
+        dict: Rows written per table
+    """
+    timestamp = datetime.now(timezone.utc).isoformat()
+    written = {}
+    
+    if include_entities:
+        for table, chunks in (
+            ("user_ids", population.user_rows()),
+            ("leagues", population.league_rows()),
+            ("league_memberships", population.membership_rows()),
+        ):
+            written[table] = sum(sink.write(table, columns) for columns in chunks)
+    
+    # Buffer day-sized chunks up to CHUNK_ROWS so each write is a decent size
+    written[steps_table] = 0
+    pending = []
+    pending_rows = 0
+    for columns in population.step_rows(end_date):
+        pending.append(columns)
+        pending_rows += len(columns["name"])
+        if pending_rows >= CHUNK_ROWS:
+            written[steps_table] += sink.write(steps_table, concat_columns(pending), timestamp)
+            pending, pending_rows = [], 0
+    if pending:
+        written[steps_table] += sink.write(steps_table, concat_columns(pending), timestamp)
+    
+    return written
 
-# List of dummy user names
-DUMMY_USERS = [
-    "Alice Johnson", "Bob Smith", "Charlie Brown", "Diana Prince", "Eve Adams",
-    "Frank Miller", "Grace Lee", "Henry Ford", "Ivy Chen", "Jack Wilson",
-    "Kate Davis", "Liam O'Connor", "Maya Patel", "Noah Williams", "Olivia Taylor"
-]
+def concat_columns(chunks):
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
 
 @functions_framework.cloud_event
 def generate_dummy_data(cloud_event):
@@ -25,39 +85,70 @@ def generate_dummy_data(cloud_event):
     
     try:
         # Get today's date
-        today = date.today().isoformat()
+        today = date.today()
         
-        # Prepare rows for all users
-        rows_to_insert = []
+        population = Population(
+            POPULATION_USERS,
+            POPULATION_LEAGUES,
+            start_date=POPULATION_START_DATE,
+            end_date=POPULATION_END_DATE,
+            seed=POPULATION_SEED
+        )
+        sink = BigQuerySink(client, DATASET_ID)
+        timestamp = datetime.now(timezone.utc).isoformat()
         
-        for user_name in DUMMY_USERS:
-            # Generate random steps between 3000 and 15000
-            steps = random.randint(3000, 15000)
-            
-            row = {
-                'name': user_name,
-                'steps': steps,
-                'date': today,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            rows_to_insert.append(row)
+        # Today's rows go through the staging table like real syncs, so
+        # compaction and the rollups pick them up
+        inserted = 0
+        for block in population.blocks():
+            inserted += sink.write(TABLE_ID, population.day_steps(today, block), timestamp)
         
-        # Get table reference
-        table_ref = client.dataset(DATASET_ID).table(TABLE_ID)
-        table = client.get_table(table_ref)
-        
-        # Insert all rows at once
-        errors = client.insert_rows_json(table, rows_to_insert)
-        
-        if errors:
-            print(f"BigQuery insert errors: {errors}")
-            raise Exception(f"Error inserting data: {errors}")
-        
-        print(f"Successfully inserted {len(rows_to_insert)} dummy records for {today}")
-        return f"Generated dummy data for {len(DUMMY_USERS)} users on {today}"
+        print(f"Successfully inserted {inserted} dummy records for {today}")
+        return f"Generated dummy data for {POPULATION_USERS} users on {today}"
         
     except Exception as e:
         print(f"Error generating dummy data: {str(e)}")
         raise e
     
-    #hi
\ No newline at end of file
+    #hi
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Backfill a synthetic population with step history")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--leagues", type=int, default=1000)
+    parser.add_argument("--leagues-per-user", type=int, default=2)
+    parser.add_argument("--years", type=float, default=1.0, help="Years of step history up to --end-date")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="Last day of step history (YYYY-MM-DD), pin it to reproduce a population")
+    parser.add_argument("--seed", type=int, default=POPULATION_SEED)
+    parser.add_argument("--output", choices=["bigquery", "ndjson", "parquet"], default="bigquery")
+    parser.add_argument("--path", default="dummy_population", help="Directory for ndjson/parquet output")
+    parser.add_argument("--steps-only", action="store_true", help="Skip users, leagues and memberships")
+    args = parser.parse_args()
+    
+    end_date = args.end_date
+    population = Population(
+        args.users,
+        args.leagues,
+        start_date=end_date - timedelta(days=int(args.years * 365)),
+        end_date=end_date,
+        leagues_per_user=args.leagues_per_user,
+        seed=args.seed
+    )
+    
+    if args.output == "bigquery":
+        sink = BigQuerySink(client, DATASET_ID)
+    elif args.output == "ndjson":
+        sink = NdjsonSink(args.path)
+    else:
+        sink = ParquetSink(args.path)
+    
+    try:
+        written = write_population(population, sink, end_date, include_entities=not args.steps_only)
+    finally:
+        sink.close()
+    
+    for table, rows in written.items():
+        print(f"Wrote {rows} rows to {table}")
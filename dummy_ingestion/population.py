@@ -0,0 +1,231 @@
+"""
+Vectorised synthetic population for capacity testing
+
+A population is N users spread over M leagues with a daily step history.
+Everything is generated with NumPy one day and one block of users at a time,
+so memory stays bounded by the block size however many users or years are
+requested. Random streams are seeded from (seed, block) and (seed, day,
+block), so the same configuration always produces the same data and a
+single day can be regenerated without replaying the history before it. The
+history's start and end dates are part of the configuration, never read
+from the clock, so a population is the same whichever day it is built on.
+
+Step counts follow a simple but realistic shape: each user has a lognormal
+baseline and their own weekend habit, every day gets multiplicative noise
+and a mild seasonal swing, users only have data from their signup day, and
+some days are missing (the phone never synced) or zero.
+"""
+import json
+import os
+import numpy as np
+from datetime import datetime, timedelta
+
+# Users generated per block. Bounds the size of every array and output chunk
+DEFAULT_BLOCK_USERS = 100000
+
+MEDIAN_DAILY_STEPS = 7000
+BASELINE_SIGMA = 0.45
+DAILY_NOISE_SIGMA = 0.3
+SEASONAL_AMPLITUDE = 0.1
+MISSING_DAY_RATE = 0.04
+ZERO_DAY_RATE = 0.01
+MAX_DAILY_STEPS = 60000
+
+# League sizes follow a Zipf-like curve so a few leagues are very large
+LEAGUE_SIZE_EXPONENT = 0.8
+
+class Population:
+    """Deterministic synthetic users, leagues, memberships and daily steps"""
+
+    def __init__(self, users, leagues, start_date, end_date, leagues_per_user=2, seed=0,
+                 block_users=DEFAULT_BLOCK_USERS):
+        self.users = users
+        self.leagues = leagues
+        self.leagues_per_user = min(leagues_per_user, leagues)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.seed = seed
+        self.block_users = block_users
+
+    def blocks(self):
+        """Yield (start, stop) user index ranges of at most block_users users"""
+        for start in range(0, self.users, self.block_users):
+            yield start, min(start + self.block_users, self.users)
+
+    def user_names(self, start, stop):
+        return np.char.add(
+            np.char.add("dummy", np.char.zfill(np.arange(start, stop).astype(str), 7)),
+            "@example.com"
+        )
+
+    def league_names(self):
+        return np.char.add("Dummy League ", np.char.zfill(np.arange(self.leagues).astype(str), 5))
+
+    def _user_traits(self, block):
+        """Per-user baseline, weekend factor and signup day for one block of users"""
+        start, stop = block
+        rng = np.random.default_rng([self.seed, 0, start])
+        size = stop - start
+
+        baseline = rng.lognormal(np.log(MEDIAN_DAILY_STEPS), BASELINE_SIGMA, size)
+        weekend_factor = np.clip(rng.normal(0.85, 0.15, size), 0.4, 1.4)
+        # Most users already existed at the start, the rest sign up before the end
+        signup_offset = np.where(
+            rng.random(size) < 0.6,
+            0,
+            rng.integers(0, max((self.end_date - self.start_date).days, 1), size)
+        )
+        signup_day = np.datetime64(self.start_date, "D") + signup_offset
+        return baseline, weekend_factor, signup_day
+
+    def user_rows(self):
+        """Yield user_ids columns, one block at a time"""
+        for start, stop in self.blocks():
+            names = self.user_names(start, stop)
+            yield {
+                "user_id": names,
+                "first_name": np.full(stop - start, "Dummy"),
+                "last_name": np.arange(start, stop).astype(str),
+            }
+
+    def league_rows(self):
+        yield {"league_id": self.league_names()}
+
+    def membership_rows(self):
+        """Yield league_memberships columns, one block of users at a time"""
+        ranks = np.arange(1, self.leagues + 1)
+        weights = 1.0 / ranks ** LEAGUE_SIZE_EXPONENT
+        weights /= weights.sum()
+        league_names = self.league_names()
+
+        for start, stop in self.blocks():
+            rng = np.random.default_rng([self.seed, 1, start])
+            size = stop - start
+            picks = rng.choice(self.leagues, size=(size, self.leagues_per_user), p=weights)
+            users = np.repeat(np.arange(start, stop), self.leagues_per_user)
+            pairs = np.unique(np.stack([users, picks.ravel()], axis=1), axis=0)
+            yield {
+                "player_id": self.user_names(start, stop)[pairs[:, 0] - start],
+                "league_id": league_names[pairs[:, 1]],
+            }
+
+    def day_steps(self, day, block, traits=None):
+        """
+        Generate one day of steps for one block of users
+
+        Returns:
+            dict: name, steps and date columns for the users with data that day
+        """
+        start, stop = block
+        baseline, weekend_factor, signup_day = traits or self._user_traits(block)
+        rng = np.random.default_rng([self.seed, 2, day.toordinal(), start])
+        size = stop - start
+
+        steps = baseline * rng.lognormal(0.0, DAILY_NOISE_SIGMA, size)
+        if day.weekday() >= 5:
+            steps *= weekend_factor
+        steps *= 1 + SEASONAL_AMPLITUDE * np.sin(2 * np.pi * (day.timetuple().tm_yday - 80) / 365.25)
+        steps = np.clip(steps, 0, MAX_DAILY_STEPS).astype(np.int32)
+
+        roll = rng.random(size)
+        steps[roll < ZERO_DAY_RATE] = 0
+        present = (roll >= MISSING_DAY_RATE) & (signup_day <= np.datetime64(day, "D"))
+
+        return {
+            "name": self.user_names(start, stop)[present],
+            "steps": steps[present],
+            "date": np.full(int(present.sum()), np.datetime64(day, "D")),
+        }
+
+    def step_rows(self, end_date=None, start_date=None):
+        """Yield step columns for every day from start_date to end_date, a day and block at a time"""
+        end_date = end_date or self.end_date
+        start_date = start_date or self.start_date
+
+        for block in self.blocks():
+            traits = self._user_traits(block)
+            day = start_date
+            while day <= end_date:
+                yield self.day_steps(day, block, traits)
+                day += timedelta(days=1)
+
+def columns_to_json_rows(columns, timestamp=None):
+    """Convert a dict of NumPy columns into JSON-ready row dicts"""
+    values = {}
+    for name, column in columns.items():
+        if np.issubdtype(column.dtype, np.datetime64):
+            values[name] = np.datetime_as_string(column, unit="D").tolist()
+        else:
+            values[name] = column.tolist()
+    if timestamp is not None:
+        values["timestamp"] = [timestamp] * len(next(iter(values.values()), []))
+
+    keys = list(values)
+    return [dict(zip(keys, row)) for row in zip(*values.values())]
+
+class BigQuerySink:
+    """Append column chunks to BigQuery tables with load jobs, which are free unlike streaming inserts"""
+
+    def __init__(self, client, dataset_id, table_ids=None):
+        self.client = client
+        self.dataset_id = dataset_id
+        self.table_ids = table_ids or {}
+
+    def write(self, table, columns, timestamp=None):
+        rows = columns_to_json_rows(columns, timestamp)
+        if rows:
+            table_ref = self.client.dataset(self.dataset_id).table(self.table_ids.get(table, table))
+            self.client.load_table_from_json(rows, table_ref).result()
+        return len(rows)
+
+    def close(self):
+        pass
+
+class NdjsonSink:
+    """Append column chunks to one <table>.ndjson file per table"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+
+    def write(self, table, columns, timestamp=None):
+        if table not in self._files:
+            self._files[table] = open(os.path.join(self.directory, f"{table}.ndjson"), "w")
+        rows = columns_to_json_rows(columns, timestamp)
+        self._files[table].writelines(json.dumps(row) + "\n" for row in rows)
+        return len(rows)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+class ParquetSink:
+    """Append column chunks to one <table>.parquet file per table (needs pyarrow)"""
+
+    def __init__(self, directory):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._pq = pq
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._writers = {}
+
+    def write(self, table, columns, timestamp=None):
+        arrays = {name: self._pa.array(column) for name, column in columns.items()}
+        batch = self._pa.table(arrays)
+        if timestamp is not None:
+            batch = batch.append_column(
+                "timestamp",
+                self._pa.array([datetime.fromisoformat(timestamp)] * batch.num_rows, self._pa.timestamp("us", tz="UTC"))
+            )
+        if table not in self._writers:
+            self._writers[table] = self._pq.ParquetWriter(os.path.join(self.directory, f"{table}.parquet"), batch.schema)
+        self._writers[table].write_table(batch)
+        return batch.num_rows
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
@@ -1,25 +1,73 @@
 import functions_framework
 from google.cloud import bigquery
+import os
 import json
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 
-# Initialize BigQuery client
-client = bigquery.Client()
+# orjson parses request bodies several times faster when it is installed
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+from batcher import MicroBatcher, micro_batching_enabled
+from queues import create_queue
+from table_cache import TableCache, coerce_columns
+from writers import create_writer
+
+# Initialize BigQuery client, or the local stand-in when STEPLOTTO_BACKEND=local
+if os.environ.get("STEPLOTTO_BACKEND") == "local":
+    from local_bigquery.client import LocalClient
+    client = LocalClient()
+else:
+    client = bigquery.Client()
 
 # Configure your BigQuery details
 PROJECT_ID = "my-project-1706650764881"
 DATASET_ID = "step_lotto" 
 TABLE_ID = "user_steps_input"
+FINAL_TABLE_ID = "user_steps"
+
+# Staging table metadata and writer, chosen by INGESTION_WRITER. Created once
+# per instance so warm invocations reuse the schema, connection and stream
+table_cache = TableCache(client, client.dataset(DATASET_ID).table(TABLE_ID))
+writer = create_writer(client, table_cache, PROJECT_ID, DATASET_ID, TABLE_ID)
+
+# With concurrency > 1, pool concurrent requests' rows into shared writes
+if micro_batching_enabled():
+    writer = MicroBatcher(writer)
+
+# Set INGESTION_QUEUE to acknowledge syncs with a 202 and write them from
+# drain_steps_queue instead of inside the request
+queue = create_queue(PROJECT_ID)
 
-def json_to_records(data):
+# Leave headroom under the consumer's 540s function timeout
+DRAIN_MAX_SECONDS = 480
+
+# Rows written more recently than this may still be in the streaming buffer,
+# which DML statements cannot modify, so compaction leaves them for the next run
+COMPACTION_DELAY_MINUTES = 90
+
+@lru_cache(maxsize=1024)
+def date_range(base_date, days):
     """
-    Convert JSON input with steps array to list of records (like DataFrame rows)
+    ISO dates for the given number of days counting back from base_date
     
-    Args:
-        data (dict): Dictionary with name, steps array, and date
+    Most syncs on a given day cover the same range, so the strings are built
+    once and shared by every request that asks for that range.
+    """
+    base = datetime.strptime(base_date, '%Y-%m-%d').toordinal()
+    return tuple(date.fromordinal(base - i).isoformat() for i in range(days))
+
+def parse_payload(data):
+    """
+    Validate a payload and pull out its normalized name, step counts and dates
     
     Returns:
-        list: List of dictionaries representing rows
+        tuple: (name, list of step counts, tuple of ISO dates)
     """
     
     # Extract fields
@@ -34,23 +82,129 @@ def json_to_records(data):
     # Normalize name to lowercase
     normalized_name = name.strip().lower()
     
-    # Create list of records
-    records = []
-    base_date_obj = datetime.strptime(base_date, '%Y-%m-%d')
+    # Step counts go backwards one day at a time from base_date
+    steps = [int(step_count) for step_count in steps_array]
+    return normalized_name, steps, date_range(base_date, len(steps))
+
+def ingestion_timestamp():
+    return datetime.utcnow().isoformat()
+
+def json_to_columns(data, timestamp=None):
+    """
+    Convert JSON input with steps array to columns, one list per staging column
     
-    for i, step_count in enumerate(steps_array):
-        # Calculate the date for each step count (going backwards from base_date)
-        current_date = base_date_obj - timedelta(days=i)
-        
-        record = {
-            'name': normalized_name,
-            'steps': int(step_count),
-            'date': current_date.strftime('%Y-%m-%d'),
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        records.append(record)
+    The name and timestamp are the same on every row, so validating the
+    columns converts each of them once instead of once per row.
+    
+    Args:
+        data (dict): Dictionary with name, steps array, and date
+        timestamp (str): Ingestion timestamp shared by every row, defaults to now
+    
+    Returns:
+        dict: Column name -> list of values
+    """
+    name, steps, dates = parse_payload(data)
+    timestamp = timestamp or ingestion_timestamp()
+    
+    return {
+        'name': [name] * len(steps),
+        'steps': steps,
+        'date': list(dates),
+        'timestamp': [timestamp] * len(steps),
+    }
+
+def columns_to_records(columns):
+    """Turn columns into the row dicts the writers take"""
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def json_to_records(data, timestamp=None):
+    """
+    Convert JSON input with steps array to list of records (like DataFrame rows)
+    
+    Returns:
+        list: List of dictionaries representing rows
+    """
+    return columns_to_records(json_to_columns(data, timestamp))
+
+def record_insert_id(record):
+    """
+    Build the BigQuery insert ID for a record
+    
+    Retried or resent rows with the same values share an insert ID, so
+    BigQuery's best-effort deduplication drops them at the streaming layer.
+    A changed step count for the same day gets a new ID and is resolved by
+    compaction instead.
+    """
+    return f"{record['name']}|{record['date']}|{record['steps']}"
+
+def write_rows(rows):
+    """
+    Write validated rows to the staging table, keyed by their insert IDs
+    
+    Each row is stamped with ingested_at just before it is written. Its
+    timestamp is the sync time, which can be long before the write for
+    retried or queued syncs, so compaction goes by ingested_at instead.
+    """
+    ingested_at = ingestion_timestamp()
+    for row in rows:
+        row['ingested_at'] = ingested_at
+    return writer.write(rows, row_ids=[record_insert_id(row) for row in rows])
+
+def validated_records(data, timestamp=None):
+    """
+    Build a payload's rows, validated and coerced against the cached staging table schema
     
-    return records
+    Rows are validated as columns, which is several times faster than
+    checking every row on its own for long backfills.
+    """
+    columns = coerce_columns(json_to_columns(data, timestamp), table_cache.get().schema)
+    return columns_to_records(columns)
+
+def parse_batch_body(body):
+    """
+    Split a batch request body into individual payloads
+    
+    Accepts either a JSON array of payload objects or NDJSON (one payload
+    object per line). A malformed item does not fail the whole batch, it is
+    reported against its own index instead.
+    
+    Args:
+        body (str): Raw request body
+    
+    Returns:
+        list: List of (payload, error) tuples, one per item in the batch
+    """
+    body = body.strip()
+    if not body:
+        return []
+    
+    if body.startswith('['):
+        # JSON array - a syntax error here means we cannot find item boundaries
+        try:
+            payloads = loads(body)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON array: {str(e)}')
+    else:
+        # NDJSON - each line is parsed on its own so one bad line only fails itself
+        payloads = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                payloads.append(loads(line))
+            except json.JSONDecodeError as e:
+                payloads.append(ValueError(f'Invalid JSON: {str(e)}'))
+    
+    items = []
+    for payload in payloads:
+        if isinstance(payload, ValueError):
+            items.append((None, str(payload)))
+        elif not isinstance(payload, dict):
+            items.append((None, 'Each item must be a JSON object with name, steps and date'))
+        else:
+            items.append((payload, None))
+    
+    return items
 
 @functions_framework.http
 def insert_to_bigquery(request):
@@ -74,19 +228,21 @@ def insert_to_bigquery(request):
     try:
         # Parse the JSON data from the request
         if request.is_json:
-            data = request.get_json()
+            data = loads(request.get_data())
         else:
             return ('Invalid JSON', 400, headers)
         
         # Convert JSON to records using the DataFrame logic
-        rows_to_insert = json_to_records(data)
+        rows_to_insert = validated_records(data)
         
-        # Get table reference
-        table_ref = client.dataset(DATASET_ID).table(TABLE_ID)
-        table = client.get_table(table_ref)
+        # Queue mode: hand the rows to the consumer and acknowledge straight away
+        if queue is not None:
+            queue.publish(rows_to_insert)
+            accepted_name = rows_to_insert[0]['name'] if rows_to_insert else data.get('name')
+            return (f'Accepted {len(rows_to_insert)} rows for {accepted_name}', 202, headers)
         
-        # Insert all rows
-        errors = client.insert_rows_json(table, rows_to_insert)
+        # Insert all rows, keyed so that resends of the same day are deduplicated
+        errors = write_rows(rows_to_insert)
         
         if errors:
             print(f"BigQuery insert errors: {errors}")
@@ -102,4 +258,289 @@ def insert_to_bigquery(request):
         
     except Exception as e:
         print(f"Error: {str(e)}")
-        return (f'Internal server error: {str(e)}', 500, headers)
\ No newline at end of file
+        return (f'Internal server error: {str(e)}', 500, headers)
+
+@functions_framework.http
+def insert_batch_to_bigquery(request):
+    """HTTP Cloud Function to insert many users' step payloads into BigQuery in one request"""
+    
+    # Set CORS headers for the response
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        'Content-Type': 'application/json',
+    }
+    
+    # Handle preflight requests
+    if request.method == 'OPTIONS':
+        return ('', 204, headers)
+    
+    # Only accept POST requests
+    if request.method != 'POST':
+        return (json.dumps({'error': 'Method not allowed'}), 405, headers)
+    
+    try:
+        items = parse_batch_body(request.get_data(as_text=True))
+        if not items:
+            return (json.dumps({'error': 'Empty batch'}), 400, headers)
+        
+        # Validate every payload up front, remembering which item each row came from.
+        # The whole batch arrived at once, so its rows share one ingestion timestamp
+        timestamp = ingestion_timestamp()
+        results = []
+        rows_to_insert = []
+        row_items = []
+        for index, (payload, error) in enumerate(items):
+            records = []
+            if error is None:
+                try:
+                    records = validated_records(payload, timestamp)
+                except (ValueError, TypeError, AttributeError) as e:
+                    error = f'Validation error: {str(e)}'
+            
+            if error is not None:
+                # Resending an invalid payload fails the same way
+                results.append({'index': index, 'status': 'error', 'error': error, 'retryable': False})
+                continue
+            
+            results.append({'index': index, 'status': 'ok', 'name': records[0]['name'], 'rows': len(records)})
+            rows_to_insert.extend(records)
+            row_items.extend([index] * len(records))
+        
+        # Several payloads in one batch can cover the same user-day (e.g. two
+        # syncs from one phone), so keep only the last copy of each
+        latest_rows = {}
+        for row_index, row in enumerate(rows_to_insert):
+            latest_rows.pop((row['name'], row['date']), None)
+            latest_rows[(row['name'], row['date'])] = row_index
+        row_items = [row_items[row_index] for row_index in latest_rows.values()]
+        rows_to_insert = [rows_to_insert[row_index] for row_index in latest_rows.values()]
+        
+        # Send all valid rows in as few inserts as possible
+        insert_errors = []
+        if rows_to_insert:
+            insert_errors = write_rows(rows_to_insert)
+            
+            if insert_errors:
+                print(f"BigQuery insert errors: {insert_errors}")
+            for error in insert_errors:
+                result = results[row_items[error['index']]]
+                # A row BigQuery rejected as invalid fails again on retry;
+                # anything else (an outage, a stopped row) may go through
+                retryable = result.get('retryable', True) and not is_rejected_row(error)
+                result.update({
+                    'status': 'error',
+                    'error': f"Error inserting data: {error['errors']}",
+                    'retryable': retryable,
+                })
+        
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        failed = len(results) - succeeded
+        retryable = sum(1 for result in results if result.get('retryable'))
+        inserted_rows = len(rows_to_insert) - len({error['index'] for error in insert_errors})
+        
+        if failed == 0:
+            status = 200
+        elif succeeded == 0 and retryable == failed:
+            # Nothing was written because the write failed, so let the client retry it all
+            status = 500
+        elif succeeded == 0 and retryable == 0:
+            status = 400
+        else:
+            # Mixed outcomes: each failed item says whether resending it can help
+            status = 207
+        
+        response = {
+            'succeeded': succeeded,
+            'failed': failed,
+            'retryable': retryable,
+            'inserted_rows': inserted_rows,
+            'results': results,
+        }
+        return (json.dumps(response), status, headers)
+        
+    except ValueError as ve:
+        print(f"Validation error: {str(ve)}")
+        return (json.dumps({'error': f'Validation error: {str(ve)}'}), 400, headers)
+        
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return (json.dumps({'error': f'Internal server error: {str(e)}'}), 500, headers)
+
+def is_rejected_row(error):
+    """Whether BigQuery rejected a row as invalid, which fails the same way on every redelivery"""
+    return all(detail.get('reason') == 'invalid' for detail in error['errors'])
+
+def drain_queue(max_seconds=DRAIN_MAX_SECONDS):
+    """
+    Write queued rows to the staging table in large batches
+    
+    Each pull's messages are written together. Messages whose rows were all
+    written are acked. A message with a row BigQuery rejected as invalid is
+    poison: it is logged and acked, since redelivering it cannot help. Any
+    other failure is nacked for redelivery and draining stops there, so a
+    BigQuery outage cannot spin until the timeout; Pub/Sub moves a message
+    to the dead-letter topic after MAX_DELIVERY_ATTEMPTS deliveries.
+    
+    Only one drain may run at a time, which the deployment enforces with
+    max-instances=1 (see cloudbuild.yaml).
+    
+    Returns:
+        tuple: (messages acked, rows written)
+    """
+    started = time.monotonic()
+    acked_messages = written_rows = 0
+    
+    while time.monotonic() - started < max_seconds:
+        messages = queue.pull()
+        if not messages:
+            break
+        
+        # Remember which message each row came from
+        rows = []
+        row_messages = []
+        for message_index, (_, message_rows) in enumerate(messages):
+            rows.extend(message_rows)
+            row_messages.extend([message_index] * len(message_rows))
+        
+        try:
+            errors = write_rows(rows)
+        except Exception:
+            queue.nack([ack_id for ack_id, _ in messages])
+            raise
+        
+        if errors:
+            print(f"BigQuery insert errors: {errors}")
+        poison = {row_messages[error['index']] for error in errors if is_rejected_row(error)}
+        failed = {row_messages[error['index']] for error in errors} - poison
+        for index in sorted(poison):
+            print(f"Dropping queued sync with rejected rows: {messages[index][1]}")
+        queue.nack([messages[index][0] for index in sorted(failed)])
+        queue.ack([ack_id for index, (ack_id, _) in enumerate(messages) if index not in failed])
+        
+        acked_messages += len(messages) - len(failed)
+        written_rows += len(rows) - len({error['index'] for error in errors})
+        if failed:
+            break
+    
+    return acked_messages, written_rows
+
+@functions_framework.cloud_event
+def drain_steps_queue(cloud_event):
+    """Cloud Function triggered by Cloud Scheduler to write queued step rows into BigQuery"""
+    
+    try:
+        if queue is None:
+            raise ValueError("INGESTION_QUEUE is not set")
+        
+        acked_messages, written_rows = drain_queue()
+        
+        print(f"Drained {acked_messages} queued syncs: {written_rows} rows written")
+        return f"Wrote {written_rows} rows"
+        
+    except Exception as e:
+        print(f"Error draining step queue: {str(e)}")
+        raise e
+
+def compact_staging_rows(cutoff):
+    """
+    Merge staged rows into the final steps table so each user-day exists once
+    
+    The newest staged row for each (name, date) wins. Staged rows that have
+    been merged are then removed so the staging table stays small. Rows are
+    picked by when they were written (ingested_at), not their sync time, so
+    a late-delivered sync is left alone until it has settled, and the MERGE
+    and DELETE run in one transaction so both act on the same snapshot of
+    staging and nothing is deleted without being merged. Re-running with the
+    same cutoff is harmless because the MERGE only overwrites a day with a
+    newer reading.
+    
+    Every row the MERGE inserts or updates is stamped with compacted_at,
+    which the rollups use as their watermark. A reading that is compacted
+    late still gets a compacted_at after the last rollup, whatever its sync
+    time. Compactions run one at a time from the scheduler, so compacted_at
+    only moves forward.
+    
+    Args:
+        cutoff (datetime): Only staged rows written at or before this time are compacted
+    
+    Returns:
+        int: Number of staged rows compacted
+    """
+    staging_table = f"`{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`"
+    final_table = f"`{PROJECT_ID}.{DATASET_ID}.{FINAL_TABLE_ID}`"
+    
+    # Rows staged before ingested_at existed fall back to their sync time
+    settled = "COALESCE(ingested_at, timestamp) <= @cutoff"
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("cutoff", "TIMESTAMP", cutoff)
+        ]
+    )
+    
+    # Find the oldest staged day so the MERGE only touches recent partitions
+    # of the final table instead of scanning its whole history
+    first_day_query = f"""
+    SELECT MIN(date) AS first_day, COUNT(*) AS staged_rows
+    FROM {staging_table}
+    WHERE {settled}
+    """
+    first_day = None
+    staged_rows = 0
+    for row in client.query(first_day_query, job_config=job_config).result():
+        first_day = row.first_day
+        staged_rows = row.staged_rows
+    if first_day is None:
+        return 0
+    
+    compact_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("cutoff", "TIMESTAMP", cutoff),
+            bigquery.ScalarQueryParameter("first_day", "DATE", first_day)
+        ]
+    )
+    
+    # Settled rows are past the streaming buffer, so the DELETE never has to
+    # touch rows that DML cannot modify yet
+    compact_query = f"""
+    BEGIN TRANSACTION;
+    
+    MERGE {final_table} t
+    USING (
+        SELECT name, steps, date, timestamp
+        FROM {staging_table}
+        WHERE {settled}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY name, date ORDER BY timestamp DESC) = 1
+    ) s
+    ON t.name = s.name AND t.date = s.date AND t.date >= @first_day
+    WHEN MATCHED AND (t.timestamp IS NULL OR s.timestamp > t.timestamp) THEN
+        UPDATE SET steps = s.steps, timestamp = s.timestamp, compacted_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (name, steps, date, timestamp, compacted_at)
+        VALUES (s.name, s.steps, s.date, s.timestamp, CURRENT_TIMESTAMP());
+    
+    DELETE FROM {staging_table}
+    WHERE {settled};
+    
+    COMMIT TRANSACTION;
+    """
+    client.query(compact_query, job_config=compact_config).result()
+    
+    return staged_rows
+
+@functions_framework.cloud_event
+def compact_user_steps(cloud_event):
+    """Cloud Function triggered by Cloud Scheduler to compact staged step rows into user_steps"""
+    
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=COMPACTION_DELAY_MINUTES)
+        compacted_rows = compact_staging_rows(cutoff)
+        
+        print(f"Compacted staged rows written up to {cutoff.isoformat()}: {compacted_rows} rows")
+        return f"Compacted {compacted_rows} rows"
+        
+    except Exception as e:
+        print(f"Error compacting step data: {str(e)}")
+        raise e
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Queues between the ingestion HTTP front and the BigQuery writer
+
+When INGESTION_QUEUE is set, insert_to_bigquery validates a payload,
+publishes its rows as one message and answers 202 straight away. The
+scheduled drain_steps_queue consumer pulls messages in large batches and
+writes them to the staging table. BigQuery latency then never reaches the
+phone. Both queues share publish / pull / ack / nack:
+
+    pubsub  Google Cloud Pub/Sub topic and pull subscription
+    local   in-process queue, for tests and running offline
+
+A message that is nacked MAX_DELIVERY_ATTEMPTS times is moved to a
+dead-letter topic (or the local queue's dead_letters) instead of being
+redelivered forever.
+"""
+import json
+import os
+import threading
+from collections import deque
+from itertools import count
+
+PUBSUB_TOPIC = os.environ.get("INGESTION_TOPIC", "ingest-steps-topic")
+PUBSUB_SUBSCRIPTION = os.environ.get("INGESTION_SUBSCRIPTION", "ingest-steps-sub")
+
+# Pub/Sub returns at most 1000 messages per pull
+MAX_MESSAGES_PER_PULL = 1000
+
+# Must match the subscription's --max-delivery-attempts in cloudbuild.yaml
+MAX_DELIVERY_ATTEMPTS = 5
+
+class PubSubQueue:
+    """Publish to a Pub/Sub topic and drain it through a pull subscription"""
+
+    def __init__(self, project_id, topic=PUBSUB_TOPIC, subscription=PUBSUB_SUBSCRIPTION):
+        from google.cloud import pubsub_v1
+
+        self.publisher = pubsub_v1.PublisherClient()
+        self.subscriber = pubsub_v1.SubscriberClient()
+        self.topic_path = self.publisher.topic_path(project_id, topic)
+        self.subscription_path = self.subscriber.subscription_path(project_id, subscription)
+
+    def publish(self, rows):
+        """Publish rows as one message, returning once Pub/Sub has stored it"""
+        return self.publisher.publish(self.topic_path, json.dumps(rows).encode("utf-8")).result()
+
+    def pull(self, max_messages=MAX_MESSAGES_PER_PULL):
+        """
+        Pull up to max_messages messages
+
+        Messages that are not valid JSON can never be written, so they are
+        logged and acked here rather than returned.
+
+        Returns:
+            list: (ack_id, rows) tuples, empty when the subscription is drained
+        """
+        response = self.subscriber.pull(
+            request={"subscription": self.subscription_path, "max_messages": max_messages},
+            timeout=30
+        )
+        messages = []
+        undecodable = []
+        for received in response.received_messages:
+            try:
+                messages.append((received.ack_id, json.loads(received.message.data)))
+            except ValueError as e:
+                print(f"Dropping undecodable queued message {received.message.message_id}: {str(e)}")
+                undecodable.append(received.ack_id)
+        if undecodable:
+            self.ack(undecodable)
+        return messages
+
+    def ack(self, ack_ids):
+        for start in range(0, len(ack_ids), MAX_MESSAGES_PER_PULL):
+            self.subscriber.acknowledge(request={
+                "subscription": self.subscription_path,
+                "ack_ids": ack_ids[start:start + MAX_MESSAGES_PER_PULL],
+            })
+
+    def nack(self, ack_ids):
+        """Make messages available for redelivery straight away"""
+        for start in range(0, len(ack_ids), MAX_MESSAGES_PER_PULL):
+            self.subscriber.modify_ack_deadline(request={
+                "subscription": self.subscription_path,
+                "ack_ids": ack_ids[start:start + MAX_MESSAGES_PER_PULL],
+                "ack_deadline_seconds": 0,
+            })
+
+class LocalQueue:
+    """
+    In-process stand-in for Pub/Sub with the same at-least-once behaviour
+
+    Pulled messages stay in flight until they are acked; nacked messages go
+    back to the front of the queue, or to dead_letters once they have been
+    delivered max_delivery_attempts times.
+    """
+
+    def __init__(self, max_delivery_attempts=MAX_DELIVERY_ATTEMPTS):
+        self.max_delivery_attempts = max_delivery_attempts
+        self.dead_letters = []
+        self._messages = deque()
+        self._in_flight = {}
+        self._ack_ids = count()
+        self._lock = threading.Lock()
+
+    def publish(self, rows):
+        with self._lock:
+            self._messages.append((json.dumps(rows), 0))
+        return None
+
+    def pull(self, max_messages=MAX_MESSAGES_PER_PULL):
+        with self._lock:
+            pulled = []
+            while self._messages and len(pulled) < max_messages:
+                ack_id = str(next(self._ack_ids))
+                data, deliveries = self._messages.popleft()
+                self._in_flight[ack_id] = (data, deliveries + 1)
+                pulled.append((ack_id, json.loads(data)))
+            return pulled
+
+    def ack(self, ack_ids):
+        with self._lock:
+            for ack_id in ack_ids:
+                self._in_flight.pop(ack_id, None)
+
+    def nack(self, ack_ids):
+        with self._lock:
+            for ack_id in reversed(ack_ids):
+                if ack_id not in self._in_flight:
+                    continue
+                data, deliveries = self._in_flight.pop(ack_id)
+                if deliveries >= self.max_delivery_attempts:
+                    self.dead_letters.append(data)
+                else:
+                    self._messages.appendleft((data, deliveries))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._messages) + len(self._in_flight)
+
+def create_queue(project_id):
+    """Create the queue selected by INGESTION_QUEUE, or None to write synchronously"""
+    kind = os.environ.get("INGESTION_QUEUE")
+
+    if not kind:
+        return None
+    if kind == "pubsub":
+        return PubSubQueue(project_id)
+    if kind == "local":
+        return LocalQueue()
+    raise ValueError(f"Unknown INGESTION_QUEUE: {kind}")
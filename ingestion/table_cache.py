@@ -0,0 +1,174 @@
+"""
+Warm-instance cache of the staging table's metadata
+
+The schema of user_steps_input never changes between requests, so it is
+fetched once per instance and reused until it is older than
+SCHEMA_TTL_SECONDS, or until a write fails in a way that suggests the
+schema moved underneath us. Rows are validated and coerced against the
+cached schema before they are sent, so malformed rows fail fast with a 400
+instead of costing a write call. A payload's rows are validated a column at
+a time, converting each distinct value once.
+"""
+import threading
+import time
+from datetime import date, datetime
+from functools import lru_cache
+
+SCHEMA_TTL_SECONDS = 600
+
+class TableCache:
+    """Thread-safe cache of one table handle, refreshed after a TTL or on demand"""
+
+    def __init__(self, client, table_ref, ttl=SCHEMA_TTL_SECONDS):
+        self.client = client
+        self.table_ref = table_ref
+        self.ttl = ttl
+        self._table = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._table is None or time.monotonic() - self._fetched_at > self.ttl:
+                self._table = self.client.get_table(self.table_ref)
+                self._fetched_at = time.monotonic()
+            return self._table
+
+    def invalidate(self):
+        """Force the next get() to fetch the table again"""
+        with self._lock:
+            self._table = None
+
+def coerce_value(value, field_type):
+    if field_type == "STRING":
+        if isinstance(value, (dict, list)):
+            raise ValueError("expected a string")
+        return str(value)
+    if field_type in ("INTEGER", "INT64"):
+        if isinstance(value, bool):
+            raise ValueError("expected an integer")
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError("expected a whole number")
+        return int(value)
+    if field_type in ("FLOAT", "FLOAT64"):
+        return float(value)
+    if field_type in ("BOOLEAN", "BOOL"):
+        if not isinstance(value, bool):
+            raise ValueError("expected true or false")
+        return value
+    if field_type == "DATE":
+        if isinstance(value, date):
+            return value.isoformat()
+        return date.fromisoformat(value).isoformat()
+    if field_type == "TIMESTAMP":
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return datetime.fromisoformat(value).isoformat()
+    return value
+
+def coerce_row(row, schema):
+    """
+    Validate a row against a table schema and coerce its values to the column types
+
+    Args:
+        row (dict): Row to validate
+        schema (list): The table's SchemaFields
+
+    Returns:
+        dict: The coerced row
+
+    Raises:
+        ValueError: If a column is unknown, a required column is missing, or a
+            value cannot be converted to its column's type
+    """
+    fields = {field.name: field for field in schema}
+    unknown = set(row) - set(fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    coerced = {}
+    for name, field in fields.items():
+        value = row.get(name)
+        if value is None:
+            if field.mode == "REQUIRED":
+                raise ValueError(f"Missing required field: {name}")
+            continue
+        try:
+            coerced[name] = coerce_value(value, field.field_type)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid value for {name} ({field.field_type}): {value!r} - {str(e)}")
+    return coerced
+
+@lru_cache(maxsize=8192)
+def coerce_temporal(value, field_type):
+    """coerce_value for DATE and TIMESTAMP strings, which repeat across requests"""
+    return coerce_value(value, field_type)
+
+def coerce_column(name, values, field_type):
+    """
+    Coerce one column's values, converting each distinct value once
+
+    A payload's name and timestamp repeat on every row, and its dates repeat
+    across requests, so most values are converted once rather than per row.
+    """
+    converted = {}
+    coerced = []
+    for value in values:
+        # 1, 1.0 and True are equal but coerce differently, so the type is part of the key
+        key = (type(value), value)
+        try:
+            coerced.append(converted[key])
+            continue
+        except KeyError:
+            pass
+        except TypeError:
+            # Lists and dicts cannot be keys, and are never valid values
+            key = None
+
+        if value is None:
+            result = None
+        else:
+            try:
+                if type(value) is str and field_type in ("DATE", "TIMESTAMP"):
+                    result = coerce_temporal(value, field_type)
+                else:
+                    result = coerce_value(value, field_type)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid value for {name} ({field_type}): {value!r} - {str(e)}")
+        if key is not None:
+            converted[key] = result
+        coerced.append(result)
+    return coerced
+
+def coerce_columns(columns, schema):
+    """
+    Validate columns against a table schema and coerce their values to the column types
+
+    The column-wise counterpart of coerce_row, for a payload's rows built as
+    columns. Missing optional columns are left out; None values in an
+    optional column stay None.
+
+    Args:
+        columns (dict): Column name -> list of values, all the same length
+        schema (list): The table's SchemaFields
+
+    Returns:
+        dict: The coerced columns
+
+    Raises:
+        ValueError: If a column is unknown, a required value is missing, or a
+            value cannot be converted to its column's type
+    """
+    fields = {field.name: field for field in schema}
+    unknown = set(columns) - set(fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    coerced = {}
+    for name, field in fields.items():
+        values = columns.get(name)
+        if field.mode == "REQUIRED" and (values is None or None in values):
+            raise ValueError(f"Missing required field: {name}")
+        if values is not None:
+            coerced[name] = coerce_column(name, values, field.field_type)
+    return coerced
@@ -0,0 +1,234 @@
+"""
+Row writers for the ingestion functions
+
+All writers share one interface, write(rows, row_ids=None), which returns a
+list of per-row errors shaped like insert_rows_json's ({'index': ...,
+'errors': [...]}) so callers can report failures against the payload that
+produced them. Only insert_all uses row_ids; the Storage Write API has no
+insert IDs. Delivery into staging is at-least-once either way, and
+compaction keeps one row per (name, date), so a resent row never reaches
+user_steps twice. create_writer() picks the implementation from the
+INGESTION_WRITER environment variable:
+
+    storage_write  BigQuery Storage Write API (default on GCP)
+    insert_all     legacy insert_rows_json streaming inserts (default locally)
+    memory         keeps rows in a list, for tests and dry runs
+"""
+import os
+import threading
+from datetime import date, datetime, timezone
+
+# BigQuery caps a streaming insert at 10MB per request, so large batches are
+# sent in chunks of at most this many rows
+MAX_ROWS_PER_INSERT = 5000
+
+# AppendRows requests are also capped at 10MB. Step rows serialise to well
+# under 100 bytes, so this leaves plenty of headroom
+MAX_ROWS_PER_APPEND = 50000
+
+# Attempts at one append, reconnecting in between, before giving up
+MAX_APPEND_ATTEMPTS = 3
+
+EPOCH = date(1970, 1, 1)
+EPOCH_TIMESTAMP = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+class InsertAllWriter:
+    """Legacy streaming inserts through client.insert_rows_json"""
+
+    def __init__(self, client, table_cache):
+        self.client = client
+        self.table_cache = table_cache
+
+    def write(self, rows, row_ids=None):
+        """
+        Insert rows, splitting them into request-sized chunks
+
+        Invalid rows are skipped rather than failing their whole chunk so that
+        one bad payload cannot block the rest of a batch. The table handle
+        comes from the warm-instance cache, so this is one call per chunk.
+        """
+        table = self.table_cache.get()
+        errors = []
+        for start in range(0, len(rows), MAX_ROWS_PER_INSERT):
+            chunk = rows[start:start + MAX_ROWS_PER_INSERT]
+            chunk_errors = self.client.insert_rows_json(
+                table,
+                chunk,
+                row_ids=row_ids[start:start + MAX_ROWS_PER_INSERT] if row_ids else None,
+                skip_invalid_rows=True
+            )
+            for error in chunk_errors:
+                errors.append({**error, 'index': error['index'] + start})
+        if errors:
+            # Rejected rows may mean the schema changed, so refetch it next time
+            self.table_cache.invalidate()
+        return errors
+
+class MemoryWriter:
+    """In-memory writer that records every row it is given"""
+
+    def __init__(self):
+        self.rows = []
+        self.writes = 0
+
+    def write(self, rows, row_ids=None):
+        self.rows.extend(rows)
+        self.writes += 1
+        return []
+
+def step_row_descriptor():
+    """
+    Protobuf descriptor matching the user_steps_input schema
+
+    The Storage Write API maps DATE to int32 days since the epoch and
+    TIMESTAMP to int64 microseconds since the epoch.
+    """
+    from google.protobuf import descriptor_pb2
+
+    descriptor = descriptor_pb2.DescriptorProto(name="StepRow")
+    for number, (name, field_type) in enumerate([
+        ("name", descriptor_pb2.FieldDescriptorProto.TYPE_STRING),
+        ("steps", descriptor_pb2.FieldDescriptorProto.TYPE_INT64),
+        ("date", descriptor_pb2.FieldDescriptorProto.TYPE_INT32),
+        ("timestamp", descriptor_pb2.FieldDescriptorProto.TYPE_INT64),
+        ("ingested_at", descriptor_pb2.FieldDescriptorProto.TYPE_INT64),
+    ], start=1):
+        descriptor.field.add(
+            name=name,
+            number=number,
+            type=field_type,
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+        )
+    return descriptor
+
+def step_row_class(descriptor):
+    """Build a message class from a DescriptorProto without any generated code"""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(descriptor_pb2.FileDescriptorProto(name="step_row.proto", message_type=[descriptor]))
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName(descriptor.name))
+
+def timestamp_micros(value):
+    """Microseconds since the epoch, in integer arithmetic so no microsecond is rounded away"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    elapsed = parsed - EPOCH_TIMESTAMP
+    return (elapsed.days * 86400 + elapsed.seconds) * 1_000_000 + elapsed.microseconds
+
+class StorageWriteApiWriter:
+    """
+    Writes through the table's Storage Write API default stream
+
+    Rows are serialised to protobuf and appended to the _default stream,
+    which commits them as they arrive and needs no stream to be created or
+    finalized, so warm instances share it without leaving open streams
+    behind. The connection is reused across warm invocations.
+
+    The default stream takes no offsets, so a failed append is retried up
+    to MAX_APPEND_ATTEMPTS times, reconnecting in between, and an attempt
+    that landed before failing is written again. If every attempt fails,
+    every row in the chunk is reported as failed and the caller's resend may
+    duplicate rows in staging too. Compaction's (name, date) MERGE resolves
+    both: this writer is at-least-once, not exactly-once.
+    """
+
+    def __init__(self, project_id, dataset_id, table_id, table_cache=None):
+        from google.cloud import bigquery_storage_v1
+
+        self.write_client = bigquery_storage_v1.BigQueryWriteClient()
+        self.stream_name = f"{self.write_client.table_path(project_id, dataset_id, table_id)}/streams/_default"
+        self.descriptor = step_row_descriptor()
+        self.row_class = step_row_class(self.descriptor)
+        self._connection = None
+        self.table_cache = table_cache
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open a connection to the default stream"""
+        from google.cloud.bigquery_storage_v1 import types, writer
+
+        request_template = types.AppendRowsRequest(
+            write_stream=self.stream_name,
+            proto_rows=types.AppendRowsRequest.ProtoData(
+                writer_schema=types.ProtoSchema(proto_descriptor=self.descriptor)
+            )
+        )
+        self._connection = writer.AppendRowsStream(self.write_client, request_template)
+
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception as e:
+                print(f"Error closing write stream connection: {str(e)}")
+        self._connection = None
+
+    def serialize(self, row):
+        return self.row_class(
+            name=row['name'],
+            steps=int(row['steps']),
+            date=(date.fromisoformat(row['date']) - EPOCH).days,
+            timestamp=timestamp_micros(row['timestamp']),
+            ingested_at=timestamp_micros(row['ingested_at'])
+        ).SerializeToString()
+
+    def _append(self, serialized_rows):
+        """Append one chunk, retrying on a fresh connection; raises the last error"""
+        from google.cloud.bigquery_storage_v1 import types
+
+        request = types.AppendRowsRequest(
+            proto_rows=types.AppendRowsRequest.ProtoData(
+                rows=types.ProtoRows(serialized_rows=serialized_rows)
+            )
+        )
+
+        for attempt in range(MAX_APPEND_ATTEMPTS):
+            try:
+                if self._connection is None:
+                    self._connect()
+                self._connection.send(request).result()
+                return
+            except Exception as e:
+                print(f"Storage Write API append attempt {attempt + 1} failed: {str(e)}")
+                self._disconnect()
+                if attempt == MAX_APPEND_ATTEMPTS - 1:
+                    raise
+
+    def write(self, rows, row_ids=None):
+        """
+        Append rows in chunks of MAX_ROWS_PER_APPEND
+
+        row_ids is ignored: the Storage Write API has no insert IDs, so the
+        best-effort insert-ID dedup of streaming inserts does not apply here
+        and a resent row is only collapsed by compaction.
+        """
+        errors = []
+        with self._lock:
+            for start in range(0, len(rows), MAX_ROWS_PER_APPEND):
+                chunk = rows[start:start + MAX_ROWS_PER_APPEND]
+                try:
+                    self._append([self.serialize(row) for row in chunk])
+                except Exception as e:
+                    print(f"Storage Write API append failed: {str(e)}")
+                    if self.table_cache is not None:
+                        self.table_cache.invalidate()
+                    errors.extend(
+                        {'index': start + index, 'errors': [{'reason': 'appendFailed', 'message': str(e)}]}
+                        for index in range(len(chunk))
+                    )
+        return errors
+
+def create_writer(client, table_cache, project_id, dataset_id, table_id):
+    """Create the writer selected by INGESTION_WRITER"""
+    default = "insert_all" if os.environ.get("STEPLOTTO_BACKEND") == "local" else "storage_write"
+    kind = os.environ.get("INGESTION_WRITER", default)
+
+    if kind == "storage_write":
+        return StorageWriteApiWriter(project_id, dataset_id, table_id, table_cache)
+    if kind == "insert_all":
+        return InsertAllWriter(client, table_cache)
+    if kind == "memory":
+        return MemoryWriter()
+    raise ValueError(f"Unknown INGESTION_WRITER: {kind}")
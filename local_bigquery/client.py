@@ -0,0 +1,493 @@
+"""
+Local stand-in for google.cloud.bigquery.Client, backed by DuckDB
+
+Every part of Step Lotto talks to storage through the same small slice of
+the BigQuery client: client.query() with named scalar or array parameters,
+insert_rows_json(), get_table(), create_table(), load_table_from_json() and
+client.dataset(...).table(...). LocalClient implements exactly that slice on
+an embedded DuckDB database so the app, the Cloud Functions and the
+benchmarks can run with no GCP project.
+
+Select it by setting STEPLOTTO_BACKEND=local (and optionally
+STEPLOTTO_LOCAL_DB to a database file path, default
+.local/steplotto.duckdb) with the repository root on PYTHONPATH.
+
+Queries are written in BigQuery SQL and translated to DuckDB with sqlglot.
+Projects are dropped, datasets become DuckDB schemas, and @name parameters
+become $name prepared-statement parameters, so nothing is interpolated
+into the SQL text. Multi-statement queries run in order on one DuckDB
+cursor, so BEGIN TRANSACTION ... COMMIT TRANSACTION and temp tables work;
+procedural BigQuery scripting (DECLARE, IF, BEGIN ... END) is not
+supported.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+import duckdb
+import pyarrow as pa
+import sqlglot
+from sqlglot import exp
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from google.cloud import bigquery
+
+BACKEND_ENV_VAR = "STEPLOTTO_BACKEND"
+DATABASE_ENV_VAR = "STEPLOTTO_LOCAL_DB"
+DEFAULT_DATABASE = os.path.join(".local", "steplotto.duckdb")
+DEFAULT_PROJECT = "local-project"
+
+# BigQuery drops repeated insert IDs seen within roughly a minute
+INSERT_ID_WINDOW_SECONDS = 60
+
+# Schema where partitioning and clustering options are remembered, since
+# DuckDB has no equivalent and get_table() should report what was created
+META_SCHEMA = "_local_bigquery"
+
+BIGQUERY_TO_DUCKDB_TYPES = {
+    "STRING": "VARCHAR",
+    "INTEGER": "BIGINT",
+    "INT64": "BIGINT",
+    "FLOAT": "DOUBLE",
+    "FLOAT64": "DOUBLE",
+    "NUMERIC": "DECIMAL(38, 9)",
+    "BOOLEAN": "BOOLEAN",
+    "BOOL": "BOOLEAN",
+    "DATE": "DATE",
+    "DATETIME": "TIMESTAMP",
+    "TIMESTAMP": "TIMESTAMPTZ",
+    "BYTES": "BLOB",
+}
+
+DUCKDB_TO_BIGQUERY_TYPES = {
+    "VARCHAR": "STRING",
+    "BIGINT": "INTEGER",
+    "INTEGER": "INTEGER",
+    "DOUBLE": "FLOAT",
+    "BOOLEAN": "BOOLEAN",
+    "DATE": "DATE",
+    "TIMESTAMP": "DATETIME",
+    "TIMESTAMP WITH TIME ZONE": "TIMESTAMP",
+    "BLOB": "BYTES",
+}
+
+DML_STATEMENTS = (exp.Insert, exp.Update, exp.Delete, exp.Merge)
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp the way BigQuery does, treating naive values as UTC"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+# Converters used to validate streamed JSON rows against a table schema
+FIELD_CONVERTERS = {
+    "STRING": str,
+    "INTEGER": int,
+    "INT64": int,
+    "FLOAT": float,
+    "FLOAT64": float,
+    "BOOLEAN": bool,
+    "BOOL": bool,
+    "DATE": lambda value: value if isinstance(value, date) else date.fromisoformat(str(value)),
+    "DATETIME": lambda value: value if isinstance(value, datetime) else datetime.fromisoformat(str(value)),
+    "TIMESTAMP": parse_timestamp,
+}
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """
+    Translate a BigQuery SQL string into DuckDB statements
+
+    Returns:
+        tuple: One (duckdb_sql, parameter_names, is_dml) tuple per statement
+    """
+    statements = []
+    for tree in sqlglot.parse(sql, read="bigquery"):
+        if tree is None:
+            continue
+        parameter_names = sorted({node.name for node in tree.find_all(exp.Parameter)})
+
+        def rewrite(node):
+            if isinstance(node, exp.Parameter):
+                return exp.var(f"${node.name}")
+            if isinstance(node, exp.Table) and node.args.get("catalog"):
+                # project.dataset.table -> dataset.table
+                node = node.copy()
+                node.set("catalog", None)
+            return node
+
+        tree = tree.transform(rewrite)
+        statements.append((tree.sql(dialect="duckdb"), tuple(parameter_names), isinstance(tree, DML_STATEMENTS)))
+    return tuple(statements)
+
+def parameter_value(parameter):
+    """Convert a BigQuery query parameter into a value DuckDB can bind"""
+    if isinstance(parameter, bigquery.ArrayQueryParameter):
+        converter = FIELD_CONVERTERS.get(parameter.array_type.upper(), lambda value: value)
+        return [converter(value) for value in parameter.values]
+
+    value = parameter.value
+    if value is None:
+        return None
+    converter = FIELD_CONVERTERS.get((parameter.type_ or "").upper())
+    return converter(value) if converter else value
+
+def normalize_integers(table):
+    """
+    Cast HUGEINT results back to 64-bit integers
+
+    DuckDB widens SUM(BIGINT) to a 128-bit integer, which reaches Arrow as
+    decimal(38, 0). BigQuery returns INT64 for the same query.
+    """
+    for index, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type) and field.type.scale == 0:
+            table = table.set_column(index, field.name, table.column(index).cast(pa.int64()))
+    return table
+
+class LocalRowIterator:
+    """Fully fetched query result with the parts of RowIterator the app uses"""
+
+    def __init__(self, table):
+        table = normalize_integers(table)
+        self._table = table
+        self.total_rows = table.num_rows
+        self.schema = [
+            bigquery.SchemaField(field.name, DUCKDB_TO_BIGQUERY_TYPES.get(str(field.type).upper(), "STRING"))
+            for field in table.schema
+        ]
+
+    def __iter__(self):
+        field_to_index = {name: index for index, name in enumerate(self._table.column_names)}
+        for record in self._table.to_pylist():
+            yield bigquery.Row(tuple(record.values()), field_to_index)
+
+    def to_arrow(self, *args, **kwargs):
+        return self._table
+
+    def to_dataframe(self, *args, **kwargs):
+        return self._table.to_pandas()
+
+class LocalQueryJob:
+    """Completed query job; queries run synchronously when submitted"""
+
+    def __init__(self, table, num_dml_affected_rows=None):
+        self._result = LocalRowIterator(table)
+        self.num_dml_affected_rows = num_dml_affected_rows
+        self.state = "DONE"
+
+    def result(self, *args, **kwargs):
+        return self._result
+
+class LocalLoadJob:
+    """Completed load job"""
+
+    def __init__(self, output_rows):
+        self.output_rows = output_rows
+        self.state = "DONE"
+
+    def result(self, *args, **kwargs):
+        return self
+
+class LocalClient:
+    """DuckDB-backed implementation of the BigQuery client calls Step Lotto makes"""
+
+    def __init__(self, database=None, project=DEFAULT_PROJECT):
+        self.project = project
+        self.database = database or os.environ.get(DATABASE_ENV_VAR, DEFAULT_DATABASE)
+        if self.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+
+        self._connection = duckdb.connect(self.database)
+        self._connection.execute(f"CREATE SCHEMA IF NOT EXISTS {META_SCHEMA}")
+        self._connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {META_SCHEMA}.table_options (
+                dataset_id VARCHAR,
+                table_id VARCHAR,
+                partition_field VARCHAR,
+                clustering_fields VARCHAR[]
+            )
+        """)
+
+        self._insert_ids = {}
+        self._insert_ids_lock = threading.Lock()
+
+    def _cursor(self):
+        # DuckDB connections are not safe to share between threads, cursors
+        # are. Session settings are not inherited, so BigQuery's UTC is set on each
+        cursor = self._connection.cursor()
+        cursor.execute("SET TimeZone = 'UTC'")
+        return cursor
+
+    def _resolve_table(self, table):
+        """Return (dataset_id, table_id) for a Table, TableReference or table string"""
+        if isinstance(table, str):
+            parts = table.replace("`", "").split(".")
+            return parts[-2], parts[-1]
+        return table.dataset_id, table.table_id
+
+    def dataset(self, dataset_id, project=None):
+        return bigquery.DatasetReference(project or self.project, dataset_id)
+
+    def query(self, query, job_config=None, **kwargs):
+        parameters = {}
+        if job_config is not None:
+            for parameter in job_config.query_parameters or []:
+                parameters[parameter.name] = parameter_value(parameter)
+
+        cursor = self._cursor()
+        try:
+            table = pa.table({})
+            affected_rows = None
+            for statement, parameter_names, is_dml in translate(query):
+                try:
+                    cursor.execute(statement, {name: parameters[name] for name in parameter_names})
+                except KeyError as e:
+                    raise BadRequest(f"Query parameter {e} is not defined")
+                except duckdb.Error as e:
+                    raise BadRequest(str(e))
+
+                if cursor.description is None:
+                    table = pa.table({})
+                    continue
+
+                table = cursor.arrow().read_all()
+                if is_dml:
+                    # DuckDB reports DML as a single "Count" row
+                    affected_rows = (affected_rows or 0) + sum(table.column(0).to_pylist())
+                    table = pa.table({})
+        finally:
+            cursor.close()
+
+        return LocalQueryJob(table, affected_rows)
+
+    def get_table(self, table):
+        dataset_id, table_id = self._resolve_table(table)
+        cursor = self._cursor()
+        try:
+            columns = cursor.execute(
+                """
+                SELECT column_name, data_type, is_nullable
+                FROM information_schema.columns
+                WHERE table_schema = $dataset AND table_name = $table
+                ORDER BY ordinal_position
+                """,
+                {"dataset": dataset_id, "table": table_id}
+            ).fetchall()
+            options = cursor.execute(
+                f"""
+                SELECT partition_field, clustering_fields
+                FROM {META_SCHEMA}.table_options
+                WHERE dataset_id = $dataset AND table_id = $table
+                """,
+                {"dataset": dataset_id, "table": table_id}
+            ).fetchone()
+        finally:
+            cursor.close()
+
+        if not columns:
+            raise NotFound(f"Not found: Table {self.project}:{dataset_id}.{table_id}")
+
+        result = bigquery.Table(
+            f"{self.project}.{dataset_id}.{table_id}",
+            schema=[
+                bigquery.SchemaField(
+                    name,
+                    DUCKDB_TO_BIGQUERY_TYPES.get(data_type.upper(), "STRING"),
+                    mode="NULLABLE" if is_nullable == "YES" else "REQUIRED"
+                )
+                for name, data_type, is_nullable in columns
+            ]
+        )
+        if options:
+            partition_field, clustering_fields = options
+            if partition_field:
+                result.time_partitioning = bigquery.TimePartitioning(field=partition_field)
+            result.clustering_fields = clustering_fields or None
+        return result
+
+    def create_table(self, table, exists_ok=False, **kwargs):
+        dataset_id, table_id = self._resolve_table(table)
+        columns = ", ".join(
+            f'"{field.name}" {BIGQUERY_TO_DUCKDB_TYPES[field.field_type.upper()]}'
+            + (" NOT NULL" if field.mode == "REQUIRED" else "")
+            for field in table.schema
+        )
+
+        cursor = self._cursor()
+        try:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {dataset_id}")
+            exists = cursor.execute(
+                "SELECT 1 FROM information_schema.tables WHERE table_schema = $dataset AND table_name = $table",
+                {"dataset": dataset_id, "table": table_id}
+            ).fetchone()
+            if exists:
+                if exists_ok:
+                    return self.get_table(table)
+                raise Conflict(f"Already Exists: Table {self.project}:{dataset_id}.{table_id}")
+
+            cursor.execute(f"CREATE TABLE {dataset_id}.{table_id} ({columns})")
+            partitioning = getattr(table, "time_partitioning", None)
+            cursor.execute(
+                f"INSERT INTO {META_SCHEMA}.table_options VALUES ($dataset, $table, $partition_field, $clustering_fields)",
+                {
+                    "dataset": dataset_id,
+                    "table": table_id,
+                    "partition_field": partitioning.field if partitioning else None,
+                    "clustering_fields": list(getattr(table, "clustering_fields", None) or []),
+                }
+            )
+        finally:
+            cursor.close()
+
+        return self.get_table(table)
+
+    def update_table(self, table, fields, **kwargs):
+        dataset_id, table_id = self._resolve_table(table)
+        if "clustering_fields" in fields:
+            cursor = self._cursor()
+            try:
+                cursor.execute(
+                    f"UPDATE {META_SCHEMA}.table_options SET clustering_fields = $clustering_fields "
+                    "WHERE dataset_id = $dataset AND table_id = $table",
+                    {"dataset": dataset_id, "table": table_id, "clustering_fields": list(table.clustering_fields or [])}
+                )
+            finally:
+                cursor.close()
+        return self.get_table(table)
+
+    def _seen_insert_id(self, insert_id, now):
+        """Check whether an accepted row had this insert ID inside the dedup window"""
+        seen = self._insert_ids.get(insert_id)
+        return seen is not None and now - seen < INSERT_ID_WINDOW_SECONDS
+
+    def _record_insert_ids(self, insert_ids, now):
+        """Remember the insert IDs of accepted rows, pruning expired ones once there are many"""
+        if len(self._insert_ids) > 100000:
+            cutoff = now - INSERT_ID_WINDOW_SECONDS
+            self._insert_ids = {key: seen for key, seen in self._insert_ids.items() if seen >= cutoff}
+        self._insert_ids.update((insert_id, now) for insert_id in insert_ids)
+
+    def _convert_rows(self, schema, json_rows, ignore_unknown_values=False):
+        """
+        Validate and convert JSON rows against a table schema
+
+        Returns:
+            tuple: (dict of column name -> converted values for the valid rows,
+            list of BigQuery-style errors for the invalid ones)
+        """
+        fields = {field.name: field for field in schema}
+        columns = {name: [] for name in fields}
+        errors = []
+
+        for index, row in enumerate(json_rows):
+            converted = {}
+            row_errors = []
+            for name, value in row.items():
+                if name not in fields:
+                    if not ignore_unknown_values:
+                        row_errors.append({"reason": "invalid", "location": name, "message": "no such field."})
+                    continue
+                if value is None:
+                    continue
+                try:
+                    converted[name] = FIELD_CONVERTERS.get(fields[name].field_type.upper(), lambda v: v)(value)
+                except (TypeError, ValueError) as e:
+                    row_errors.append({"reason": "invalid", "location": name, "message": str(e)})
+            for name, field in fields.items():
+                if field.mode == "REQUIRED" and name not in converted and not any(error["location"] == name for error in row_errors):
+                    row_errors.append({"reason": "invalid", "location": name, "message": "Missing required field."})
+
+            if row_errors:
+                errors.append({"index": index, "errors": row_errors})
+                continue
+            for name in fields:
+                columns[name].append(converted.get(name))
+
+        return columns, errors
+
+    def _append(self, dataset_id, table_id, schema, columns):
+        """Append already converted columns to a table in one statement"""
+        batch = pa.table({name: values for name, values in columns.items()})
+        if batch.num_rows == 0:
+            return 0
+
+        column_list = ", ".join(f'"{field.name}"' for field in schema)
+        cursor = self._cursor()
+        try:
+            cursor.register("_incoming_rows", batch)
+            cursor.execute(
+                f"INSERT INTO {dataset_id}.{table_id} ({column_list}) SELECT {column_list} FROM _incoming_rows"
+            )
+            cursor.unregister("_incoming_rows")
+        finally:
+            cursor.close()
+        return batch.num_rows
+
+    def insert_rows_json(self, table, json_rows, row_ids=None, skip_invalid_rows=False,
+                         ignore_unknown_values=False, **kwargs):
+        dataset_id, table_id = self._resolve_table(table)
+        schema = self.get_table(table).schema
+
+        if row_ids is None:
+            return self._insert_rows(dataset_id, table_id, schema, json_rows, list(range(len(json_rows))),
+                                     skip_invalid_rows, ignore_unknown_values)
+
+        # Best-effort deduplication on insert IDs, as in streaming inserts.
+        # Only rows that were written count as seen, so a retry of a rejected
+        # row goes through; the lock keeps concurrent retries from both landing
+        with self._insert_ids_lock:
+            now = time.monotonic()
+            positions, fresh_ids = [], set()
+            for index, row_id in enumerate(row_ids):
+                if row_id is None or not (row_id in fresh_ids or self._seen_insert_id(row_id, now)):
+                    positions.append(index)
+                    fresh_ids.add(row_id)
+            errors = self._insert_rows(dataset_id, table_id, schema, [json_rows[index] for index in positions],
+                                       positions, skip_invalid_rows, ignore_unknown_values)
+            failed = {error["index"] for error in errors}
+            self._record_insert_ids(
+                (row_ids[index] for index in positions if index not in failed and row_ids[index] is not None), now
+            )
+        return errors
+
+    def _insert_rows(self, dataset_id, table_id, schema, json_rows, positions, skip_invalid_rows,
+                     ignore_unknown_values):
+        """Validate and append rows, reporting errors at their positions in the caller's request"""
+        columns, errors = self._convert_rows(schema, json_rows, ignore_unknown_values)
+        for error in errors:
+            error["index"] = positions[error["index"]]
+
+        if errors and not skip_invalid_rows:
+            # Without skip_invalid_rows BigQuery rejects the whole request
+            failed = {error["index"] for error in errors}
+            stopped = [
+                {"index": index, "errors": [{"reason": "stopped", "location": "", "message": ""}]}
+                for index in positions if index not in failed
+            ]
+            return sorted(errors + stopped, key=lambda error: error["index"])
+
+        self._append(dataset_id, table_id, schema, columns)
+        return errors
+
+    def load_table_from_json(self, json_rows, destination, job_config=None, **kwargs):
+        dataset_id, table_id = self._resolve_table(destination)
+        schema = self.get_table(destination).schema
+
+        json_rows = list(json_rows)
+        columns, errors = self._convert_rows(schema, json_rows)
+        if errors:
+            raise BadRequest(f"Error while reading data: {errors[:5]}")
+
+        if job_config is not None and job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+            cursor = self._cursor()
+            try:
+                cursor.execute(f"DELETE FROM {dataset_id}.{table_id}")
+            finally:
+                cursor.close()
+
+        return LocalLoadJob(self._append(dataset_id, table_id, schema, columns))
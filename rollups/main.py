@@ -0,0 +1,403 @@
+import functions_framework
+from google.cloud import bigquery
+import os
+from datetime import date, datetime, timedelta, timezone
+
+# Initialize BigQuery client, or the local stand-in when STEPLOTTO_BACKEND=local
+if os.environ.get("STEPLOTTO_BACKEND") == "local":
+    from local_bigquery.client import LocalClient
+    client = LocalClient()
+else:
+    client = bigquery.Client()
+
+# Configure your BigQuery details
+PROJECT_ID = "my-project-1706650764881"
+DATASET_ID = "step_lotto"
+STEPS_TABLE_ID = "user_steps"
+MEMBERSHIPS_TABLE_ID = "league_memberships"
+DAILY_TABLE_ID = "daily_user_steps"
+LEAGUE_TOTALS_TABLE_ID = "league_totals"
+CUMULATIVE_TABLE_ID = "cumulative_user_steps"
+STATE_TABLE_ID = "rollup_state"
+
+# Names under which watermarks are stored in the state table: the newest
+# rolled-up user_steps compacted_at, and the last day the cumulative series reaches
+STEPS_ROLLUP = "user_steps"
+CUMULATIVE_ROLLUP = "cumulative_user_steps"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def table_path(table_id):
+    """Fully qualified, quoted table name for use in queries"""
+    return f"`{PROJECT_ID}.{DATASET_ID}.{table_id}`"
+
+def ensure_rollup_tables():
+    """Create the rollup tables if they do not exist yet"""
+    daily = bigquery.Table(
+        f"{PROJECT_ID}.{DATASET_ID}.{DAILY_TABLE_ID}",
+        schema=[
+            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("day", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("total_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+    )
+    daily.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="day"
+    )
+    daily.clustering_fields = ["name"]
+    
+    league_totals = bigquery.Table(
+        f"{PROJECT_ID}.{DATASET_ID}.{LEAGUE_TOTALS_TABLE_ID}",
+        schema=[
+            bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("player_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("total_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+    )
+    league_totals.clustering_fields = ["league_id", "player_id"]
+    
+    cumulative = bigquery.Table(
+        f"{PROJECT_ID}.{DATASET_ID}.{CUMULATIVE_TABLE_ID}",
+        schema=[
+            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("day", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("cumulative_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+    )
+    cumulative.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="day"
+    )
+    cumulative.clustering_fields = ["name"]
+    
+    state = bigquery.Table(
+        f"{PROJECT_ID}.{DATASET_ID}.{STATE_TABLE_ID}",
+        schema=[
+            bigquery.SchemaField("rollup", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("watermark", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("refreshed_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+    )
+    
+    for table in (daily, league_totals, cumulative, state):
+        client.create_table(table, exists_ok=True)
+
+def get_watermark(rollup=STEPS_ROLLUP):
+    """Get the compaction time up to which user_steps has been rolled up"""
+    query = f"""
+    SELECT watermark
+    FROM {table_path(STATE_TABLE_ID)}
+    WHERE rollup = @rollup
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("rollup", "STRING", rollup)
+        ]
+    )
+    
+    results = client.query(query, job_config=job_config).result()
+    
+    for row in results:
+        return row.watermark
+    return EPOCH
+
+def get_changes_since(watermark):
+    """
+    Summarise the user_steps rows compacted since the watermark
+    
+    Rows are picked by compacted_at, when compaction wrote them, not by
+    their sync time, which can be older than a watermark that has already
+    moved past it. Rows compacted before compacted_at existed are NULL and
+    were rolled up by sync time.
+    
+    Returns:
+        tuple: (first changed day, newest compacted_at, number of changed rows)
+    """
+    query = f"""
+    SELECT
+        MIN(date) AS first_day,
+        MAX(compacted_at) AS high_water,
+        COUNT(*) AS changed_rows
+    FROM {table_path(STEPS_TABLE_ID)}
+    WHERE compacted_at > @watermark
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)
+        ]
+    )
+    
+    results = client.query(query, job_config=job_config).result()
+    
+    for row in results:
+        return row.first_day, row.high_water, row.changed_rows
+    return None, None, 0
+
+def refresh_daily_user_steps(watermark, high_water, first_day):
+    """Recompute the daily rows for every (user, day) touched since the watermark"""
+    query = f"""
+    MERGE {table_path(DAILY_TABLE_ID)} t
+    USING (
+        SELECT
+            us.name,
+            us.date AS day,
+            SUM(us.steps) AS total_steps
+        FROM {table_path(STEPS_TABLE_ID)} us
+        JOIN (
+            SELECT DISTINCT name, date
+            FROM {table_path(STEPS_TABLE_ID)}
+            WHERE compacted_at > @watermark AND compacted_at <= @high_water
+        ) touched
+        ON us.name = touched.name AND us.date = touched.date
+        WHERE us.date >= @first_day
+        GROUP BY us.name, us.date
+    ) s
+    ON t.name = s.name AND t.day = s.day AND t.day >= @first_day
+    WHEN MATCHED THEN
+        UPDATE SET total_steps = s.total_steps, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (name, day, total_steps, updated_at)
+        VALUES (s.name, s.day, s.total_steps, CURRENT_TIMESTAMP())
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+            bigquery.ScalarQueryParameter("high_water", "TIMESTAMP", high_water),
+            bigquery.ScalarQueryParameter("first_day", "DATE", first_day)
+        ]
+    )
+    
+    query_job = client.query(query, job_config=job_config)
+    query_job.result()
+    return query_job.num_dml_affected_rows or 0
+
+def refresh_league_totals(watermark, high_water):
+    """
+    Recompute league totals for players whose steps changed since the watermark
+    
+    Memberships that have no totals row yet (new leagues and new joiners) are
+    filled in as well, so every member appears with their full history.
+    """
+    query = f"""
+    MERGE {table_path(LEAGUE_TOTALS_TABLE_ID)} t
+    USING (
+        SELECT
+            lm.league_id,
+            lm.player_id,
+            COALESCE(SUM(d.total_steps), 0) AS total_steps
+        FROM {table_path(MEMBERSHIPS_TABLE_ID)} lm
+        LEFT JOIN {table_path(DAILY_TABLE_ID)} d ON lm.player_id = d.name
+        WHERE lm.player_id IN (
+            SELECT DISTINCT name
+            FROM {table_path(STEPS_TABLE_ID)}
+            WHERE compacted_at > @watermark AND compacted_at <= @high_water
+        )
+        OR NOT EXISTS (
+            SELECT 1
+            FROM {table_path(LEAGUE_TOTALS_TABLE_ID)} lt
+            WHERE lt.league_id = lm.league_id AND lt.player_id = lm.player_id
+        )
+        GROUP BY lm.league_id, lm.player_id
+    ) s
+    ON t.league_id = s.league_id AND t.player_id = s.player_id
+    WHEN MATCHED THEN
+        UPDATE SET total_steps = s.total_steps, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (league_id, player_id, total_steps, updated_at)
+        VALUES (s.league_id, s.player_id, s.total_steps, CURRENT_TIMESTAMP())
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+            bigquery.ScalarQueryParameter("high_water", "TIMESTAMP", high_water)
+        ]
+    )
+    
+    query_job = client.query(query, job_config=job_config)
+    query_job.result()
+    return query_job.num_dml_affected_rows or 0
+
+def refresh_cumulative_user_steps(watermark, high_water, first_day, through):
+    """
+    Bring the dense cumulative series up to date
+    
+    cumulative_user_steps holds, for every user and every day from their
+    first step to today, their total steps up to and including that day, so
+    any window is two point lookups: cumulative(end) - cumulative(start - 1).
+    Users whose steps changed are recomputed from their first changed day;
+    everyone else is just extended from the last built day to today.
+    
+    Args:
+        watermark (datetime): Compaction time rolled up by the previous run
+        high_water (datetime): Newest compaction time rolled up by this run
+        first_day (date): Oldest day changed since the watermark, or None
+        through (date): Last day the series was built to, or None to build it from scratch
+    
+    Returns:
+        int: Number of cumulative rows inserted or updated
+    """
+    today = datetime.now(timezone.utc).date()
+    
+    if through is None:
+        # First build: every user from their first day in the daily rollup
+        starts = f"""
+        SELECT name, MIN(day) AS from_day
+        FROM {table_path(DAILY_TABLE_ID)}
+        GROUP BY name
+        """
+        first_day = date(1970, 1, 1)
+    else:
+        starts = f"""
+        SELECT name, MIN(from_day) AS from_day
+        FROM (
+            SELECT name, MIN(date) AS from_day
+            FROM {table_path(STEPS_TABLE_ID)}
+            WHERE compacted_at > @watermark AND compacted_at <= @high_water
+            GROUP BY name
+            UNION ALL
+            SELECT name, DATE_ADD(day, INTERVAL 1 DAY) AS from_day
+            FROM {table_path(CUMULATIVE_TABLE_ID)}
+            WHERE day = @through
+        )
+        GROUP BY name
+        """
+        extend_from = through + timedelta(days=1)
+        first_day = min(first_day, extend_from) if first_day else extend_from
+    
+    query = f"""
+    MERGE {table_path(CUMULATIVE_TABLE_ID)} t
+    USING (
+        WITH starts AS ({starts}),
+        base AS (
+            SELECT s.name, COALESCE(c.cumulative_steps, 0) AS base_steps
+            FROM starts s
+            LEFT JOIN {table_path(CUMULATIVE_TABLE_ID)} c
+                ON c.name = s.name
+                AND c.day = DATE_SUB(s.from_day, INTERVAL 1 DAY)
+                AND c.day >= DATE_SUB(@first_day, INTERVAL 1 DAY)
+        ),
+        days AS (
+            SELECT s.name, day
+            FROM starts s
+            CROSS JOIN UNNEST(GENERATE_DATE_ARRAY(s.from_day, @today)) AS day
+        )
+        SELECT
+            days.name,
+            days.day,
+            base.base_steps + SUM(COALESCE(d.total_steps, 0)) OVER (
+                PARTITION BY days.name ORDER BY days.day
+            ) AS cumulative_steps
+        FROM days
+        JOIN base ON base.name = days.name
+        LEFT JOIN {table_path(DAILY_TABLE_ID)} d
+            ON d.name = days.name AND d.day = days.day AND d.day >= @first_day
+    ) s
+    ON t.name = s.name AND t.day = s.day AND t.day >= @first_day
+    WHEN MATCHED AND t.cumulative_steps != s.cumulative_steps THEN
+        UPDATE SET cumulative_steps = s.cumulative_steps, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (name, day, cumulative_steps, updated_at)
+        VALUES (s.name, s.day, s.cumulative_steps, CURRENT_TIMESTAMP())
+    """
+    
+    query_parameters = [
+        bigquery.ScalarQueryParameter("first_day", "DATE", first_day),
+        bigquery.ScalarQueryParameter("today", "DATE", today)
+    ]
+    if through is not None:
+        query_parameters += [
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+            bigquery.ScalarQueryParameter("high_water", "TIMESTAMP", high_water),
+            bigquery.ScalarQueryParameter("through", "DATE", through)
+        ]
+    
+    query_job = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=query_parameters))
+    query_job.result()
+    
+    set_watermark(datetime(today.year, today.month, today.day, tzinfo=timezone.utc), CUMULATIVE_ROLLUP)
+    return query_job.num_dml_affected_rows or 0
+
+def set_watermark(watermark, rollup=STEPS_ROLLUP):
+    """Record the compaction time up to which user_steps has been rolled up"""
+    query = f"""
+    MERGE {table_path(STATE_TABLE_ID)} t
+    USING (SELECT @rollup AS rollup, @watermark AS watermark) s
+    ON t.rollup = s.rollup
+    WHEN MATCHED THEN
+        UPDATE SET watermark = s.watermark, refreshed_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (rollup, watermark, refreshed_at)
+        VALUES (s.rollup, s.watermark, CURRENT_TIMESTAMP())
+    """
+    
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("rollup", "STRING", rollup),
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)
+        ]
+    )
+    
+    client.query(query, job_config=job_config).result()
+
+def refresh_rollups():
+    """
+    Bring daily_user_steps, league_totals and cumulative_user_steps up to date with user_steps
+    
+    Only the days touched since the last run are recomputed. The watermark is
+    the newest compacted_at that has been rolled up rather than the wall
+    clock, so rows compacted while the refresh runs are picked up next time.
+    
+    Returns:
+        dict: Counts of changed source rows and updated rollup rows
+    """
+    ensure_rollup_tables()
+    
+    watermark = get_watermark()
+    first_day, high_water, changed_rows = get_changes_since(watermark)
+    
+    daily_rows = 0
+    if changed_rows:
+        daily_rows = refresh_daily_user_steps(watermark, high_water, first_day)
+    else:
+        high_water = watermark
+    
+    league_rows = refresh_league_totals(watermark, high_water)
+    
+    # The cumulative series needs work when steps changed or a new day started
+    cumulative_through = get_watermark(CUMULATIVE_ROLLUP)
+    through = cumulative_through.date() if cumulative_through > EPOCH else None
+    cumulative_rows = 0
+    if changed_rows or through is None or through < datetime.now(timezone.utc).date():
+        cumulative_rows = refresh_cumulative_user_steps(watermark, high_water, first_day, through)
+    
+    if changed_rows:
+        set_watermark(high_water)
+    
+    return {
+        'changed_rows': changed_rows,
+        'daily_rows': daily_rows,
+        'league_rows': league_rows,
+        'cumulative_rows': cumulative_rows,
+    }
+
+@functions_framework.cloud_event
+def refresh_step_rollups(cloud_event):
+    """Cloud Function triggered by Cloud Scheduler to incrementally refresh the step rollups"""
+    
+    try:
+        counts = refresh_rollups()
+        
+        print(f"Refreshed rollups: {counts}")
+        return f"Refreshed {counts['daily_rows']} daily rows and {counts['league_rows']} league rows"
+        
+    except Exception as e:
+        print(f"Error refreshing rollups: {str(e)}")
+        raise e
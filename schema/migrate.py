@@ -0,0 +1,307 @@
+"""
+Create and migrate the Step Lotto BigQuery tables
+
+Run from the repository root with credentials for the project:
+
+    python schema/migrate.py
+
+Set STEPLOTTO_BACKEND=local (with the repository root on PYTHONPATH) to
+create the same tables in the local DuckDB stand-in instead.
+
+Every step is safe to re-run. Tables that already exist with the expected
+layout are left alone. An existing unpartitioned user_steps table is rebuilt
+as a date-partitioned, name-clustered copy (keeping the newest reading per
+user-day) and the original is kept as user_steps_legacy_<timestamp>.
+Rebuilding is not atomic and needs downtime: pause the ingestion functions
+and the compaction and dummy data schedulers, wait for the table's streaming
+buffer to flush, then run
+
+    python schema/migrate.py --rebuild
+
+Nullable columns added to TABLES since a table was created are added in
+place.
+"""
+from google.cloud import bigquery
+from datetime import datetime
+import os
+
+# Configure your BigQuery details
+PROJECT_ID = "my-project-1706650764881"
+DATASET_ID = "step_lotto"
+
+STEPS_SCHEMA = [
+    bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("steps", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("timestamp", "TIMESTAMP"),
+]
+
+# Staged rows also record when they reached the table. timestamp is the
+# phone's sync time, which can be much older for retried or queued syncs,
+# so compaction decides what has settled by ingested_at instead
+STAGING_SCHEMA = STEPS_SCHEMA + [
+    bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+]
+
+# Compacted rows record when compaction last wrote them. The rollups go by
+# compacted_at, so a reading compacted after a rollup has run is still
+# rolled up however old its sync time is
+COMPACTED_SCHEMA = STEPS_SCHEMA + [
+    bigquery.SchemaField("compacted_at", "TIMESTAMP"),
+]
+
+# table_id -> (schema, partition field, clustering fields). created_at on
+# user_ids, leagues and league_memberships lets the app's lookup store copy
+# only new keys; rows written without it are copied by its full syncs
+TABLES = {
+    "user_steps": (COMPACTED_SCHEMA, "date", ["name"]),
+    "user_steps_input": (STAGING_SCHEMA, "timestamp", ["name"]),
+    "user_ids": (
+        [
+            bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("first_name", "STRING"),
+            bigquery.SchemaField("last_name", "STRING"),
+            bigquery.SchemaField("created_at", "TIMESTAMP"),
+        ],
+        None,
+        ["user_id"],
+    ),
+    "leagues": (
+        [
+            bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("created_at", "TIMESTAMP"),
+        ],
+        None,
+        ["league_id"],
+    ),
+    "league_memberships": (
+        [
+            bigquery.SchemaField("player_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("created_at", "TIMESTAMP"),
+        ],
+        None,
+        ["league_id", "player_id"],
+    ),
+    # Rollups maintained by the refresh-step-rollups job, which also creates
+    # them on first run
+    "daily_user_steps": (
+        [
+            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("day", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("total_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        "day",
+        ["name"],
+    ),
+    "league_totals": (
+        [
+            bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("player_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("total_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        None,
+        ["league_id", "player_id"],
+    ),
+    # Dense running totals: one row per user per day from their first step
+    "cumulative_user_steps": (
+        [
+            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("day", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("cumulative_steps", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        "day",
+        ["name"],
+    ),
+    # Weekly draw results written by the run-league-draws job
+    "draws": (
+        [
+            bigquery.SchemaField("league_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("period_start", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("period_end", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("winner_rank", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("winner_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("winner_tickets", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("total_tickets", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("entrants", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("seed", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("drawn_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        "period_end",
+        ["league_id"],
+    ),
+    "rollup_state": (
+        [
+            bigquery.SchemaField("rollup", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("watermark", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("refreshed_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        None,
+        None,
+    ),
+}
+
+def table_id_path(table_id):
+    return f"{PROJECT_ID}.{DATASET_ID}.{table_id}"
+
+def build_table(table_id):
+    """Build the Table definition for one of the tables in TABLES"""
+    schema, partition_field, clustering_fields = TABLES[table_id]
+    
+    table = bigquery.Table(table_id_path(table_id), schema=schema)
+    if partition_field:
+        table.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY,
+            field=partition_field
+        )
+    if clustering_fields:
+        table.clustering_fields = clustering_fields
+    return table
+
+def get_existing_table(client, table_id):
+    """Return the existing table, or None if it has not been created yet"""
+    try:
+        return client.get_table(table_id_path(table_id))
+    except Exception as e:
+        if getattr(e, "code", None) == 404:
+            return None
+        raise
+
+def is_laid_out(table, table_id):
+    """Check whether an existing table already has the expected partitioning and clustering"""
+    _, partition_field, clustering_fields = TABLES[table_id]
+    
+    current_partition = table.time_partitioning.field if table.time_partitioning else None
+    return current_partition == partition_field and (table.clustering_fields or []) == (clustering_fields or [])
+
+def rebuild_steps_table(client, table_id):
+    """
+    Rebuild a steps table with the target layout and swap it into place
+    
+    BigQuery cannot add partitioning to an existing table, so the data is
+    copied into a new table with CREATE TABLE AS SELECT and the two are
+    renamed. Duplicate user-days are collapsed to the newest reading on the
+    way through, and every column of the original is kept.
+    
+    The copy and the renames are separate jobs, so this needs downtime:
+    pause everything that writes the table (the ingestion functions and the
+    compaction and dummy data schedulers) and wait for its streaming buffer
+    to flush first. BigQuery refuses to rename a table with a streaming
+    buffer, so the rebuild stops before copying if there is one, and it
+    drops the copy without renaming if the table changed while it was made.
+    """
+    _, partition_field, clustering_fields = TABLES[table_id]
+    suffix = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    new_table_id = f"{table_id}_rebuild_{suffix}"
+    legacy_table_id = f"{table_id}_legacy_{suffix}"
+    
+    source = client.get_table(table_id_path(table_id))
+    if source.streaming_buffer is not None:
+        raise RuntimeError(
+            f"{table_id} still has a streaming buffer; pause its writers and "
+            "re-run once the buffer has flushed (up to 90 minutes)"
+        )
+    
+    # DATE columns partition directly, TIMESTAMP columns by their day
+    if partition_field == "date":
+        partition_expression = partition_field
+    else:
+        partition_expression = f"DATE({partition_field})"
+    
+    # The key columns are normalized; every other column (ingested_at,
+    # compacted_at, ...) is carried through as it is
+    key_columns = {field.name for field in STEPS_SCHEMA}
+    other_columns = "".join(
+        f",\n        {field.name}" for field in source.schema if field.name not in key_columns
+    )
+    
+    query = f"""
+    CREATE TABLE `{table_id_path(new_table_id)}`
+    PARTITION BY {partition_expression}
+    CLUSTER BY {", ".join(clustering_fields)}
+    AS
+    SELECT
+        LOWER(TRIM(name)) AS name,
+        CAST(steps AS INT64) AS steps,
+        CAST(date AS DATE) AS date,
+        CAST(timestamp AS TIMESTAMP) AS timestamp{other_columns}
+    FROM `{table_id_path(table_id)}`
+    WHERE name IS NOT NULL AND date IS NOT NULL
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY LOWER(TRIM(name)), CAST(date AS DATE)
+        ORDER BY CAST(timestamp AS TIMESTAMP) DESC
+    ) = 1
+    """
+    client.query(query).result()
+    
+    # Rows written since the copy started would be left behind in the legacy table
+    current = client.get_table(table_id_path(table_id))
+    if current.modified != source.modified or current.streaming_buffer is not None:
+        client.query(f"DROP TABLE `{table_id_path(new_table_id)}`").result()
+        raise RuntimeError(f"{table_id} was written during the rebuild; pause its writers and re-run")
+    
+    client.query(f"ALTER TABLE `{table_id_path(table_id)}` RENAME TO `{legacy_table_id}`").result()
+    client.query(f"ALTER TABLE `{table_id_path(new_table_id)}` RENAME TO `{table_id}`").result()
+    
+    print(f"Rebuilt {table_id}; previous data kept in {legacy_table_id}")
+
+def add_missing_columns(client, table_id):
+    """
+    Add columns that are in TABLES but not yet on the existing table
+    
+    Only nullable columns are added, so existing rows stay valid with NULLs.
+    """
+    existing_columns = {field.name for field in client.get_table(table_id_path(table_id)).schema}
+    for field in TABLES[table_id][0]:
+        if field.name in existing_columns or field.mode == "REQUIRED":
+            continue
+        client.query(
+            f"ALTER TABLE `{table_id_path(table_id)}` ADD COLUMN IF NOT EXISTS {field.name} {field.field_type}"
+        ).result()
+        print(f"Added {field.name} to {table_id}")
+
+def migrate(client, rebuild=False):
+    """
+    Create missing tables, rebuild steps tables that lack partitioning and add new columns
+    
+    Rebuilds need the table's writers paused (see rebuild_steps_table), so
+    they only run when rebuild is True and are reported otherwise.
+    """
+    for table_id in TABLES:
+        existing = get_existing_table(client, table_id)
+        
+        if existing is None:
+            client.create_table(build_table(table_id))
+            print(f"Created {table_id}")
+            continue
+        elif is_laid_out(existing, table_id):
+            print(f"{table_id} is up to date")
+        elif TABLES[table_id][0] in (COMPACTED_SCHEMA, STAGING_SCHEMA):
+            if not rebuild:
+                print(f"{table_id} needs a rebuild; pause its writers and re-run with --rebuild")
+                continue
+            rebuild_steps_table(client, table_id)
+        else:
+            # Clustering can be changed in place, unlike partitioning
+            existing.clustering_fields = TABLES[table_id][2]
+            client.update_table(existing, ["clustering_fields"])
+            print(f"Updated clustering on {table_id}")
+        
+        add_missing_columns(client, table_id)
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Create and migrate the Step Lotto tables")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild steps tables that lack partitioning (writers must be paused)")
+    args = parser.parse_args()
+    
+    if os.environ.get("STEPLOTTO_BACKEND") == "local":
+        from local_bigquery.client import LocalClient
+        migrate(LocalClient(), rebuild=args.rebuild)
+    else:
+        migrate(bigquery.Client(project=PROJECT_ID), rebuild=args.rebuild)
@@ -0,0 +1,68 @@
+"""
+Fixtures for running the Cloud Functions against the local DuckDB stand-in
+
+Each function directory is its own deployable whose main.py connects to
+BigQuery on import. load_function imports one with STEPLOTTO_BACKEND=local
+and its directory on sys.path, and undoes the environment, the path and the
+imported modules when the test module finishes.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("sqlglot")
+pytest.importorskip("functions_framework")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def load_function():
+    """Import a function directory's main.py, e.g. load_function("rollups")"""
+    modules_before = set(sys.modules)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("STEPLOTTO_BACKEND", "local")
+        monkeypatch.setenv("STEPLOTTO_LOCAL_DB", ":memory:")
+        monkeypatch.syspath_prepend(REPO_ROOT)
+
+        def load(directory):
+            monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, directory))
+            spec = importlib.util.spec_from_file_location(
+                f"{directory}_main", os.path.join(REPO_ROOT, directory, "main.py")
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+
+        yield load
+
+    # Sibling modules (batcher, sampler, data, ...) were imported by bare
+    # name, so drop them before another test imports a different one
+    for name in set(sys.modules) - modules_before:
+        module = sys.modules[name]
+        location = getattr(module, "__file__", None) or next(iter(getattr(module, "__path__", [])), "")
+        if location.startswith(REPO_ROOT):
+            del sys.modules[name]
+
+@pytest.fixture
+def local_client(load_function):
+    """An empty in-memory stand-in with every table from schema/migrate.py"""
+    from local_bigquery.client import LocalClient
+    from schema.migrate import migrate
+
+    client = LocalClient(":memory:")
+    migrate(client)
+    return client
+
+@pytest.fixture
+def website(load_function, local_client, monkeypatch):
+    """The app's data layer (website_streamlit/data/queries.py) reading from local_client"""
+    st = pytest.importorskip("streamlit")
+    monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, "website_streamlit"))
+    from data import client, queries
+
+    monkeypatch.setattr(client, "get_client", lambda: local_client)
+    st.cache_data.clear()
+    return queries
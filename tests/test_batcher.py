@@ -0,0 +1,102 @@
+"""
+MicroBatcher pools concurrent writes and hands each caller back its own errors
+"""
+import threading
+
+import pytest
+
+@pytest.fixture(scope="module")
+def batcher(load_function):
+    load_function("ingestion")
+    import batcher
+    return batcher
+
+class RecordingWriter:
+    """Writer that rejects rows whose steps are negative, like BigQuery would reject invalid rows"""
+
+    def __init__(self, fail_with=None):
+        self.calls = []
+        self.fail_with = fail_with
+
+    def write(self, rows, row_ids=None):
+        self.calls.append((list(rows), row_ids))
+        if self.fail_with is not None:
+            raise self.fail_with
+        return [
+            {'index': index, 'errors': [{'reason': 'invalid', 'message': 'negative steps'}]}
+            for index, row in enumerate(rows)
+            if row['steps'] < 0
+        ]
+
+def write_concurrently(micro_batcher, requests):
+    """Call write() once per (rows, row_ids) from its own thread, returning results in request order"""
+    results = [None] * len(requests)
+    barrier = threading.Barrier(len(requests))
+
+    def call(position, rows, row_ids):
+        barrier.wait()
+        try:
+            results[position] = micro_batcher.write(rows, row_ids=row_ids)
+        except Exception as e:
+            results[position] = e
+
+    threads = [threading.Thread(target=call, args=(position, *request)) for position, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+def test_concurrent_writes_share_one_flush_and_get_their_own_errors(batcher):
+    writer = RecordingWriter()
+    micro_batcher = batcher.MicroBatcher(writer, max_rows=6, max_wait_ms=5000)
+
+    requests = [
+        ([{'name': 'alice', 'steps': 100}, {'name': 'alice', 'steps': -1}], ['a1', 'a2']),
+        ([{'name': 'bob', 'steps': 200}], ['b1']),
+        ([{'name': 'carol', 'steps': -5}, {'name': 'carol', 'steps': 300}, {'name': 'carol', 'steps': -7}], ['c1', 'c2', 'c3']),
+    ]
+    results = write_concurrently(micro_batcher, requests)
+
+    # Six rows fill the pool, so they go out together without waiting out max_wait
+    assert micro_batcher.flushes == 1
+    rows, row_ids = writer.calls[0]
+    assert len(rows) == 6
+    assert sorted(row_ids) == ['a1', 'a2', 'b1', 'c1', 'c2', 'c3']
+
+    assert [[error['index'] for error in errors] for errors in results] == [[1], [], [0, 2]]
+    assert results[0][0]['errors'][0]['reason'] == 'invalid'
+
+def test_a_failed_flush_fails_every_caller_in_it(batcher):
+    micro_batcher = batcher.MicroBatcher(RecordingWriter(fail_with=RuntimeError("unavailable")), max_rows=2)
+
+    results = write_concurrently(micro_batcher, [
+        ([{'name': 'alice', 'steps': 100}], None),
+        ([{'name': 'bob', 'steps': 200}], None),
+    ])
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_row_ids_are_padded_for_callers_without_them(batcher):
+    writer = RecordingWriter()
+    micro_batcher = batcher.MicroBatcher(writer, max_rows=3, max_wait_ms=5000)
+
+    write_concurrently(micro_batcher, [
+        ([{'name': 'alice', 'steps': 100}, {'name': 'alice', 'steps': 50}], ['a1', 'a2']),
+        ([{'name': 'bob', 'steps': 200}], None),
+    ])
+
+    rows, row_ids = writer.calls[0]
+    assert dict(zip([row['name'] + str(row['steps']) for row in rows], row_ids)) == {
+        'alice100': 'a1', 'alice50': 'a2', 'bob200': None,
+    }
+
+def test_a_lone_write_flushes_after_max_wait(batcher):
+    writer = RecordingWriter()
+    micro_batcher = batcher.MicroBatcher(writer, max_rows=1000, max_wait_ms=10)
+
+    assert micro_batcher.write([{'name': 'alice', 'steps': -1}]) == [
+        {'index': 0, 'errors': [{'reason': 'invalid', 'message': 'negative steps'}]}
+    ]
+    assert micro_batcher.write([]) == []
+    assert micro_batcher.flushes == 1
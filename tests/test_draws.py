@@ -0,0 +1,115 @@
+"""
+League draws: ticket weighting, batch and single-league agreement, and reruns
+
+Runs draws/main.py against an in-memory DuckDB stand-in.
+"""
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+PERIOD_START, PERIOD_END = date(2026, 10, 5), date(2026, 10, 11)
+
+@pytest.fixture(scope="module")
+def draws(load_function):
+    return load_function("draws")
+
+@pytest.fixture
+def sampler(draws):
+    import sampler
+    return sampler
+
+def random_totals(rng, leagues, max_members):
+    """Period totals for leagues of 1 to max_members members, some on too few steps for a ticket"""
+    frames = []
+    for league in range(leagues):
+        members = int(rng.integers(1, max_members + 1))
+        frames.append(pd.DataFrame({
+            'league_id': f"league{league:04d}",
+            'player_id': [f"player{member:03d}" for member in range(members)],
+            'total_steps': rng.integers(0, 60000, members) * (rng.random(members) < 0.8),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def winners_by_league(rows):
+    return {
+        (row['league_id'], row['winner_rank']): (row['winner_id'], row['winner_tickets'], row['total_tickets'], row['entrants'], row['seed'])
+        for row in rows
+    }
+
+def test_alias_sampler_draws_in_proportion_to_weights(sampler):
+    weights = np.array([1, 0, 2, 7])
+    samples = sampler.AliasSampler(weights).sample(np.random.default_rng(1), 200000)
+
+    frequencies = np.bincount(samples, minlength=len(weights)) / len(samples)
+    assert frequencies[1] == 0
+    np.testing.assert_allclose(frequencies, weights / weights.sum(), atol=0.005)
+
+def test_segmented_sampler_keeps_segments_apart(sampler):
+    weights = np.array([3, 1, 0, 5, 5])
+    segmented = sampler.SegmentedAliasSampler(weights, [0, 2])
+    rng = np.random.default_rng(2)
+    draws_per_segment = 100000
+
+    for segment, start, stop in ((0, 0, 2), (1, 2, 5)):
+        picks = segmented.lookup(
+            np.full(draws_per_segment, segment),
+            rng.random(draws_per_segment),
+            rng.random(draws_per_segment)
+        )
+        assert picks.min() >= start and picks.max() < stop
+        frequencies = np.bincount(picks - start, minlength=stop - start) / draws_per_segment
+        expected = weights[start:stop] / weights[start:stop].sum()
+        np.testing.assert_allclose(frequencies, expected, atol=0.005)
+
+@pytest.mark.parametrize("winners", [1, 3, 10])
+def test_batch_draw_matches_single_league_draws(draws, winners):
+    totals = random_totals(np.random.default_rng(winners), leagues=300, max_members=15)
+
+    batch = draws.draw_all_leagues(totals, PERIOD_START, PERIOD_END, winners)
+
+    single = []
+    for league_id, league in totals.groupby('league_id', sort=True):
+        single.extend(draws.draw_winners(
+            league_id,
+            league['player_id'].tolist(),
+            league['total_steps'].to_numpy(),
+            PERIOD_START,
+            PERIOD_END,
+            winners
+        ))
+
+    assert winners_by_league(batch) == winners_by_league(single)
+
+def test_rerun_only_draws_leagues_not_drawn_yet(draws, local_client, monkeypatch):
+    monkeypatch.setattr(draws, "client", local_client)
+    local_client.query("""
+        INSERT INTO step_lotto.league_memberships (player_id, league_id)
+        VALUES ('alice', 'walkers'), ('bob', 'walkers')
+    """).result()
+    local_client.query("""
+        INSERT INTO step_lotto.daily_user_steps (name, day, total_steps, updated_at)
+        VALUES
+            ('alice', DATE '2026-10-06', 12000, CURRENT_TIMESTAMP()),
+            ('bob', DATE '2026-10-07', 4000, CURRENT_TIMESTAMP()),
+            ('carol', DATE '2026-10-08', 9000, CURRENT_TIMESTAMP())
+    """).result()
+
+    assert draws.run_all_draws(PERIOD_START, PERIOD_END) == {'leagues_drawn': 1, 'winners': 1}
+    first_draw = local_client.query("SELECT * FROM step_lotto.draws").result().to_dataframe()
+
+    # A league created after the first run is drawn; walkers is left alone
+    local_client.query("""
+        INSERT INTO step_lotto.league_memberships (player_id, league_id) VALUES ('carol', 'runners')
+    """).result()
+    assert draws.run_all_draws(PERIOD_START, PERIOD_END) == {'leagues_drawn': 1, 'winners': 1}
+    assert draws.run_all_draws(PERIOD_START, PERIOD_END) == {'leagues_drawn': 0, 'winners': 0}
+
+    recorded = local_client.query(
+        "SELECT league_id, winner_id, drawn_at FROM step_lotto.draws ORDER BY league_id"
+    ).result().to_dataframe()
+    assert recorded['league_id'].tolist() == ['runners', 'walkers']
+    assert recorded.loc[1, 'winner_id'] == first_draw.loc[0, 'winner_id']
+    assert recorded.loc[1, 'drawn_at'] == first_draw.loc[0, 'drawn_at']
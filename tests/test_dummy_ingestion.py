@@ -0,0 +1,27 @@
+"""
+Backfilling the synthetic population through staging and compaction
+"""
+from datetime import date, datetime, timezone
+
+import pytest
+
+pytest.importorskip("numpy")
+
+def test_rerunning_a_backfill_does_not_duplicate_step_days(load_function, local_client, monkeypatch):
+    dummy = load_function("dummy_ingestion")
+    ingestion = load_function("ingestion")
+    monkeypatch.setattr(ingestion, "client", local_client)
+    monkeypatch.setattr(ingestion.table_cache, "client", local_client)
+
+    population = dummy.Population(20, 3, start_date=date(2026, 10, 1), end_date=date(2026, 10, 7), seed=1)
+    sink = dummy.BigQuerySink(local_client, dummy.DATASET_ID)
+    first = dummy.write_population(population, sink, date(2026, 10, 7), include_entities=False)
+    dummy.write_population(population, sink, date(2026, 10, 7), include_entities=False)
+    ingestion.compact_staging_rows(datetime.now(timezone.utc))
+
+    counts = local_client.query("""
+        SELECT COUNT(*) AS row_count, COUNT(DISTINCT name || CAST(date AS STRING)) AS user_days
+        FROM step_lotto.user_steps
+    """).result()
+    row = next(iter(counts))
+    assert row['row_count'] == row['user_days'] == first['user_steps_input'] > 0
@@ -0,0 +1,166 @@
+"""
+The ingestion function's validation, compaction and micro-batching
+
+Runs ingestion/main.py against an in-memory DuckDB stand-in.
+"""
+import json
+from datetime import date, datetime, timezone
+
+import pytest
+
+@pytest.fixture
+def ingestion(load_function, local_client, monkeypatch):
+    module = load_function("ingestion")
+    monkeypatch.setattr(module, "client", local_client)
+    monkeypatch.setattr(module.table_cache, "client", local_client)
+    module.table_cache.invalidate()
+    return module
+
+@pytest.mark.parametrize("steps", [[1200, 0, 8000], list(range(1095))])
+def test_columnar_validation_matches_per_row_validation(ingestion, steps):
+    from table_cache import coerce_row
+
+    payload = {'name': ' Alice ', 'steps': steps, 'date': '2026-10-16'}
+    timestamp = datetime(2026, 10, 16, 12, tzinfo=timezone.utc).isoformat()
+    schema = ingestion.table_cache.get().schema
+
+    expected = [coerce_row(record, schema) for record in ingestion.json_to_records(payload, timestamp)]
+    assert ingestion.validated_records(payload, timestamp) == expected
+
+@pytest.mark.parametrize("payload", [
+    {'name': 'alice', 'steps': [100, 'many'], 'date': '2026-10-16'},
+    {'name': 'alice', 'steps': [100], 'date': '16/10/2026'},
+    {'name': 'alice', 'steps': [], 'date': '2026-10-16'},
+])
+def test_invalid_payloads_are_rejected(ingestion, payload):
+    with pytest.raises(ValueError):
+        ingestion.validated_records(payload)
+
+def stage(client, rows):
+    assert client.insert_rows_json("step_lotto.user_steps_input", [
+        {'name': name, 'steps': steps, 'date': day, 'timestamp': synced_at, 'ingested_at': ingested_at}
+        for name, steps, day, synced_at, ingested_at in rows
+    ]) == []
+
+def table_rows(client, table, columns="name, date, steps"):
+    rows = client.query(f"SELECT {columns} FROM step_lotto.{table} ORDER BY name, date, steps").result()
+    return [tuple(row.values()) for row in rows]
+
+def test_compaction_keeps_the_newest_reading_of_each_user_day(ingestion, local_client):
+    stage(local_client, [
+        ('alice', 4000, '2026-10-15', '2026-10-15T20:00:00+00:00', '2026-10-15T20:00:01+00:00'),
+        ('alice', 9000, '2026-10-15', '2026-10-15T23:00:00+00:00', '2026-10-15T23:00:01+00:00'),
+        ('alice', 6000, '2026-10-15', '2026-10-15T21:00:00+00:00', '2026-10-16T01:00:00+00:00'),
+        ('bob', 3000, '2026-10-15', '2026-10-15T22:00:00+00:00', '2026-10-15T22:00:01+00:00'),
+    ])
+
+    assert ingestion.compact_staging_rows(datetime(2026, 10, 16, 6, tzinfo=timezone.utc)) == 4
+
+    assert table_rows(local_client, "user_steps") == [
+        ('alice', date(2026, 10, 15), 9000),
+        ('bob', date(2026, 10, 15), 3000),
+    ]
+    assert table_rows(local_client, "user_steps_input") == []
+
+def test_compaction_never_replaces_a_newer_compacted_reading(ingestion, local_client):
+    cutoff = datetime(2026, 10, 16, 6, tzinfo=timezone.utc)
+    stage(local_client, [
+        ('alice', 9000, '2026-10-15', '2026-10-15T23:00:00+00:00', '2026-10-15T23:00:01+00:00'),
+        ('bob', 3000, '2026-10-15', '2026-10-15T20:00:00+00:00', '2026-10-15T20:00:01+00:00'),
+    ])
+    ingestion.compact_staging_rows(cutoff)
+
+    # A late, older reading for Alice and a newer one for Bob
+    stage(local_client, [
+        ('alice', 4000, '2026-10-15', '2026-10-15T20:00:00+00:00', '2026-10-16T02:00:00+00:00'),
+        ('bob', 5000, '2026-10-15', '2026-10-15T23:30:00+00:00', '2026-10-16T02:00:00+00:00'),
+    ])
+    assert ingestion.compact_staging_rows(cutoff) == 2
+
+    assert table_rows(local_client, "user_steps") == [
+        ('alice', date(2026, 10, 15), 9000),
+        ('bob', date(2026, 10, 15), 5000),
+    ]
+    assert table_rows(local_client, "user_steps_input") == []
+
+def test_compaction_leaves_rows_written_after_the_cutoff(ingestion, local_client):
+    cutoff = datetime(2026, 10, 16, 6, tzinfo=timezone.utc)
+    stage(local_client, [
+        # Synced long before the cutoff but only written after it
+        ('alice', 7000, '2026-10-14', '2026-10-14T20:00:00+00:00', '2026-10-16T07:00:00+00:00'),
+        ('bob', 3000, '2026-10-15', '2026-10-15T20:00:00+00:00', '2026-10-15T20:00:01+00:00'),
+        # Staged before ingested_at existed, so settled by its sync time
+        ('carol', 8000, '2026-10-15', '2026-10-15T21:00:00+00:00', None),
+        ('dave', 2000, '2026-10-16', '2026-10-16T08:00:00+00:00', None),
+    ])
+
+    assert ingestion.compact_staging_rows(cutoff) == 2
+    assert ingestion.compact_staging_rows(cutoff) == 0
+
+    assert table_rows(local_client, "user_steps") == [
+        ('bob', date(2026, 10, 15), 3000),
+        ('carol', date(2026, 10, 15), 8000),
+    ]
+    assert table_rows(local_client, "user_steps_input") == [
+        ('alice', date(2026, 10, 14), 7000),
+        ('dave', date(2026, 10, 16), 2000),
+    ]
+
+class BatchRequest:
+    method = 'POST'
+
+    def __init__(self, payloads):
+        self.body = "\n".join(json.dumps(payload) for payload in payloads)
+
+    def get_data(self, as_text=False):
+        return self.body
+
+class FailingWriter:
+    """Fails every row, as an outage would, except Carol's, which it rejects as invalid"""
+
+    def write(self, rows, row_ids=None):
+        return [
+            {'index': index, 'errors': [{'reason': 'invalid' if row['name'] == 'carol' else 'backendError'}]}
+            for index, row in enumerate(rows)
+        ]
+
+def batch(ingestion, payloads):
+    body, status, _ = ingestion.insert_batch_to_bigquery(BatchRequest(payloads))
+    response = json.loads(body)
+    return status, [(result['status'], result.get('retryable')) for result in response['results']]
+
+def test_batch_with_invalid_payloads_and_a_failed_write_reports_each_item(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion, "writer", FailingWriter())
+
+    status, results = batch(ingestion, [
+        {'name': 'alice', 'steps': [100], 'date': '2026-10-16'},
+        {'name': 'bob', 'steps': ['many'], 'date': '2026-10-16'},
+        {'name': 'carol', 'steps': [300], 'date': '2026-10-16'},
+    ])
+
+    assert status == 207
+    assert results == [('error', True), ('error', False), ('error', False)]
+
+def test_batch_whose_write_failed_can_be_retried_whole(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion, "writer", FailingWriter())
+
+    status, results = batch(ingestion, [
+        {'name': 'alice', 'steps': [100], 'date': '2026-10-16'},
+        {'name': 'bob', 'steps': [200], 'date': '2026-10-16'},
+    ])
+
+    assert status == 500
+    assert results == [('error', True), ('error', True)]
+
+def test_batch_of_partly_invalid_payloads(ingestion, local_client, monkeypatch):
+    from writers import InsertAllWriter
+    monkeypatch.setattr(ingestion, "writer", InsertAllWriter(local_client, ingestion.table_cache))
+
+    status, results = batch(ingestion, [
+        {'name': 'alice', 'steps': [100], 'date': '2026-10-16'},
+        {'name': 'bob', 'steps': [200], 'date': 'yesterday'},
+    ])
+
+    assert status == 207
+    assert results == [('ok', None), ('error', False)]
+    assert table_rows(local_client, "user_steps_input") == [('alice', date(2026, 10, 16), 100)]
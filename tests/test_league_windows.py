@@ -0,0 +1,51 @@
+"""
+League windows are the difference of two days of the cumulative rollup
+
+Runs the app's window queries on an in-memory DuckDB stand-in.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+@pytest.fixture
+def stale_series(website, local_client):
+    """Alice's cumulative series, last built two days ago"""
+    today = website.utc_today()
+    through = today - timedelta(days=2)
+    local_client.query("""
+        INSERT INTO step_lotto.league_memberships (player_id, league_id) VALUES ('alice', 'walkers')
+    """).result()
+    local_client.insert_rows_json("step_lotto.cumulative_user_steps", [
+        {'name': 'alice', 'day': (through - timedelta(days=1)).isoformat(), 'cumulative_steps': 1000,
+         'updated_at': datetime.now(timezone.utc).isoformat()},
+        {'name': 'alice', 'day': through.isoformat(), 'cumulative_steps': 3000,
+         'updated_at': datetime.now(timezone.utc).isoformat()},
+    ])
+    local_client.insert_rows_json("step_lotto.rollup_state", [
+        {'rollup': 'cumulative_user_steps', 'watermark': f"{through.isoformat()}T00:00:00+00:00",
+         'refreshed_at': datetime.now(timezone.utc).isoformat()},
+    ])
+    return today, through
+
+def test_window_starting_after_the_series_is_empty(website, stale_series):
+    today, _ = stale_series
+
+    summary = website.league_window_summary('walkers', today, today)
+
+    assert summary == {'members': 1, 'total_steps': 0, 'zero_members': 1}
+    assert website.league_window_leaderboard('walkers', today, today)['total_steps'].to_pylist() == [0]
+
+def test_window_overlapping_the_series_ends_at_its_last_day(website, stale_series):
+    today, through = stale_series
+
+    assert website.league_window_summary('walkers', through, today)['total_steps'] == 2000
+    assert website.league_window_summary('walkers', through - timedelta(days=1), today)['total_steps'] == 3000
+
+def test_window_leaderboard_is_compact(website, stale_series):
+    today, through = stale_series
+
+    leaderboard = website.league_window_leaderboard('walkers', through, today)
+
+    assert leaderboard.schema == website.LEADERBOARD_SCHEMA
+    assert str(leaderboard.to_pandas()['player_id'].dtype) == 'category'
+    assert leaderboard.to_pylist() == [{'rank': 1, 'player_id': 'alice', 'total_steps': 2000}]
@@ -0,0 +1,42 @@
+"""
+Streaming inserts into the local DuckDB stand-in
+"""
+import pytest
+
+def steps(client):
+    rows = client.query("SELECT name, steps FROM step_lotto.user_steps_input ORDER BY name").result()
+    return [tuple(row.values()) for row in rows]
+
+def row(name, steps):
+    return {'name': name, 'steps': steps, 'date': '2026-10-16', 'timestamp': '2026-10-16T12:00:00+00:00'}
+
+def test_repeated_insert_ids_are_dropped(local_client):
+    assert local_client.insert_rows_json(
+        "step_lotto.user_steps_input", [row('alice', 100), row('alice', 100)], row_ids=['a', 'a']
+    ) == []
+    assert local_client.insert_rows_json("step_lotto.user_steps_input", [row('alice', 100)], row_ids=['a']) == []
+
+    assert steps(local_client) == [('alice', 100)]
+
+@pytest.mark.parametrize("skip_invalid_rows", [False, True])
+def test_a_rejected_row_can_be_retried_under_its_insert_id(local_client, skip_invalid_rows):
+    errors = local_client.insert_rows_json(
+        "step_lotto.user_steps_input",
+        [row('alice', 'lots'), row('bob', 200)],
+        row_ids=['a', 'b'],
+        skip_invalid_rows=skip_invalid_rows,
+    )
+    assert errors[0]['index'] == 0
+
+    assert local_client.insert_rows_json(
+        "step_lotto.user_steps_input", [row('alice', 100), row('bob', 200)], row_ids=['a', 'b']
+    ) == []
+
+    assert steps(local_client) == [('alice', 100), ('bob', 200)]
+
+def test_rows_without_insert_ids_are_never_dropped(local_client):
+    assert local_client.insert_rows_json(
+        "step_lotto.user_steps_input", [row('alice', 100), row('bob', 200)], row_ids=[None, None]
+    ) == []
+
+    assert steps(local_client) == [('alice', 100), ('bob', 200)]
@@ -0,0 +1,96 @@
+"""
+The lookup store's incremental syncs and its fallback to BigQuery
+
+Syncs from an in-memory DuckDB stand-in into a SQLite store in tmp_path.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+@pytest.fixture
+def lookups(website):
+    from data import lookup_store
+    return lookup_store
+
+@pytest.fixture
+def store(lookups, tmp_path):
+    return lookups.SqliteLookupStore(str(tmp_path / "lookups.sqlite3"))
+
+def add_users(client, users):
+    """Insert (user_id, created_at) rows; created_at None stands for a backfilled row"""
+    assert client.insert_rows_json("step_lotto.user_ids", [
+        {'user_id': user_id, 'created_at': created_at and created_at.isoformat()}
+        for user_id, created_at in users
+    ]) == []
+
+def add_daily_steps(client, name, updated_at):
+    assert client.insert_rows_json("step_lotto.daily_user_steps", [
+        {'name': name, 'day': '2024-01-02', 'total_steps': 5000, 'updated_at': updated_at.isoformat()}
+    ]) == []
+
+def test_incremental_sync_only_copies_what_changed(lookups, store, local_client, monkeypatch):
+    now = datetime.now(timezone.utc)
+    add_users(local_client, [('alice', None), ('bob', now - timedelta(days=30))])
+    # Alice's steps are years old, and still count
+    add_daily_steps(local_client, 'alice', now - timedelta(days=800))
+    synced = lookups.SyncedKeys()
+
+    lookups.sync_from_bigquery(store, synced)
+    assert store.user_exists('alice') == (True, True)
+    assert store.user_exists('bob') == (True, False)
+
+    copied = []
+    upsert_all = store.upsert_all
+    def recording_upsert_all(users, leagues, memberships):
+        copied.append(list(users))
+        upsert_all(users, leagues, memberships)
+    monkeypatch.setattr(store, "upsert_all", recording_upsert_all)
+
+    # A sign-up, a backfilled user without created_at, and Bob's first steps
+    add_users(local_client, [('carol', now), ('dave', None)])
+    add_daily_steps(local_client, 'bob', now)
+    lookups.sync_from_bigquery(store, synced)
+
+    assert sorted(copied[0]) == [('bob', True), ('carol', False)]
+    assert store.user_exists('dave') == (False, False)
+
+    # The next full sync picks up rows written without created_at
+    synced.full_started_at -= lookups.LOOKUP_FULL_SYNC_SECONDS
+    lookups.sync_from_bigquery(store, synced)
+    assert copied[1] == [('dave', False)]
+
+def test_lookups_fall_back_to_bigquery_while_the_store_cannot_sync(lookups, store, local_client, monkeypatch):
+    add_users(local_client, [('alice', None)])
+    add_daily_steps(local_client, 'alice', datetime.now(timezone.utc))
+    local_client.query("INSERT INTO step_lotto.leagues (league_id) VALUES ('walkers')").result()
+    local_client.query("""
+        INSERT INTO step_lotto.league_memberships (player_id, league_id) VALUES ('alice', 'walkers')
+    """).result()
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("BigQuery is unavailable")
+    monkeypatch.setattr(lookups, "run_query_arrow", unavailable)
+    sync = lookups.LookupStoreSync(store)
+
+    fallback = sync.fresh_store()
+    with sync.lock:
+        pass  # the failed background sync has finished
+
+    assert sync.fresh_store() is fallback
+    assert fallback.user_exists('alice') == (True, True)
+    assert fallback.user_exists('bob') == (False, False)
+    assert fallback.is_member('alice', 'walkers')
+    assert fallback.claim_league('walkers') is False
+    assert fallback.claim_league('runners') is True
+    assert store.league_exists('runners')
+
+def test_a_synced_store_answers_lookups(lookups, store, local_client):
+    add_users(local_client, [('alice', None)])
+    sync = lookups.LookupStoreSync(store)
+
+    assert isinstance(sync.fresh_store(), lookups.BigQueryLookups)
+    with sync.lock:
+        pass
+
+    assert sync.fresh_store() is store
+    assert store.user_exists('alice') == (True, False)
@@ -0,0 +1,31 @@
+"""
+Rebuilding an unpartitioned steps table on the local DuckDB stand-in
+"""
+import pytest
+
+@pytest.mark.parametrize("table_id, extra_column", [
+    ("user_steps", "compacted_at"),
+    ("user_steps_input", "ingested_at"),
+])
+def test_rebuild_keeps_every_column_and_the_newest_reading(local_client, table_id, extra_column):
+    from schema.migrate import rebuild_steps_table
+
+    local_client.query(f"DROP TABLE step_lotto.{table_id}").result()
+    local_client.query(f"""
+        CREATE TABLE step_lotto.{table_id} (
+            name STRING, steps INT64, date DATE, timestamp TIMESTAMP, {extra_column} TIMESTAMP
+        )
+    """).result()
+    local_client.query(f"""
+        INSERT INTO step_lotto.{table_id} VALUES
+            (' Alice', 5000, DATE '2026-10-01', TIMESTAMP '2026-10-01 10:00:00', TIMESTAMP '2026-10-02 00:00:00'),
+            ('alice', 7000, DATE '2026-10-01', TIMESTAMP '2026-10-01 12:00:00', TIMESTAMP '2026-10-02 01:00:00')
+    """).result()
+
+    rebuild_steps_table(local_client, table_id)
+
+    assert [field.name for field in local_client.get_table(f"step_lotto.{table_id}").schema] == [
+        "name", "steps", "date", "timestamp", extra_column
+    ]
+    rows = local_client.query(f"SELECT name, steps, {extra_column} FROM step_lotto.{table_id}").result()
+    assert [(row['name'], row['steps'], row[extra_column].hour) for row in rows] == [('alice', 7000, 1)]
@@ -0,0 +1,73 @@
+"""
+Incremental rollups must pick up every compacted reading, however old its sync time
+
+Runs compaction and the rollups on one in-memory DuckDB stand-in.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+@pytest.fixture
+def pipeline(load_function, local_client, monkeypatch):
+    ingestion = load_function("ingestion")
+    rollups = load_function("rollups")
+    monkeypatch.setattr(ingestion, "client", local_client)
+    monkeypatch.setattr(rollups, "client", local_client)
+    return ingestion, rollups, local_client
+
+def stage(client, name, steps, day, synced_at, ingested_at):
+    errors = client.insert_rows_json("step_lotto.user_steps_input", [{
+        'name': name,
+        'steps': steps,
+        'date': day.isoformat(),
+        'timestamp': synced_at.isoformat(),
+        'ingested_at': ingested_at.isoformat(),
+    }])
+    assert errors == []
+
+def daily_totals(client):
+    rows = client.query("SELECT name, day, total_steps FROM step_lotto.daily_user_steps").result()
+    return {(row.name, row.day): row.total_steps for row in rows}
+
+def league_totals(client):
+    rows = client.query("SELECT player_id, total_steps FROM step_lotto.league_totals").result()
+    return {row.player_id: row.total_steps for row in rows}
+
+def test_late_compacted_row_with_old_sync_time_is_rolled_up(pipeline):
+    ingestion, rollups, client = pipeline
+    now = datetime.now(timezone.utc)
+    day = date.today() - timedelta(days=1)
+    client.query("""
+        INSERT INTO step_lotto.league_memberships (player_id, league_id)
+        VALUES ('alice', 'walkers'), ('bob', 'walkers')
+    """).result()
+
+    stage(client, 'alice', 5000, day, synced_at=now - timedelta(hours=1), ingested_at=now - timedelta(hours=1))
+    assert ingestion.compact_staging_rows(now) == 1
+    assert rollups.refresh_rollups()['changed_rows'] == 1
+
+    # Bob synced two hours ago, before Alice, but his row was only written
+    # (a Pub/Sub redelivery, say) after the rollup had moved its watermark on
+    stage(client, 'bob', 7000, day, synced_at=now - timedelta(hours=2), ingested_at=now)
+    assert ingestion.compact_staging_rows(now) == 1
+    assert rollups.refresh_rollups()['changed_rows'] == 1
+
+    assert daily_totals(client) == {('alice', day): 5000, ('bob', day): 7000}
+    assert league_totals(client) == {'alice': 5000, 'bob': 7000}
+
+def test_late_older_reading_does_not_replace_newer_one(pipeline):
+    ingestion, rollups, client = pipeline
+    now = datetime.now(timezone.utc)
+    day = date.today() - timedelta(days=1)
+
+    stage(client, 'alice', 5000, day, synced_at=now - timedelta(hours=1), ingested_at=now - timedelta(hours=1))
+    ingestion.compact_staging_rows(now)
+    rollups.refresh_rollups()
+
+    # An older reading for the same day arrives late: compaction keeps the
+    # newer one, so there is nothing new to roll up
+    stage(client, 'alice', 3000, day, synced_at=now - timedelta(hours=3), ingested_at=now)
+    ingestion.compact_staging_rows(now)
+    assert rollups.refresh_rollups()['changed_rows'] == 0
+
+    assert daily_totals(client) == {('alice', day): 5000}
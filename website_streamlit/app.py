@@ -8,11 +8,6 @@ from setup_steps.setup_steps import show_setup_steps_page
 def main():
     st.set_page_config(page_title="Step Lotto", page_icon="🔐")
     
-    # Configuration - UPDATE THESE WITH YOUR BIGQUERY DETAILS
-    PROJECT_ID = "my-project-1706650764881"
-    DATASET_ID = "step_lotto"  
-    TABLE_ID = "user_steps"
-    
     # Initialize session state
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
@@ -25,16 +20,16 @@ def main():
     
     # Route to appropriate page
     if not st.session_state.logged_in:
-        show_login_page(PROJECT_ID, DATASET_ID)
+        show_login_page()
     else:
         if st.session_state.page == "create_league":
-            show_create_league_page(PROJECT_ID, DATASET_ID)
+            show_create_league_page()
         elif st.session_state.page == "league_page":
-            show_league_page(st.session_state.current_league, PROJECT_ID, DATASET_ID)
+            show_league_page(st.session_state.current_league)
         elif st.session_state.page == "setup_steps":
-            show_setup_steps_page(PROJECT_ID, DATASET_ID, TABLE_ID)
+            show_setup_steps_page()
         else:
-            show_homepage(PROJECT_ID, DATASET_ID, TABLE_ID)
+            show_homepage()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,62 +1,7 @@
 import streamlit as st
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from data.queries import LeagueOutcome, create_league
 
-@st.cache_resource
-def init_bigquery_client():
-    """Initialize BigQuery client using service account from secrets"""
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    return bigquery.Client(
-        credentials=credentials,
-        project="my-project-1706650764881"
-    )
-
-def check_league_exists(client, league_name, project_id, dataset_id, leagues_table):
-    """Check if league name already exists in BigQuery table"""
-    query = f"""
-    SELECT COUNT(*) as count
-    FROM `{project_id}.{dataset_id}.{leagues_table}`
-    WHERE league_id = @league_name
-    """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("league_name", "STRING", league_name)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    for row in results:
-        return row.count > 0
-    return False
-
-def create_league(client, league_name, project_id, dataset_id, leagues_table):
-    """Add new league to BigQuery leagues table"""
-    table_ref = client.dataset(dataset_id, project=project_id).table(leagues_table)
-    table = client.get_table(table_ref)
-    
-    # Create row to insert
-    rows_to_insert = [{"league_id": league_name}]
-    
-    errors = client.insert_rows_json(table, rows_to_insert)
-    return len(errors) == 0
-
-def add_league_membership(client, username, league_name, project_id, dataset_id, memberships_table):
-    """Add user to league membership table"""
-    table_ref = client.dataset(dataset_id, project=project_id).table(memberships_table)
-    table = client.get_table(table_ref)
-    
-    # Create row to insert
-    rows_to_insert = [{"player_id": username, "league_id": league_name}]
-    
-    errors = client.insert_rows_json(table, rows_to_insert)
-    return len(errors) == 0
-
-def show_create_league_page(project_id, dataset_id):
+def show_create_league_page():
     """Display the create league page"""
     st.title("🏆 Create League")
     
@@ -74,39 +19,17 @@ def show_create_league_page(project_id, dataset_id):
     if st.button("Create League", type="primary"):
         if league_name.strip():
             try:
-                # Initialize BigQuery client
-                client = init_bigquery_client()
-                
-                # Check if league already exists
-                league_exists = check_league_exists(client, league_name.strip(), project_id, dataset_id, "leagues")
+                # Create the league and add the user to it in one transaction
+                outcome = create_league(st.session_state.username, league_name.strip())
                 
-                if league_exists:
-                    st.error(f"League '{league_name}' already exists. Please choose a different name.")
+                if outcome == LeagueOutcome.CREATED:
+                    st.success(f"League '{league_name}' created successfully! You are now a member.")
+                    st.info("Returning to homepage in 3 seconds...")
+                    # Optional: Auto redirect after success
+                    # st.session_state.page = "homepage"
+                    # st.rerun()
                 else:
-                    # Create the league
-                    league_created = create_league(client, league_name.strip(), project_id, dataset_id, "leagues")
-                    
-                    if league_created:
-                        # Add user to league membership
-                        membership_added = add_league_membership(
-                            client, 
-                            st.session_state.username, 
-                            league_name.strip(), 
-                            project_id, 
-                            dataset_id, 
-                            "league_memberships"
-                        )
-                        
-                        if membership_added:
-                            st.success(f"League '{league_name}' created successfully! You are now a member.")
-                            st.info("Returning to homepage in 3 seconds...")
-                            # Optional: Auto redirect after success
-                            # st.session_state.page = "homepage"
-                            # st.rerun()
-                        else:
-                            st.error("League created but failed to add you as a member. Please contact support.")
-                    else:
-                        st.error("Failed to create league. Please try again.")
+                    st.error(f"League '{league_name}' already exists. Please choose a different name.")
                         
             except Exception as e:
                 st.error(f"Error creating league: {str(e)}")
@@ -0,0 +1,109 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+from google.cloud import bigquery
+from google.oauth2 import service_account
+
+# Configure your BigQuery details
+PROJECT_ID = "my-project-1706650764881"
+DATASET_ID = "step_lotto"
+
+STEPS_TABLE = "user_steps"
+STAGING_STEPS_TABLE = "user_steps_input"
+USERS_TABLE = "user_ids"
+LEAGUES_TABLE = "leagues"
+MEMBERSHIPS_TABLE = "league_memberships"
+DAILY_STEPS_TABLE = "daily_user_steps"
+LEAGUE_TOTALS_TABLE = "league_totals"
+CUMULATIVE_STEPS_TABLE = "cumulative_user_steps"
+ROLLUP_STATE_TABLE = "rollup_state"
+DRAWS_TABLE = "draws"
+
+# Keys of the rollup_state rows written by rollups/main.py (STEPS_ROLLUP and
+# CUMULATIVE_ROLLUP there): the newest user_steps compacted_at rolled up, and
+# the last day the cumulative series reaches
+STEPS_ROLLUP = "user_steps"
+CUMULATIVE_ROLLUP = "cumulative_user_steps"
+
+# Results with at least this many rows are downloaded through the BigQuery
+# Storage Read API, which streams Arrow record batches instead of paging
+# JSON rows through the REST API. Below it, opening a read session costs
+# more than it saves
+STORAGE_READ_MIN_ROWS = 5000
+
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+# Player ID columns are dictionary-encoded, so pandas reads them as
+# categoricals instead of one Python string object per row
+DICTIONARY_COLUMNS = ("player_id", "winner_id")
+PLAYER_ID_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+@st.cache_resource
+def get_client():
+    """
+    Initialize BigQuery client using service account from secrets
+    
+    With STEPLOTTO_BACKEND=local the DuckDB stand-in in local_bigquery is
+    used instead, so the app runs without GCP credentials.
+    """
+    if os.environ.get("STEPLOTTO_BACKEND") == "local":
+        from local_bigquery.client import LocalClient
+        return LocalClient()
+    
+    return bigquery.Client(
+        credentials=service_account_credentials(),
+        project=PROJECT_ID
+    )
+
+def service_account_credentials():
+    """Service account credentials from secrets, shared by every Google client the app uses"""
+    return service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"]
+    )
+
+def table_path(table_id: str) -> str:
+    """Fully qualified, quoted table name for use in queries"""
+    return f"`{PROJECT_ID}.{DATASET_ID}.{table_id}`"
+
+def run_query(query: str, query_parameters: list | None = None):
+    """Run a parameterized query and wait for its rows"""
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+    query_job = get_client().query(query, job_config=job_config)
+    return query_job.result()
+
+def compact_table(table: pa.Table) -> pa.Table:
+    """
+    Downcast 64-bit integer columns to int32 wherever every value fits, and
+    dictionary-encode player IDs
+
+    BigQuery returns every integer as INT64, but daily steps, windowed and
+    all-time totals and ranks all fit in 32 bits, halving their memory.
+    """
+    for index, field in enumerate(table.schema):
+        if field.name in DICTIONARY_COLUMNS and pa.types.is_string(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(PLAYER_ID_TYPE))
+        elif pa.types.is_int64(field.type) and table.num_rows:
+            bounds = pc.min_max(table.column(index))
+            low, high = bounds['min'].as_py(), bounds['max'].as_py()
+            if low is None or (low >= INT32_MIN and high <= INT32_MAX):
+                table = table.set_column(index, field.name, table.column(index).cast(pa.int32()))
+    return table
+
+def run_query_arrow(query: str, query_parameters: list | None = None) -> pa.Table:
+    """
+    Run a parameterized query and download its rows as a compact Arrow table
+
+    Large results come through the Storage Read API. Either way no Python
+    object is built per row, and DATE columns stay date32.
+    """
+    results = run_query(query, query_parameters)
+    use_storage_api = (results.total_rows or 0) >= STORAGE_READ_MIN_ROWS
+    return compact_table(results.to_arrow(create_bqstorage_client=use_storage_api))
+
+def insert_rows(table_id: str, rows: list[dict]) -> bool:
+    """Stream rows into a table, returning True if every row was accepted"""
+    client = get_client()
+    table_ref = client.dataset(DATASET_ID, project=PROJECT_ID).table(table_id)
+    errors = client.insert_rows_json(table_ref, rows)
+    return len(errors) == 0
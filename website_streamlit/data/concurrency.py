@@ -0,0 +1,38 @@
+import threading
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Query functions spend nearly all their time waiting on BigQuery, so a small
+# thread pool is enough to overlap every independent query a page needs
+MAX_WORKERS = 8
+
+@st.cache_resource
+def get_executor():
+    """Thread pool shared by all sessions for running independent queries"""
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="steplotto-query")
+
+def fetch_concurrently(**calls):
+    """
+    Run independent data-layer calls at the same time and wait for all of them
+
+    Each keyword argument is a (function, *args) tuple, and the result is a dict
+    with the same keys. Page time becomes the slowest call rather than the sum.
+    Worker threads are attached to the caller's script run context so cached
+    functions and st.* calls behave as they would on the main thread.
+
+        results = fetch_concurrently(
+            leaderboard=(league_leaderboard, league_id),
+            draw=(latest_league_draw, league_id),
+        )
+    """
+    ctx = get_script_run_ctx()
+
+    def run(function, *args):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return function(*args)
+
+    executor = get_executor()
+    futures = {key: executor.submit(run, *call) for key, call in calls.items()}
+    return {key: future.result() for key, future in futures.items()}
@@ -0,0 +1,51 @@
+"""
+Downsampling for long step series
+
+lttb_indices implements Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+The series is split into equal buckets, and from each one it keeps the point
+that forms the largest triangle with the point kept from the previous bucket
+and the average of the next. Peaks and troughs survive, so a few hundred
+points still look like years of daily history.
+"""
+import numpy as np
+
+def lttb_indices(x, y, threshold):
+    """
+    Pick at most threshold points of a series, always keeping the first and last
+
+    Args:
+        x (array): Ascending x values, e.g. day ordinals
+        y (array): Values at each x
+        threshold (int): Number of points to keep
+
+    Returns:
+        array: Indexes of the kept points, ascending
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Points between the fixed first and last are split into threshold - 2 buckets
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Twice the triangle area for each candidate point in the bucket
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+
+    return kept
@@ -0,0 +1,322 @@
+"""
+In-memory all-time leaderboards, kept in step with ingestion
+
+Ranking a league used to mean an ORDER BY over its league totals on every
+page view. LeaderboardIndex holds each league's members in a sorted list
+keyed by (-total_steps, player_id) instead, so a page of N members or a
+member's neighbourhood costs O(log n + N), and a member's rank O(log n).
+
+BigQuery stays the system of record. The index is bootstrapped from
+league_totals as of the rollup watermark, then polled for rows the rollups
+have not absorbed yet: everything still staged, plus rows compacted into
+user_steps after the watermark. A player's live total is
+their rolled-up total plus the difference between their newest readings and
+the rolled-up days they replace. Each poll recomputes that difference from
+the watermark rather than from the previous poll, so a repeated or
+overlapping poll never counts a reading twice. When the hourly rollup moves
+the watermark on, the index is rebuilt from the fresh totals.
+
+Readings for days more than INDEX_FEED_LOOKBACK_DAYS old (long backfills)
+only show up once the rollup has absorbed them.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+from google.cloud import bigquery
+from sortedcontainers import SortedList
+
+from data.client import (
+    STEPS_TABLE,
+    STAGING_STEPS_TABLE,
+    MEMBERSHIPS_TABLE,
+    DAILY_STEPS_TABLE,
+    LEAGUE_TOTALS_TABLE,
+    ROLLUP_STATE_TABLE,
+    STEPS_ROLLUP,
+    table_path,
+    run_query,
+)
+
+# How often a read may trigger a poll for newly ingested rows
+INDEX_POLL_SECONDS = 60
+
+# Only readings for this many recent days are applied between rollups
+INDEX_FEED_LOOKBACK_DAYS = 14
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+class LeaderboardIndex:
+    """Per-league sorted step totals with O(log n) updates and rank lookups"""
+
+    def __init__(self):
+        self.watermark = None
+        self.synced_at = 0.0
+        self.generation = 0
+        self._revisions = defaultdict(int)
+        self._leagues = defaultdict(SortedList)
+        self._league_players = defaultdict(set)
+        self._league_sums = defaultdict(int)
+        self._totals = {}
+        self._base_totals = {}
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def load(self, rows, watermark):
+        """
+        Replace the whole index with (league_id, player_id, total_steps) rows
+
+        The totals become the base that later polls add their differences to.
+        A player's all-time total is the same in every league, except that a
+        membership newer than the last rollup comes back as 0, so the
+        largest of their rows is taken.
+        """
+        leagues = defaultdict(list)
+        league_players = defaultdict(set)
+        league_sums = defaultdict(int)
+        totals = {}
+        for league_id, player_id, total_steps in rows:
+            totals[player_id] = max(totals.get(player_id, 0), int(total_steps))
+            league_players[player_id].add(league_id)
+        for player_id, league_ids in league_players.items():
+            for league_id in league_ids:
+                leagues[league_id].append((-totals[player_id], player_id))
+                league_sums[league_id] += totals[player_id]
+
+        with self._lock:
+            self._leagues = defaultdict(SortedList, {
+                league_id: SortedList(keys) for league_id, keys in leagues.items()
+            })
+            self._league_players = league_players
+            self._league_sums = league_sums
+            self._totals = totals
+            self._base_totals = dict(totals)
+            self.watermark = watermark
+            self.generation += 1
+            self._revisions = defaultdict(int)
+
+    def set_total(self, player_id, total_steps):
+        """Move a player to a new total in every league they belong to"""
+        total_steps = int(total_steps)
+        with self._lock:
+            old_total = self._totals.get(player_id)
+            if old_total == total_steps:
+                return
+            self._totals[player_id] = total_steps
+            for league_id in self._league_players.get(player_id, ()):
+                league = self._leagues[league_id]
+                if old_total is not None:
+                    league.discard((-old_total, player_id))
+                league.add((-total_steps, player_id))
+                self._league_sums[league_id] += total_steps - (old_total or 0)
+                self._revisions[league_id] += 1
+
+    def apply_deltas(self, deltas):
+        """Set each player's total to their rolled-up total plus the change since the watermark"""
+        with self._lock:
+            for player_id, delta in deltas:
+                self.set_total(player_id, self._base_totals.get(player_id, 0) + int(delta))
+
+    def add_member(self, league_id, player_id):
+        """Add a player who has just joined a league, at their current total"""
+        with self._lock:
+            if league_id in self._league_players[player_id]:
+                return
+            self._league_players[player_id].add(league_id)
+            total_steps = self._totals.setdefault(player_id, 0)
+            self._leagues[league_id].add((-total_steps, player_id))
+            self._league_sums[league_id] += total_steps
+            self._revisions[league_id] += 1
+
+    def _ranked(self, league, start, stop):
+        """(rank, player_id, total_steps) for sorted positions start to stop, ties sharing a rank"""
+        rows = []
+        rank = previous = None
+        for position, (negative_total, player_id) in enumerate(league.islice(start, stop), start=start):
+            if negative_total != previous:
+                # Only the first of a run of equal totals needs a search
+                rank = position + 1 if rows else league.bisect_left((negative_total, "")) + 1
+                previous = negative_total
+            rows.append((rank, player_id, -negative_total))
+        return rows
+
+    def top(self, league_id, n=None, offset=0):
+        """
+        Members ranked by total steps, highest first
+
+        Returns:
+            list: (rank, player_id, total_steps) tuples for n members from
+            offset, or to the end of the league when n is None
+        """
+        with self._lock:
+            league = self._leagues.get(league_id)
+            if not league:
+                return []
+            stop = None if n is None else offset + n
+            return self._ranked(league, offset, stop)
+
+    def around(self, league_id, player_id, k):
+        """
+        A member and the k members either side of them in the ranking
+
+        Returns:
+            list: (rank, player_id, total_steps) tuples, empty if the player
+            is not in the league
+        """
+        with self._lock:
+            league = self._leagues.get(league_id)
+            total_steps = self._totals.get(player_id)
+            if not league or total_steps is None or league_id not in self._league_players.get(player_id, ()):
+                return []
+            position = league.index((-total_steps, player_id))
+            return self._ranked(league, max(position - k, 0), position + k + 1)
+
+    def rank(self, league_id, player_id):
+        """
+        A member's 1-based rank, shared with anyone on the same total
+
+        Returns:
+            int | None: The rank, or None if the player is not in the league
+        """
+        with self._lock:
+            league = self._leagues.get(league_id)
+            total_steps = self._totals.get(player_id)
+            if not league or total_steps is None or league_id not in self._league_players.get(player_id, ()):
+                return None
+            return league.bisect_left((-total_steps, "")) + 1
+
+    def version(self, league_id):
+        """Changes whenever the league's ranking does, for keying caches built from it"""
+        with self._lock:
+            return f"{self.generation}.{self._revisions.get(league_id, 0)}"
+
+    def size(self, league_id):
+        with self._lock:
+            league = self._leagues.get(league_id)
+            return len(league) if league else 0
+
+    def summary(self, league_id):
+        """
+        Member count, total steps and members on 0 steps, without walking the league
+
+        Returns:
+            dict: members, total_steps, zero_members
+        """
+        with self._lock:
+            league = self._leagues.get(league_id)
+            if not league:
+                return {'members': 0, 'total_steps': 0, 'zero_members': 0}
+            # Zero totals sort last, as (0, player_id)
+            return {
+                'members': len(league),
+                'total_steps': self._league_sums[league_id],
+                'zero_members': len(league) - league.bisect_left((0, "")),
+            }
+
+    def sync(self):
+        """Rebuild from the rollups if they have moved on, then apply rows ingested since"""
+        watermark = rollup_watermark()
+        if watermark != self.watermark:
+            self.load(fetch_league_totals(), watermark)
+        self.apply_deltas(fetch_deltas_since(watermark))
+        self.synced_at = time.monotonic()
+
+    def sync_if_stale(self, max_age=INDEX_POLL_SECONDS):
+        """
+        Sync if the last one is older than max_age seconds
+
+        Only one caller polls at a time; the others carry on with the
+        current, slightly older totals instead of waiting.
+        """
+        if self.watermark is not None and time.monotonic() - self.synced_at < max_age:
+            return
+        if not self._sync_lock.acquire(blocking=self.watermark is None):
+            return
+        try:
+            if self.watermark is None or time.monotonic() - self.synced_at >= max_age:
+                self.sync()
+        finally:
+            self._sync_lock.release()
+
+def rollup_watermark() -> datetime:
+    """Newest user_steps compacted_at the rollups include"""
+    query = f"""
+    SELECT watermark
+    FROM {table_path(ROLLUP_STATE_TABLE)}
+    WHERE rollup = @rollup
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("rollup", "STRING", STEPS_ROLLUP)
+    ])
+
+    for row in results:
+        return row.watermark
+    return EPOCH
+
+def fetch_league_totals() -> list[tuple]:
+    """Every membership with its rolled-up all-time total, 0 for members with no steps"""
+    query = f"""
+    SELECT
+        lm.league_id,
+        lm.player_id,
+        COALESCE(lt.total_steps, 0) as total_steps
+    FROM {table_path(MEMBERSHIPS_TABLE)} lm
+    LEFT JOIN {table_path(LEAGUE_TOTALS_TABLE)} lt
+        ON lt.league_id = lm.league_id AND lt.player_id = lm.player_id
+    """
+
+    return [(row.league_id, row.player_id, row.total_steps) for row in run_query(query)]
+
+def fetch_deltas_since(watermark: datetime) -> list[tuple]:
+    """
+    Each player's change in all-time steps from rows the rollups have not absorbed
+
+    Those are every staged row, since compaction removes rows from staging
+    as it merges them, and every user_steps row compacted after the
+    watermark. Neither is picked by sync time, so a late reading with an
+    old sync time still counts. The newest reading of each user-day
+    replaces that day's rolled-up total.
+    """
+    query = f"""
+    WITH latest AS (
+        SELECT name, date, steps
+        FROM (
+            SELECT name, date, steps, timestamp FROM {table_path(STAGING_STEPS_TABLE)}
+            UNION ALL
+            SELECT name, date, steps, timestamp FROM {table_path(STEPS_TABLE)}
+            WHERE compacted_at > @watermark
+        )
+        WHERE date >= @feed_from
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY name, date ORDER BY timestamp DESC) = 1
+    )
+    SELECT
+        l.name,
+        SUM(l.steps - COALESCE(d.total_steps, 0)) as delta
+    FROM latest l
+    LEFT JOIN {table_path(DAILY_STEPS_TABLE)} d
+        ON d.name = l.name AND d.day = l.date AND d.day >= @feed_from
+    GROUP BY l.name
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+        bigquery.ScalarQueryParameter(
+            "feed_from", "DATE", datetime.now(timezone.utc).date() - timedelta(days=INDEX_FEED_LOOKBACK_DAYS)
+        )
+    ])
+
+    return [(row.name, row.delta) for row in results]
+
+@st.cache_resource
+def get_leaderboard_index() -> LeaderboardIndex:
+    """Leaderboard index shared by all sessions, built on first use"""
+    return LeaderboardIndex()
+
+def leaderboard_index() -> LeaderboardIndex:
+    """The shared index, polled for new rows if it has not been recently"""
+    index = get_leaderboard_index()
+    index.sync_if_stale()
+    return index
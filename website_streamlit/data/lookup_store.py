@@ -0,0 +1,514 @@
+"""
+Point lookups for users, leagues and memberships
+
+Login, sign-up, create-league and join only need yes/no answers, and a
+BigQuery job spends far longer being scheduled than answering them. The
+lookup store keeps the keys of user_ids, leagues and league_memberships,
+plus whether each user has synced steps, in a store that answers in
+milliseconds. BigQuery stays the system of record:
+
+- the app's own writes go to BigQuery and are then written through to the
+  store, so they are visible straight away
+- everything else (other replicas' writes, steps synced from phones) is
+  picked up by re-syncing from BigQuery every LOOKUP_SYNC_SECONDS. A sync
+  only reads keys created, and users whose daily steps were updated, since
+  the previous one; every LOOKUP_FULL_SYNC_SECONDS it re-reads the tables,
+  for rows written without created_at (backfills, rows added by hand)
+
+Syncs run in the background. While the store's last sync is older than
+LOOKUP_MAX_STALE_SECONDS (a cold store, or syncs that keep failing),
+lookups are answered by BigQuery instead, so a sync never holds up login
+and a failing one never breaks it.
+
+A user has steps once they have any daily_user_steps row, however old.
+
+The store is also where a new league name is claimed: claim_league
+succeeds for exactly one caller, so two people creating the same league
+at once cannot both go on to write it to BigQuery, where nothing enforces
+uniqueness. A claim is only released if its BigQuery write fails.
+
+Syncs only upsert, since the app never deletes users, leagues or
+memberships. Rows deleted from BigQuery by hand stay in the store. Each
+process remembers the keys it has already copied, so keys re-read by a
+full sync or by the overlap between syncs are not written again.
+
+Selected with STEPLOTTO_LOOKUP_STORE:
+
+    sqlite     embedded SQLite file at STEPLOTTO_LOOKUP_DB, by default in
+               the app's own .local directory (default). Enough for a
+               single replica; with several, writes made on one reach the
+               others at their next sync, and league claims are only
+               exclusive among processes sharing the file
+    firestore  Google Cloud Firestore collections shared by every replica
+"""
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+from itertools import islice
+import threading
+import time
+from urllib.parse import quote
+
+import streamlit as st
+from google.cloud import bigquery
+
+from data.client import (
+    PROJECT_ID,
+    USERS_TABLE,
+    LEAGUES_TABLE,
+    MEMBERSHIPS_TABLE,
+    DAILY_STEPS_TABLE,
+    table_path,
+    run_query,
+    run_query_arrow,
+    service_account_credentials,
+)
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_STORE = os.environ.get("STEPLOTTO_LOOKUP_STORE", "sqlite")
+
+# Beside the app rather than in the machine's shared temp directory, so two
+# deployments on one host never read each other's keys
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOOKUP_DB = os.environ.get("STEPLOTTO_LOOKUP_DB", os.path.join(APP_DIR, ".local", "steplotto_lookups.sqlite3"))
+
+# How stale the store may get before it is re-synced from BigQuery
+LOOKUP_SYNC_SECONDS = int(os.environ.get("STEPLOTTO_LOOKUP_SYNC_SECONDS", "300"))
+
+# How often a sync re-reads the tables instead of only what changed
+LOOKUP_FULL_SYNC_SECONDS = 86400
+
+# Each incremental sync re-reads this much before the previous one started,
+# for created_at values set by the app's clock and rows still being written
+LOOKUP_SYNC_OVERLAP_SECONDS = 600
+
+# Lookups go to BigQuery while the store's last sync is older than this
+LOOKUP_MAX_STALE_SECONDS = 3 * LOOKUP_SYNC_SECONDS
+
+# How long to wait before retrying a failed sync
+LOOKUP_RETRY_SECONDS = 60
+
+# Firestore accepts at most 500 writes per batch
+FIRESTORE_BATCH_SIZE = 500
+
+# Rows upserted into SQLite per transaction during a sync. The lock is
+# released between chunks, so lookups wait for one chunk at most
+SQLITE_SYNC_CHUNK_ROWS = 5000
+
+def chunks(rows, size):
+    """Split an iterable into lists of at most size items"""
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+class SqliteLookupStore:
+    """Lookup tables in a local SQLite file, shared by every session in the process"""
+
+    def __init__(self, path=LOOKUP_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, has_steps INTEGER NOT NULL) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS leagues (league_id TEXT PRIMARY KEY) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS memberships (
+                    league_id TEXT NOT NULL,
+                    player_id TEXT NOT NULL,
+                    PRIMARY KEY (league_id, player_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sync_state (id INTEGER PRIMARY KEY, synced_at REAL NOT NULL);
+            """)
+
+    def _one(self, query, parameters):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchone()
+
+    def user_exists(self, user_id):
+        """(exists, has_steps) for a user"""
+        row = self._one("SELECT has_steps FROM users WHERE user_id = ?", (user_id,))
+        return (True, bool(row[0])) if row else (False, False)
+
+    def league_exists(self, league_id):
+        return self._one("SELECT 1 FROM leagues WHERE league_id = ?", (league_id,)) is not None
+
+    def is_member(self, player_id, league_id):
+        return self._one(
+            "SELECT 1 FROM memberships WHERE league_id = ? AND player_id = ?", (league_id, player_id)
+        ) is not None
+
+    def add_user(self, user_id, has_steps=False):
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO users VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET has_steps = has_steps OR excluded.has_steps",
+                (user_id, int(has_steps))
+            )
+
+    def set_has_steps(self, user_id):
+        self.add_user(user_id, has_steps=True)
+
+    def add_league(self, league_id):
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO leagues VALUES (?)", (league_id,))
+
+    def claim_league(self, league_id):
+        """Add a league, returning False if it was already there"""
+        with self._lock:
+            return self._connection.execute("INSERT OR IGNORE INTO leagues VALUES (?)", (league_id,)).rowcount == 1
+
+    def release_league(self, league_id):
+        """Undo a claim whose BigQuery write failed"""
+        with self._lock:
+            self._connection.execute("DELETE FROM leagues WHERE league_id = ?", (league_id,))
+
+    def add_membership(self, player_id, league_id):
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO memberships VALUES (?, ?)", (league_id, player_id))
+
+    def _upsert_chunks(self, statement, rows):
+        """Run an upsert over rows, one transaction per SQLITE_SYNC_CHUNK_ROWS"""
+        for chunk in chunks(rows, SQLITE_SYNC_CHUNK_ROWS):
+            with self._lock:
+                cursor = self._connection.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    cursor.executemany(statement, chunk)
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+
+    def upsert_all(self, users, leagues, memberships):
+        """
+        Upsert keys copied from BigQuery, then record the sync time
+
+        Rows go in chunks of SQLITE_SYNC_CHUNK_ROWS, and the lock is released
+        between them so lookups are not held up by a large sync. Nothing is
+        deleted and has_steps is only ever set, so a write made through the
+        store while the copy was being read from BigQuery is never lost. The
+        sync time is only recorded once every chunk is in, so a failed sync
+        is retried.
+
+        Args:
+            users (iterable): (user_id, has_steps) pairs
+            leagues (iterable): league IDs
+            memberships (iterable): (player_id, league_id) pairs
+        """
+        self._upsert_chunks(
+            "INSERT INTO users VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET has_steps = has_steps OR excluded.has_steps",
+            ((user_id, int(has_steps)) for user_id, has_steps in users)
+        )
+        self._upsert_chunks("INSERT OR IGNORE INTO leagues VALUES (?)", ((league_id,) for league_id in leagues))
+        self._upsert_chunks(
+            "INSERT OR IGNORE INTO memberships VALUES (?, ?)",
+            ((league_id, player_id) for player_id, league_id in memberships)
+        )
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO sync_state VALUES (1, ?)", (time.time(),))
+
+    def synced_at(self):
+        """Wall-clock time of the last sync, or None if there has not been one"""
+        row = self._one("SELECT synced_at FROM sync_state WHERE id = 1", ())
+        return row[0] if row else None
+
+class FirestoreLookupStore:
+    """
+    Lookup documents in Firestore, one per user, league and membership
+
+    IDs are percent-encoded into document IDs, since league names may
+    contain "/".
+    """
+
+    def __init__(self, project=PROJECT_ID, credentials=None, prefix="lookup_"):
+        from google.cloud import firestore
+
+        self.db = firestore.Client(project=project, credentials=credentials)
+        self.users = self.db.collection(f"{prefix}users")
+        self.leagues = self.db.collection(f"{prefix}leagues")
+        self.memberships = self.db.collection(f"{prefix}memberships")
+        self.state = self.db.collection(f"{prefix}state").document("sync")
+
+    @staticmethod
+    def _key(*ids):
+        return "|".join(quote(value, safe="") for value in ids)
+
+    def user_exists(self, user_id):
+        """(exists, has_steps) for a user"""
+        snapshot = self.users.document(self._key(user_id)).get()
+        if not snapshot.exists:
+            return False, False
+        return True, bool(snapshot.to_dict().get("has_steps", False))
+
+    def league_exists(self, league_id):
+        return self.leagues.document(self._key(league_id)).get().exists
+
+    def is_member(self, player_id, league_id):
+        return self.memberships.document(self._key(league_id, player_id)).get().exists
+
+    @staticmethod
+    def _user_fields(user_id, has_steps):
+        """
+        Fields to merge into a user's document
+
+        has_steps is only ever written as True, so no write can clear a flag
+        that set_has_steps, a sync or another replica set.
+        """
+        return {"user_id": user_id, "has_steps": True} if has_steps else {"user_id": user_id}
+
+    def add_user(self, user_id, has_steps=False):
+        self.users.document(self._key(user_id)).set(self._user_fields(user_id, has_steps), merge=True)
+
+    def set_has_steps(self, user_id):
+        self.add_user(user_id, has_steps=True)
+
+    def add_league(self, league_id):
+        self.leagues.document(self._key(league_id)).set({"league_id": league_id})
+
+    def claim_league(self, league_id):
+        """Create a league's document, returning False if it already existed"""
+        from google.api_core.exceptions import AlreadyExists
+
+        try:
+            self.leagues.document(self._key(league_id)).create({"league_id": league_id})
+        except AlreadyExists:
+            return False
+        return True
+
+    def release_league(self, league_id):
+        """Undo a claim whose BigQuery write failed"""
+        self.leagues.document(self._key(league_id)).delete()
+
+    def add_membership(self, player_id, league_id):
+        self.memberships.document(self._key(league_id, player_id)).set({"league_id": league_id, "player_id": player_id})
+
+    def upsert_all(self, users, leagues, memberships):
+        """Merge users, leagues and memberships in batches of FIRESTORE_BATCH_SIZE, then record the sync time"""
+        writes = [
+            *((self.users.document(self._key(u)), self._user_fields(u, h)) for u, h in users),
+            *((self.leagues.document(self._key(league_id)), {"league_id": league_id}) for league_id in leagues),
+            *(
+                (self.memberships.document(self._key(league_id, player_id)), {"league_id": league_id, "player_id": player_id})
+                for player_id, league_id in memberships
+            ),
+        ]
+        for chunk in chunks(writes, FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for document, fields in chunk:
+                batch.set(document, fields, merge=True)
+            batch.commit()
+        self.state.set({"synced_at": time.time()})
+
+    def synced_at(self):
+        """Wall-clock time of the last sync by any replica, or None"""
+        snapshot = self.state.get()
+        return snapshot.get("synced_at") if snapshot.exists else None
+
+def create_lookup_store():
+    """Create the lookup store selected by STEPLOTTO_LOOKUP_STORE"""
+    if LOOKUP_STORE == "sqlite":
+        return SqliteLookupStore()
+    if LOOKUP_STORE == "firestore":
+        return FirestoreLookupStore(credentials=service_account_credentials())
+    raise ValueError(f"Unknown STEPLOTTO_LOOKUP_STORE: {LOOKUP_STORE}")
+
+class BigQueryLookups:
+    """
+    Lookups answered straight from BigQuery, used while the store is too stale
+
+    Writes still go through to the store, so it has them once it catches
+    up. They are best-effort: BigQuery already has the rows, and the next
+    sync copies anything a failed write missed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def _exists(query, parameters):
+        for row in run_query(f"SELECT EXISTS({query}) AS found", parameters):
+            return bool(row.found)
+        return False
+
+    def _write_through(self, method, *args):
+        try:
+            return method(*args)
+        except Exception:
+            logger.warning("Lookup store write %s%r failed", method.__name__, args, exc_info=True)
+            return None
+
+    def user_exists(self, user_id):
+        """(exists, has_steps) for a user"""
+        results = run_query(f"""
+        SELECT
+            EXISTS(SELECT 1 FROM {table_path(USERS_TABLE)} WHERE user_id = @user_id) AS user_exists,
+            EXISTS(SELECT 1 FROM {table_path(DAILY_STEPS_TABLE)} WHERE name = @user_id) AS has_steps
+        """, [bigquery.ScalarQueryParameter("user_id", "STRING", user_id)])
+        for row in results:
+            return bool(row.user_exists), bool(row.user_exists and row.has_steps)
+        return False, False
+
+    def league_exists(self, league_id):
+        return self._exists(f"SELECT 1 FROM {table_path(LEAGUES_TABLE)} WHERE league_id = @league_id", [
+            bigquery.ScalarQueryParameter("league_id", "STRING", league_id)
+        ])
+
+    def is_member(self, player_id, league_id):
+        return self._exists(
+            f"SELECT 1 FROM {table_path(MEMBERSHIPS_TABLE)} WHERE league_id = @league_id AND player_id = @player_id",
+            [
+                bigquery.ScalarQueryParameter("league_id", "STRING", league_id),
+                bigquery.ScalarQueryParameter("player_id", "STRING", player_id),
+            ]
+        )
+
+    def add_user(self, user_id, has_steps=False):
+        self._write_through(self.store.add_user, user_id, has_steps)
+
+    def set_has_steps(self, user_id):
+        self._write_through(self.store.set_has_steps, user_id)
+
+    def add_league(self, league_id):
+        self._write_through(self.store.add_league, league_id)
+
+    def claim_league(self, league_id):
+        """
+        Claim a league in the store, returning False if it or BigQuery already has it
+
+        If the store cannot be written the claim is not exclusive, as
+        without a lookup store; the league transaction still checks BigQuery.
+        """
+        if self._write_through(self.store.claim_league, league_id) is False:
+            return False
+        return not self.league_exists(league_id)
+
+    def release_league(self, league_id):
+        self._write_through(self.store.release_league, league_id)
+
+    def add_membership(self, player_id, league_id):
+        self._write_through(self.store.add_membership, player_id, league_id)
+
+class SyncedKeys:
+    """Keys this process has already copied into the store, and when it last read them"""
+
+    def __init__(self):
+        self.users = {}
+        self.leagues = set()
+        self.memberships = set()
+        self.started_at = None
+        self.full_started_at = None
+
+def sync_from_bigquery(store, synced):
+    """
+    Copy user (with their has-steps flag), league and membership keys into the store
+
+    The first sync in a process, and one every LOOKUP_FULL_SYNC_SECONDS,
+    reads every key. The others only read keys created since the previous
+    sync began (less LOOKUP_SYNC_OVERLAP_SECONDS), and users whose daily
+    steps were updated since then. Only keys missing from synced, and users
+    whose steps appeared since they were copied, are written; synced is
+    updated once the store has them.
+    """
+    started_at = time.time()
+    full = synced.full_started_at is None or started_at - synced.full_started_at >= LOOKUP_FULL_SYNC_SECONDS
+    since = 0.0 if full else synced.started_at - LOOKUP_SYNC_OVERLAP_SECONDS
+    parameters = [
+        bigquery.ScalarQueryParameter("full", "BOOL", full),
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", datetime.fromtimestamp(since, timezone.utc)),
+    ]
+
+    users = run_query_arrow(f"""
+    WITH stepped AS (
+        SELECT DISTINCT name
+        FROM {table_path(DAILY_STEPS_TABLE)}
+        WHERE @full
+            OR updated_at > @since
+            OR name IN (SELECT user_id FROM {table_path(USERS_TABLE)} WHERE created_at > @since)
+    )
+    SELECT
+        u.user_id,
+        s.name IS NOT NULL AS has_steps
+    FROM {table_path(USERS_TABLE)} u
+    LEFT JOIN stepped s
+        ON s.name = u.user_id
+    WHERE @full OR u.created_at > @since OR s.name IS NOT NULL
+    """, parameters)
+    leagues = run_query_arrow(f"""
+    SELECT league_id FROM {table_path(LEAGUES_TABLE)} WHERE @full OR created_at > @since
+    """, parameters)
+    memberships = run_query_arrow(f"""
+    SELECT player_id, league_id FROM {table_path(MEMBERSHIPS_TABLE)} WHERE @full OR created_at > @since
+    """, parameters)
+
+    new_users = [
+        (user_id, has_steps)
+        for user_id, has_steps in zip(users['user_id'].to_pylist(), users['has_steps'].to_pylist())
+        if user_id not in synced.users or (has_steps and not synced.users[user_id])
+    ]
+    new_leagues = [league_id for league_id in leagues['league_id'].to_pylist() if league_id not in synced.leagues]
+    new_memberships = [
+        membership
+        for membership in zip(memberships['player_id'].to_pylist(), memberships['league_id'].to_pylist())
+        if membership not in synced.memberships
+    ]
+
+    store.upsert_all(new_users, new_leagues, new_memberships)
+    synced.users.update(new_users)
+    synced.leagues.update(new_leagues)
+    synced.memberships.update(new_memberships)
+    synced.started_at = started_at
+    if full:
+        synced.full_started_at = started_at
+
+class LookupStoreSync:
+    """A lookup store, its BigQuery fallback and when it next needs checking for staleness"""
+
+    def __init__(self, store):
+        self.store = store
+        self.fallback = BigQueryLookups(store)
+        self.synced = SyncedKeys()
+        self.synced_at = None
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+
+    def fresh_store(self):
+        """
+        The store, or BigQueryLookups if its last sync is too old to trust
+
+        Once the store may have gone stale, whichever caller notices starts
+        a background re-sync and everyone carries on with the current copy.
+        Its sync time is only read by that re-sync, so a shared store costs
+        no extra reads per lookup.
+        """
+        now = time.time()
+        if now >= self.next_check and self.lock.acquire(blocking=False):
+            threading.Thread(target=self.refresh, daemon=True).start()
+        if self.synced_at is not None and now - self.synced_at < LOOKUP_MAX_STALE_SECONDS:
+            return self.store
+        return self.fallback
+
+    def refresh(self):
+        """Re-sync the store if it is stale, with the lock held by the caller"""
+        try:
+            synced_at = self.store.synced_at()
+            if synced_at is None or time.time() - synced_at >= LOOKUP_SYNC_SECONDS:
+                sync_from_bigquery(self.store, self.synced)
+                synced_at = time.time()
+            self.synced_at = synced_at
+            self.next_check = synced_at + LOOKUP_SYNC_SECONDS
+        except Exception:
+            logger.exception("Lookup store sync failed; retrying in %s seconds", LOOKUP_RETRY_SECONDS)
+            self.next_check = time.time() + LOOKUP_RETRY_SECONDS
+        finally:
+            self.lock.release()
+
+@st.cache_resource
+def get_lookup_store_sync():
+    """Lookup store shared by all sessions, created on first use"""
+    return LookupStoreSync(create_lookup_store())
+
+def lookup_store():
+    """The shared lookup store, or BigQuery while the store is too stale to answer"""
+    return get_lookup_store_sync().fresh_store()
@@ -0,0 +1,622 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+from google.cloud import bigquery
+from datetime import date, datetime, timedelta, timezone
+from enum import Enum
+
+from data.client import (
+    STEPS_TABLE,
+    STAGING_STEPS_TABLE,
+    USERS_TABLE,
+    LEAGUES_TABLE,
+    MEMBERSHIPS_TABLE,
+    DAILY_STEPS_TABLE,
+    CUMULATIVE_STEPS_TABLE,
+    ROLLUP_STATE_TABLE,
+    DRAWS_TABLE,
+    CUMULATIVE_ROLLUP,
+    PLAYER_ID_TYPE,
+    table_path,
+    run_query,
+    run_query_arrow,
+    insert_rows,
+)
+from data.downsampling import lttb_indices
+from data.leaderboard_index import get_leaderboard_index, leaderboard_index
+from data.lookup_store import lookup_store
+
+# Cache lifetimes in seconds. Rollup-backed reads only change when the hourly
+# refresh runs and draws only weekly; lookups that users act on straight away
+# are kept short
+MEMBERSHIP_TTL = 300
+STEPS_TTL = 600
+SYNC_CHECK_TTL = 30
+DRAW_TTL = 3600
+
+# Data versions are re-checked every VERSION_TTL seconds. Reads keyed on a
+# version can be kept for VERSIONED_TTL, since new data gives them a new key
+VERSION_TTL = 60
+VERSIONED_TTL = 3600
+
+# The homepage series is daily for its last DAILY_SERIES_DAYS days and weekly
+# before that, or monthly once the window spans more than
+# WEEKLY_SERIES_MAX_DAYS. LTTB downsamples to at most LTTB_MAX_POINTS
+DAILY_SERIES_DAYS = 90
+WEEKLY_SERIES_MAX_DAYS = 730
+LTTB_MAX_POINTS = 200
+SERIES_SCHEMA = pa.schema([
+    ('bucket_start', pa.date32()),
+    ('bucket', pa.string()),
+    ('days_tracked', pa.int32()),
+    ('total_steps', pa.int32()),
+    ('average_steps', pa.int32()),
+])
+
+# Schema of every leaderboard slice, whichever source it comes from
+LEADERBOARD_SCHEMA = pa.schema([
+    ('rank', pa.int32()),
+    ('player_id', PLAYER_ID_TYPE),
+    ('total_steps', pa.int32()),
+])
+
+class LeagueOutcome(Enum):
+    """What a create-league or join-league request did"""
+    CREATED = "created"
+    JOINED = "joined"
+    ALREADY_EXISTS = "already_exists"
+    ALREADY_MEMBER = "already_member"
+    NOT_FOUND = "not_found"
+
+def user_exists(email: str) -> tuple[bool, bool]:
+    """Check if email exists in user_ids table and return (exists, has_steps)"""
+    return lookup_store().user_exists(email)
+
+@st.cache_data(ttl=SYNC_CHECK_TTL, show_spinner=False)
+def user_step_entry_count(username: str, lookback_days: int) -> int:
+    """Count the user's step entries over the last lookback_days days"""
+    query = f"""
+    SELECT COUNT(*) as count
+    FROM {table_path(STEPS_TABLE)}
+    WHERE name = @username
+        AND date >= DATE_SUB(CURRENT_DATE(), INTERVAL @lookback_days DAY)
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("username", "STRING", username),
+        bigquery.ScalarQueryParameter("lookback_days", "INT64", lookback_days)
+    ])
+
+    for row in results:
+        return row.count
+    return 0
+
+@st.cache_data(ttl=VERSION_TTL, show_spinner=False)
+def user_data_version(username: str) -> str:
+    """
+    Version of the user's rolled-up steps: when the rollup last changed any of their days
+
+    Reads only the user's cluster of the daily rollup. Anything cached with
+    this version in its key stays valid until the next ingestion of theirs
+    reaches the rollup.
+    """
+    query = f"""
+    SELECT MAX(updated_at) AS version
+    FROM {table_path(DAILY_STEPS_TABLE)}
+    WHERE name = @username
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("username", "STRING", username)
+    ])
+
+    for row in results:
+        return row.version.isoformat() if row.version else ""
+    return ""
+
+@st.cache_data(ttl=VERSION_TTL, show_spinner=False)
+def rollup_version() -> str:
+    """Version of every rollup: when the hourly refresh last ran"""
+    query = f"""
+    SELECT MAX(refreshed_at) AS version
+    FROM {table_path(ROLLUP_STATE_TABLE)}
+    """
+
+    for row in run_query(query):
+        return row.version.isoformat() if row.version else ""
+    return ""
+
+def league_data_version(league_id: str, start_day: date | None = None) -> str:
+    """
+    Version of what the league page shows for a window
+
+    All time follows the leaderboard index, which changes as ingestion is
+    polled in; windows follow the rollups.
+    """
+    if start_day is None:
+        return f"index:{leaderboard_index().version(league_id)}"
+    return f"rollup:{rollup_version()}"
+
+@st.cache_data(ttl=VERSIONED_TTL, show_spinner=False)
+def homepage_snapshot(username: str, start_day: date | None, end_day: date,
+                      resolution: str = "buckets", data_version: str = "") -> tuple[bool, pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Get everything the homepage shows in a single query
+
+    The steps series covers start_day to end_day (inclusive, all history
+    when start_day is None) and is kept to a bounded number of points
+    however long the window is. With resolution "buckets" its last
+    DAILY_SERIES_DAYS days are daily and earlier days are grouped into weeks,
+    or months once the window spans more than WEEKLY_SERIES_MAX_DAYS.
+    With "lttb" it is daily throughout, downsampled to LTTB_MAX_POINTS.
+    Summary metrics are computed over every day of the window in SQL.
+    data_version (from user_data_version) only keys the cache, so a new
+    version fetches afresh.
+
+    Returns:
+        tuple: (has_steps, leagues DataFrame, series DataFrame, summary dict).
+        The series has bucket_start, bucket ('day', 'week' or 'month'),
+        days_tracked, total_steps and average_steps, with int32 steps and
+        datetime64 days. The summary has days_tracked, average_steps and
+        best_steps.
+    """
+    query = f"""
+    WITH window_steps AS (
+        SELECT day, total_steps
+        FROM {table_path(DAILY_STEPS_TABLE)}
+        WHERE name = @username
+            AND day BETWEEN @start_day AND @end_day
+    ),
+    span AS (
+        SELECT DATE_DIFF(@end_day, MIN(day), DAY) AS days
+        FROM window_steps
+    ),
+    bucketed AS (
+        SELECT
+            CASE
+                WHEN @all_daily OR w.day > DATE_SUB(@end_day, INTERVAL @daily_days DAY) THEN w.day
+                WHEN span.days <= @weekly_max_days THEN DATE_TRUNC(w.day, WEEK(MONDAY))
+                ELSE DATE_TRUNC(w.day, MONTH)
+            END AS bucket_start,
+            CASE
+                WHEN @all_daily OR w.day > DATE_SUB(@end_day, INTERVAL @daily_days DAY) THEN 'day'
+                WHEN span.days <= @weekly_max_days THEN 'week'
+                ELSE 'month'
+            END AS bucket,
+            w.total_steps
+        FROM window_steps w
+        CROSS JOIN span
+    )
+    SELECT
+        EXISTS(
+            SELECT 1
+            FROM {table_path(DAILY_STEPS_TABLE)}
+            WHERE name = @username
+        ) AS has_steps,
+        ARRAY(
+            SELECT league_id
+            FROM {table_path(MEMBERSHIPS_TABLE)}
+            WHERE player_id = @username
+            ORDER BY league_id
+        ) AS leagues,
+        ARRAY(
+            SELECT AS STRUCT
+                bucket_start,
+                bucket,
+                COUNT(*) AS days_tracked,
+                SUM(total_steps) AS total_steps,
+                CAST(ROUND(AVG(total_steps)) AS INT64) AS average_steps
+            FROM bucketed
+            GROUP BY bucket_start, bucket
+            ORDER BY bucket_start
+        ) AS series,
+        (
+            SELECT AS STRUCT
+                COUNT(*) AS days_tracked,
+                CAST(ROUND(AVG(total_steps)) AS INT64) AS average_steps,
+                MAX(total_steps) AS best_steps
+            FROM window_steps
+        ) AS summary
+    """
+
+    # LTTB needs the whole window daily and thins it out afterwards. That is
+    # a flag rather than a day count, since counting back from all time
+    # would fall outside BigQuery's DATE range
+    start_day = start_day or date.min
+
+    snapshot = run_query_arrow(query, [
+        bigquery.ScalarQueryParameter("username", "STRING", username),
+        bigquery.ScalarQueryParameter("start_day", "DATE", start_day),
+        bigquery.ScalarQueryParameter("end_day", "DATE", end_day),
+        bigquery.ScalarQueryParameter("daily_days", "INT64", DAILY_SERIES_DAYS),
+        bigquery.ScalarQueryParameter("all_daily", "BOOL", resolution == "lttb"),
+        bigquery.ScalarQueryParameter("weekly_max_days", "INT64", WEEKLY_SERIES_MAX_DAYS)
+    ])
+
+    row = snapshot.slice(0, 1).to_pylist()[0] if snapshot.num_rows else {}
+    leagues_df = pd.DataFrame({'league_id': row.get('leagues') or []})
+    summary = row.get('summary') or {'days_tracked': 0, 'average_steps': None, 'best_steps': None}
+
+    # The series comes back as one Arrow list<struct> and is unpacked column-wise
+    series = pa.Table.from_batches([
+        pa.RecordBatch.from_struct_array(snapshot.column('series')[0].values)
+    ]).cast(SERIES_SCHEMA) if snapshot.num_rows else SERIES_SCHEMA.empty_table()
+    series_df = series.to_pandas(date_as_object=False)
+
+    if resolution == "lttb" and len(series_df) > LTTB_MAX_POINTS:
+        kept = lttb_indices(
+            series_df['bucket_start'].to_numpy(dtype='datetime64[D]').astype(np.int64),
+            series_df['total_steps'].to_numpy(),
+            LTTB_MAX_POINTS
+        )
+        series_df = series_df.iloc[kept].reset_index(drop=True)
+
+    return bool(row.get('has_steps')), leagues_df, series_df, summary
+
+def league_exists(league_id: str) -> bool:
+    """Check if league exists in the leagues table"""
+    return lookup_store().league_exists(league_id)
+
+def is_league_member(username: str, league_id: str) -> bool:
+    """Check if user is already a member of the league"""
+    return lookup_store().is_member(username, league_id)
+
+@st.cache_data(ttl=VERSIONED_TTL, show_spinner=False)
+def cumulative_steps_through(data_version: str = "") -> date | None:
+    """
+    Last day the cumulative step series has been built to, or None before its first build
+
+    data_version (from rollup_version) only keys the cache.
+    """
+    query = f"""
+    SELECT DATE(watermark) AS through
+    FROM {table_path(ROLLUP_STATE_TABLE)}
+    WHERE rollup = @rollup
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("rollup", "STRING", CUMULATIVE_ROLLUP)
+    ])
+
+    for row in results:
+        return row.through
+    return None
+
+def league_summary(league_id: str, start_day: date | None = None, end_day: date | None = None,
+                   data_version: str = "") -> dict:
+    """
+    Get the league's member count, total steps and number of members on 0 steps
+
+    All time is read from the leaderboard index; a window from start_day to
+    end_day (inclusive) is aggregated in BigQuery. data_version (from
+    league_data_version, read before this) keys the cached window reads.
+    """
+    if start_day is None:
+        return leaderboard_index().summary(league_id)
+    return league_window_summary(league_id, start_day, end_day, data_version)
+
+def leaderboard_table(rows: list[tuple]) -> pa.Table:
+    """Arrow table from leaderboard index (rank, player_id, total_steps) rows"""
+    ranks, player_ids, totals = zip(*rows) if rows else ((), (), ())
+    return pa.table([ranks, player_ids, totals], schema=LEADERBOARD_SCHEMA)
+
+def league_leaderboard(league_id: str, start_day: date | None = None, end_day: date | None = None,
+                       offset: int = 0, limit: int | None = None, data_version: str = "") -> pa.Table:
+    """
+    Get one page of the league's members ranked by total steps, all-time or over a date window
+
+    Members with no steps are included with 0. Tied members share a rank.
+    All-time totals come from the in-memory leaderboard index, which is
+    kept up to date with ingestion between rollups. Windows are ranked in
+    BigQuery, so only the requested page is transferred. Slices are Arrow
+    tables that st.dataframe renders without a pandas round trip.
+
+    Returns:
+        Table: rank, player_id, total_steps for up to limit members from
+        offset, or the rest of the league when limit is None
+    """
+    if start_day is None:
+        return leaderboard_table(leaderboard_index().top(league_id, limit, offset))
+    return league_window_leaderboard(league_id, start_day, end_day, offset, limit, data_version)
+
+def league_neighbourhood(league_id: str, username: str, k: int,
+                         start_day: date | None = None, end_day: date | None = None,
+                         data_version: str = "") -> pa.Table:
+    """
+    Get the user's row in the league ranking and the k rows either side of it
+
+    Returns:
+        Table: rank, player_id, total_steps, empty if the user is not a member
+    """
+    if start_day is None:
+        return leaderboard_table(leaderboard_index().around(league_id, username, k))
+    return league_window_neighbourhood(league_id, username, k, start_day, end_day, data_version)
+
+def utc_today() -> date:
+    """Today's date in UTC, the calendar the rollups and their windows run on"""
+    return datetime.now(timezone.utc).date()
+
+def window_totals_cte() -> str:
+    """
+    Common table expression for each member's steps from @start_day to @end_day
+
+    The window is the difference of two days of the cumulative rollup, so it
+    reads two partitions however long the window is.
+    """
+    return f"""
+    window_totals AS (
+        SELECT
+            lm.player_id,
+            GREATEST(COALESCE(e.cumulative_steps, 0) - COALESCE(s.cumulative_steps, 0), 0) as total_steps
+        FROM {table_path(MEMBERSHIPS_TABLE)} lm
+        LEFT JOIN {table_path(CUMULATIVE_STEPS_TABLE)} e
+            ON e.name = lm.player_id AND e.day = @end_day
+        LEFT JOIN {table_path(CUMULATIVE_STEPS_TABLE)} s
+            ON s.name = lm.player_id AND s.day = @day_before_start
+        WHERE lm.league_id = @league_id
+    )"""
+
+def window_parameters(league_id: str, start_day: date, end_day: date | None, data_version: str) -> list:
+    """Query parameters for window_totals_cte"""
+    # The series only reaches the last refresh, which is what "today" means
+    # here. The rollup runs in UTC, so today is the UTC date
+    through = cumulative_steps_through(data_version)
+    today = utc_today()
+    end_day = min(end_day or today, through) if through else (end_day or today)
+
+    # A window starting after the series ends has nothing in it yet. Both
+    # ends are then the same day, so it sums to 0 rather than to everyone's
+    # all-time total against a missing start
+    day_before_start = min(start_day - timedelta(days=1), end_day)
+
+    return [
+        bigquery.ScalarQueryParameter("league_id", "STRING", league_id),
+        bigquery.ScalarQueryParameter("end_day", "DATE", end_day),
+        bigquery.ScalarQueryParameter("day_before_start", "DATE", day_before_start)
+    ]
+
+# Each window is cached separately, so switching back to one is free. The
+# rollup version is part of the key, so a refresh is never served old totals
+
+@st.cache_data(ttl=VERSIONED_TTL, show_spinner=False)
+def league_window_summary(league_id: str, start_day: date, end_day: date | None = None,
+                          data_version: str = "") -> dict:
+    """Get the league's member count, total steps and members on 0 steps over a window"""
+    query = f"""
+    WITH {window_totals_cte()}
+    SELECT
+        COUNT(*) as members,
+        COALESCE(SUM(total_steps), 0) as total_steps,
+        COUNTIF(total_steps = 0) as zero_members
+    FROM window_totals
+    """
+
+    for row in run_query(query, window_parameters(league_id, start_day, end_day, data_version)):
+        return {'members': row.members, 'total_steps': row.total_steps, 'zero_members': row.zero_members}
+    return {'members': 0, 'total_steps': 0, 'zero_members': 0}
+
+@st.cache_data(ttl=VERSIONED_TTL, show_spinner=False)
+def league_window_leaderboard(league_id: str, start_day: date, end_day: date | None = None,
+                              offset: int = 0, limit: int | None = None, data_version: str = "") -> pa.Table:
+    """Get one page of the league's members ranked by steps over a window"""
+    page = "LIMIT @limit OFFSET @offset" if limit is not None else ""
+    query = f"""
+    WITH {window_totals_cte()}
+    SELECT
+        RANK() OVER (ORDER BY total_steps DESC) as rank,
+        player_id,
+        total_steps
+    FROM window_totals
+    ORDER BY total_steps DESC, player_id
+    {page}
+    """
+
+    query_parameters = window_parameters(league_id, start_day, end_day, data_version)
+    if limit is not None:
+        query_parameters += [
+            bigquery.ScalarQueryParameter("limit", "INT64", limit),
+            bigquery.ScalarQueryParameter("offset", "INT64", offset)
+        ]
+
+    return run_query_arrow(query, query_parameters).cast(LEADERBOARD_SCHEMA)
+
+@st.cache_data(ttl=VERSIONED_TTL, show_spinner=False)
+def league_window_neighbourhood(league_id: str, username: str, k: int,
+                                start_day: date, end_day: date | None = None, data_version: str = "") -> pa.Table:
+    """Get the user's row in a window's ranking and the k rows either side of it"""
+    query = f"""
+    WITH {window_totals_cte()},
+    ranked AS (
+        SELECT
+            RANK() OVER (ORDER BY total_steps DESC) as rank,
+            ROW_NUMBER() OVER (ORDER BY total_steps DESC, player_id) as position,
+            player_id,
+            total_steps
+        FROM window_totals
+    )
+    SELECT r.rank, r.player_id, r.total_steps
+    FROM ranked r
+    JOIN ranked me
+        ON me.player_id = @username
+    WHERE r.position BETWEEN me.position - @k AND me.position + @k
+    ORDER BY r.position
+    """
+
+    return run_query_arrow(query, window_parameters(league_id, start_day, end_day, data_version) + [
+        bigquery.ScalarQueryParameter("username", "STRING", username),
+        bigquery.ScalarQueryParameter("k", "INT64", k)
+    ]).cast(LEADERBOARD_SCHEMA)
+
+@st.cache_data(ttl=DRAW_TTL, show_spinner=False)
+def latest_league_draw(league_id: str) -> pd.DataFrame:
+    """
+    Get the winners of the league's most recent draw, best rank first
+
+    Returns an empty DataFrame if the league has never been drawn.
+    """
+    query = f"""
+    SELECT
+        period_start,
+        period_end,
+        winner_rank,
+        winner_id,
+        winner_tickets,
+        total_tickets,
+        entrants,
+        seed
+    FROM {table_path(DRAWS_TABLE)}
+    WHERE league_id = @league_id
+    QUALIFY period_end = MAX(period_end) OVER ()
+    ORDER BY winner_rank
+    """
+
+    return run_query_arrow(query, [
+        bigquery.ScalarQueryParameter("league_id", "STRING", league_id)
+    ]).to_pandas(date_as_object=False)
+
+# Writes clear the cached reads they make stale, so the next rerun sees them
+
+def add_user(email: str, first_name: str, last_name: str) -> bool:
+    """Add new user to user_ids table"""
+    added = insert_rows(USERS_TABLE, [{
+        "user_id": email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }])
+    if added:
+        lookup_store().add_user(email)
+    return added
+
+def league_transaction(username: str, league_id: str, create: bool) -> tuple[bool, bool]:
+    """
+    Create or join a league in one multi-statement transaction
+
+    The existence checks and the inserts they guard run as one BigQuery
+    job, so a league is never created without its owner. This does not
+    make league names unique: transactions that only insert do not
+    conflict, so two concurrent creates of the same name would both see
+    league_existed false and both insert. create_league claims the name in
+    the lookup store first, which only lets one of them through.
+
+    Returns:
+        tuple: (league_existed, was_member) as they were before the writes
+    """
+    query = f"""
+    BEGIN TRANSACTION;
+
+    CREATE TEMP TABLE outcome AS
+    SELECT
+        EXISTS(
+            SELECT 1 FROM {table_path(LEAGUES_TABLE)} WHERE league_id = @league_id
+        ) AS league_existed,
+        EXISTS(
+            SELECT 1 FROM {table_path(MEMBERSHIPS_TABLE)}
+            WHERE league_id = @league_id AND player_id = @username
+        ) AS was_member;
+
+    INSERT INTO {table_path(LEAGUES_TABLE)} (league_id, created_at)
+    SELECT @league_id, CURRENT_TIMESTAMP() FROM outcome
+    WHERE @create AND NOT league_existed;
+
+    -- Creating needs the league to be new, joining needs it to exist already
+    INSERT INTO {table_path(MEMBERSHIPS_TABLE)} (player_id, league_id, created_at)
+    SELECT @username, @league_id, CURRENT_TIMESTAMP() FROM outcome
+    WHERE NOT was_member AND league_existed != @create;
+
+    COMMIT TRANSACTION;
+
+    SELECT league_existed, was_member FROM outcome;
+    """
+
+    results = run_query(query, [
+        bigquery.ScalarQueryParameter("username", "STRING", username),
+        bigquery.ScalarQueryParameter("league_id", "STRING", league_id),
+        bigquery.ScalarQueryParameter("create", "BOOL", create)
+    ])
+
+    for row in results:
+        return row.league_existed, row.was_member
+    raise RuntimeError(f"League transaction for '{league_id}' returned no outcome")
+
+def create_league(username: str, league_id: str) -> LeagueOutcome:
+    """
+    Create a league with the user as its first member
+
+    The name is claimed in the lookup store before anything is written to
+    BigQuery, so of two concurrent creates only one gets to write. The
+    transaction still checks BigQuery, for leagues the store has not
+    synced yet.
+    """
+    if not lookup_store().claim_league(league_id):
+        return LeagueOutcome.ALREADY_EXISTS
+
+    try:
+        league_existed, _ = league_transaction(username, league_id, create=True)
+    except Exception:
+        lookup_store().release_league(league_id)
+        raise
+    if league_existed:
+        return LeagueOutcome.ALREADY_EXISTS
+
+    lookup_store().add_membership(username, league_id)
+    league_memberships_changed(username, league_id)
+    return LeagueOutcome.CREATED
+
+def join_league(username: str, league_id: str) -> LeagueOutcome:
+    """Add user to an existing league"""
+    if lookup_store().is_member(username, league_id):
+        return LeagueOutcome.ALREADY_MEMBER
+
+    league_existed, was_member = league_transaction(username, league_id, create=False)
+    if not league_existed:
+        return LeagueOutcome.NOT_FOUND
+
+    lookup_store().add_league(league_id)
+    lookup_store().add_membership(username, league_id)
+    if was_member:
+        return LeagueOutcome.ALREADY_MEMBER
+
+    league_memberships_changed(username, league_id)
+    return LeagueOutcome.JOINED
+
+def league_memberships_changed(username: str, league_id: str):
+    """Refresh the cached reads and leaderboard index after a user joins a league"""
+    homepage_snapshot.clear()
+    league_window_summary.clear()
+    league_window_leaderboard.clear()
+    league_window_neighbourhood.clear()
+    get_leaderboard_index().add_member(league_id, username)
+
+def add_sample_data(username: str) -> bool:
+    """
+    Add some sample data for demonstration (optional)
+
+    The rows go into the staging table with a sync timestamp, like a real
+    sync, so compaction and the rollups pick them up.
+    """
+    # Generate sample data for the last 7 days
+    timestamp = datetime.now(timezone.utc).isoformat()
+    sample_data = []
+    for i in range(7):
+        date = datetime.now() - timedelta(days=i)
+        steps = 5000 + (i * 1000) + (i % 3 * 500)  # Varying step counts
+        sample_data.append({
+            "name": username,
+            "date": date.date().isoformat(),
+            "steps": steps,
+            "timestamp": timestamp,
+            "ingested_at": timestamp
+        })
+
+    added = insert_rows(STAGING_STEPS_TABLE, sample_data)
+    homepage_snapshot.clear()
+    user_step_entry_count.clear()
+    if added:
+        mark_user_has_steps(username)
+    return added
+
+def mark_user_has_steps(username: str):
+    """Record that the user has synced steps, so login sends them to the homepage"""
+    lookup_store().set_has_steps(username)
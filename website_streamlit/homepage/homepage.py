@@ -1,174 +1,154 @@
 import streamlit as st
-from google.cloud import bigquery
 import pandas as pd
 import plotly.express as px
-from datetime import datetime, timedelta
-from google.oauth2 import service_account
+import plotly.io as pio
+from datetime import timedelta
+from data.queries import (
+    utc_today,
+    user_data_version,
+    homepage_snapshot,
+    LeagueOutcome,
+    join_league,
+    add_sample_data,
+)
 
-@st.cache_resource
-def init_bigquery_client():
-    """Initialize BigQuery client using service account from secrets"""
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    return bigquery.Client(
-        credentials=credentials,
-        project="my-project-1706650764881"
-    )
+# Dashboard windows, as days back from today. Only the chosen window is
+# queried; "All time" has no lower bound and "Custom range" is picked with a
+# date input
+DASHBOARD_WINDOW_OPTIONS = {
+    "Last 30 days": 30,
+    "Last 90 days": 90,
+    "Last year": 365,
+    "Last 2 years": 730,
+    "All time": None,
+    "Custom range": None,
+}
+DEFAULT_DASHBOARD_WINDOW = "Last 90 days"
 
-def check_user_has_steps(client, username, project_id, dataset_id, table_id):
-    """Check if user has any step data"""
-    query = f"""
-    SELECT COUNT(*) as count
-    FROM `{project_id}.{dataset_id}.{table_id}`
-    WHERE name = @username
-    """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", username)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    for row in results:
-        return row.count > 0
-    return False
+# How the chart keeps long windows to a bounded number of points
+DASHBOARD_RESOLUTIONS = {
+    "Daily, then weekly or monthly": "buckets",
+    "Smoothed daily (LTTB)": "lttb",
+}
+
+# Built charts are kept as JSON per user, window and data version, so a
+# rerun with nothing new to show skips building the figure. Each render gets
+# its own Figure from the JSON, so no session shares a live Plotly object
+FIGURE_TTL = 3600
+FIGURE_CACHE_ENTRIES = 1000
 
-def get_user_steps(client, username, project_id, dataset_id, table_id):
-    """Get user steps data from BigQuery"""
-    query = f"""
-    SELECT 
-        DATE(date) as day,
-        SUM(steps) as total_steps
-    FROM `{project_id}.{dataset_id}.{table_id}`
-    WHERE name = @username
-    GROUP BY DATE(date)
-    ORDER BY day
+def dashboard_window(label, custom_range):
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", username)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    # Convert to DataFrame
-    df = results.to_dataframe()
-    return df
+    Resolve the selected window to (start_day, end_day)
 
-def add_sample_data(client, username, project_id, dataset_id, table_id):
-    """Add some sample data for demonstration (optional)"""
-    table_ref = client.dataset(dataset_id, project=project_id).table(table_id)
-    table = client.get_table(table_ref)
-    
-    # Generate sample data for the last 7 days
-    sample_data = []
-    for i in range(7):
-        date = datetime.now() - timedelta(days=i)
-        steps = 5000 + (i * 1000) + (i % 3 * 500)  # Varying step counts
-        sample_data.append({
-            "name": username,
-            "date": date.date().isoformat(),
-            "steps": steps
-        })
-    
-    errors = client.insert_rows_json(table, sample_data)
-    return len(errors) == 0
+    start_day is None for all time. A custom range that is only half
+    picked falls back to its single day.
+    """
+    today = utc_today()
+    if label == "Custom range":
+        if isinstance(custom_range, (tuple, list)) and len(custom_range) == 2:
+            return custom_range[0], custom_range[1]
+        if isinstance(custom_range, (tuple, list)) and custom_range:
+            return custom_range[0], custom_range[0]
+        return today - timedelta(days=29), today
+    days = DASHBOARD_WINDOW_OPTIONS[label]
+    return (today - timedelta(days=days - 1), today) if days else (None, today)
 
-def check_league_exists_for_join(client, league_name, project_id, dataset_id):
-    """Check if league exists in the leagues table"""
-    query = f"""
-    SELECT COUNT(*) as count
-    FROM `{project_id}.{dataset_id}.leagues`
-    WHERE league_id = @league_name
+@st.cache_data(ttl=FIGURE_TTL, max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def steps_figure_json(username, start_day, end_day, resolution, data_version, _steps_df):
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("league_name", "STRING", league_name)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    for row in results:
-        return row.count > 0
-    return False
+    Build the steps chart as JSON, once per user, window and data version
 
-def check_user_already_in_league(client, username, league_name, project_id, dataset_id):
-    """Check if user is already a member of the league"""
-    query = f"""
-    SELECT COUNT(*) as count
-    FROM `{project_id}.{dataset_id}.league_memberships`
-    WHERE player_id = @username AND league_id = @league_name
+    The series itself (leading underscore) is not hashed; the arguments
+    before it identify it.
     """
+    # Daily bars for recent days; older weeks and months show their
+    # average day, drawn from their first day and as wide as the period
+    long_window = start_day is None or (end_day - start_day).days >= 365
+    bucket_days = _steps_df['bucket'].map({'day': 1, 'week': 7, 'month': 30}).astype('int64')
+    if resolution == "lttb":
+        fig = px.line(
+            _steps_df,
+            x='bucket_start',
+            y='total_steps',
+            title='Your Daily Steps',
+            labels={
+                'bucket_start': 'Date',
+                'total_steps': 'Steps'
+            },
+            markers=True
+        )
+        fig.update_traces(line_color='#1f77b4')
+    else:
+        fig = px.bar(
+            _steps_df,
+            x='bucket_start',
+            y='average_steps',
+            title='Your Daily Steps',
+            labels={
+                'bucket_start': 'Date',
+                'average_steps': 'Steps'
+            },
+            custom_data=['bucket', 'days_tracked', 'total_steps']
+        )
+        
+        # Customize the chart
+        fig.update_traces(
+            width=bucket_days * 86400000 * 0.9,
+            offset=0,
+            marker_color='#1f77b4',
+            marker_line_color='#1f77b4',
+            marker_line_width=1,
+            hovertemplate='%{x|%d %b %Y} (%{customdata[0]})<br>Average: %{y:,} steps/day'
+                          '<br>Total: %{customdata[2]:,} over %{customdata[1]} days<extra></extra>'
+        )
     
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", username),
-            bigquery.ScalarQueryParameter("league_name", "STRING", league_name)
-        ]
+    fig.update_layout(
+        height=400,
+        showlegend=False,
+        hovermode='x unified'
     )
     
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    for row in results:
-        return row.count > 0
-    return False
-
-def join_league(client, username, league_name, project_id, dataset_id):
-    """Add user to league membership table"""
-    table_ref = client.dataset(dataset_id, project=project_id).table("league_memberships")
-    table = client.get_table(table_ref)
-    
-    # Create row to insert
-    rows_to_insert = [{"player_id": username, "league_id": league_name}]
-    
-    errors = client.insert_rows_json(table, rows_to_insert)
-    return len(errors) == 0
-
-def get_user_leagues(client, username, project_id, dataset_id):
-    """Get leagues that the user is a member of"""
-    query = f"""
-    SELECT league_id
-    FROM `{project_id}.{dataset_id}.league_memberships`
-    WHERE player_id = @username
-    ORDER BY league_id
-    """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("username", "STRING", username)
-        ]
+    fig.update_xaxes(
+        title_font=dict(size=14),
+        tickformat='%b %Y' if long_window else '%b %d'
     )
     
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
+    fig.update_yaxes(
+        title_font=dict(size=14),
+        tickformat=',d'
+    )
     
-    # Convert to DataFrame
-    df = results.to_dataframe()
-    return df
+    return fig.to_json()
 
-def show_homepage(project_id, dataset_id, table_id):
+def show_homepage():
     """Display the homepage after login"""
     st.title("🏠 Homepage")
     st.write(f"Hello, **{st.session_state.username}**! You are successfully logged in.")
     
-    # Initialize BigQuery client
+    # The league list, the steps series, its summary and the has-steps flag
+    # all come from one query. The window widgets are drawn further down, so
+    # read their values from the previous run
+    window_label = st.session_state.get("dashboard_window", DEFAULT_DASHBOARD_WINDOW)
+    resolution_label = st.session_state.get("dashboard_resolution", next(iter(DASHBOARD_RESOLUTIONS)))
+    start_day, end_day = dashboard_window(window_label, st.session_state.get("dashboard_range"))
+    data_version = ""
     try:
-        client = init_bigquery_client()
-        has_steps = check_user_has_steps(client, st.session_state.username, project_id, dataset_id, table_id)
+        data_version = user_data_version(st.session_state.username)
+        has_steps, leagues_df, steps_df, summary = homepage_snapshot(
+            st.session_state.username,
+            start_day,
+            end_day,
+            DASHBOARD_RESOLUTIONS[resolution_label],
+            data_version
+        )
     except Exception as e:
-        st.error(f"Error checking step data: {str(e)}")
+        st.error(f"Error loading your data: {str(e)}")
+        st.info("Make sure your BigQuery credentials are properly configured and the tables exist.")
         has_steps = False
+        leagues_df = pd.DataFrame(columns=['league_id'])
+        steps_df = pd.DataFrame(columns=['bucket_start', 'bucket', 'days_tracked', 'total_steps', 'average_steps'])
+        summary = {'days_tracked': 0, 'average_steps': None, 'best_steps': None}
     
     # Show setup banner if user doesn't have steps
     if not has_steps:
@@ -191,21 +171,15 @@ def show_homepage(project_id, dataset_id, table_id):
             if st.button("Join", type="primary", key="join_league_btn"):
                 if league_to_join.strip():
                     try:
-                        client = init_bigquery_client()
-                        
-                        # Check if league exists
-                        if not check_league_exists_for_join(client, league_to_join.strip(), project_id, dataset_id):
+                        # Check membership and join in one transaction
+                        outcome = join_league(st.session_state.username, league_to_join.strip())
+                        if outcome == LeagueOutcome.NOT_FOUND:
                             st.error(f"League '{league_to_join}' does not exist.")
-                        # Check if user is already in the league
-                        elif check_user_already_in_league(client, st.session_state.username, league_to_join.strip(), project_id, dataset_id):
+                        elif outcome == LeagueOutcome.ALREADY_MEMBER:
                             st.warning(f"You are already a member of '{league_to_join}'.")
                         else:
-                            # Join the league
-                            if join_league(client, st.session_state.username, league_to_join.strip(), project_id, dataset_id):
-                                st.success(f"Successfully joined '{league_to_join}'!")
-                                st.rerun()
-                            else:
-                                st.error("Failed to join league. Please try again.")
+                            st.success(f"Successfully joined '{league_to_join}'!")
+                            st.rerun()
                     except Exception as e:
                         st.error(f"Error joining league: {str(e)}")
                 else:
@@ -224,12 +198,6 @@ def show_homepage(project_id, dataset_id, table_id):
     st.subheader("🏆 My Leagues")
     
     try:
-        # Initialize BigQuery client
-        client = init_bigquery_client()
-        
-        # Get user leagues
-        leagues_df = get_user_leagues(client, st.session_state.username, project_id, dataset_id)
-        
         if not leagues_df.empty:
             # Display leagues in a nice format with clickable buttons
             col1, col2 = st.columns([2, 1])
@@ -252,77 +220,69 @@ def show_homepage(project_id, dataset_id, table_id):
     st.subheader("📊 Your Steps Dashboard")
     
     try:
-        # Initialize BigQuery client
-        client = init_bigquery_client()
-        
         # Add sample data button (for testing - remove in production)
-        col1, col2 = st.columns([3, 1])
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            st.selectbox(
+                "Show:",
+                list(DASHBOARD_WINDOW_OPTIONS),
+                index=list(DASHBOARD_WINDOW_OPTIONS).index(DEFAULT_DASHBOARD_WINDOW),
+                key="dashboard_window"
+            )
+            if st.session_state.dashboard_window == "Custom range":
+                today = utc_today()
+                st.date_input(
+                    "Date range:",
+                    value=(today - timedelta(days=29), today),
+                    max_value=today,
+                    key="dashboard_range"
+                )
         with col2:
+            st.selectbox("Chart detail:", list(DASHBOARD_RESOLUTIONS), key="dashboard_resolution")
+        with col3:
             if st.button("Add Sample Data", help="Click to add sample step data for testing"):
-                if add_sample_data(client, st.session_state.username, project_id, dataset_id, table_id):
+                if add_sample_data(st.session_state.username):
                     st.success("Sample data added!")
                     st.rerun()
                 else:
                     st.error("Failed to add sample data.")
         
-        # Get user steps data
-        steps_df = get_user_steps(client, st.session_state.username, project_id, dataset_id, table_id)
-        
         if not steps_df.empty:
-            # Display summary statistics
+            # Summary statistics cover every day in the window, not just the chart's points
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Days Tracked", len(steps_df))
+                st.metric("Total Days Tracked", f"{summary['days_tracked']:,}")
             with col2:
-                st.metric("Average Daily Steps", f"{int(steps_df['total_steps'].mean()):,}")
+                st.metric("Average Daily Steps", f"{summary['average_steps']:,}")
             with col3:
-                st.metric("Best Day", f"{int(steps_df['total_steps'].max()):,}")
+                st.metric("Best Day", f"{summary['best_steps']:,}")
             
-            # Create the steps bar chart
-            fig = px.bar(
-                steps_df, 
-                x='day', 
-                y='total_steps',
-                title='Your Daily Steps',
-                labels={
-                    'day': 'Date',
-                    'total_steps': 'Steps'
-                }
-            )
-            
-            # Customize the chart
-            fig.update_traces(
-                marker_color='#1f77b4',
-                marker_line_color='#1f77b4',
-                marker_line_width=1
-            )
             
-            fig.update_layout(
-                height=400,
-                showlegend=False,
-                hovermode='x unified'
-            )
-            
-            fig.update_xaxes(
-                title_font=dict(size=14),
-                tickformat='%b %d'
-            )
-            
-            fig.update_yaxes(
-                title_font=dict(size=14),
-                tickformat=',d'
-            )
-            
-            # Display the chart
+            # Display the chart, rebuilt only when the window or the data changes
+            fig = pio.from_json(steps_figure_json(
+                st.session_state.username,
+                start_day,
+                end_day,
+                DASHBOARD_RESOLUTIONS[resolution_label],
+                data_version,
+                steps_df
+            ))
             st.plotly_chart(fig, use_container_width=True)
             
             # Display recent data table
             st.subheader("📅 Recent Activity")
-            recent_data = steps_df.tail(10).copy()
-            recent_data['day'] = pd.to_datetime(recent_data['day']).dt.strftime('%Y-%m-%d')
-            recent_data['total_steps'] = recent_data['total_steps'].apply(lambda x: f"{int(x):,}")
-            recent_data = recent_data.rename(columns={'day': 'Date', 'total_steps': 'Steps'})
-            st.dataframe(recent_data, use_container_width=True, hide_index=True)
+            recent_data = (
+                steps_df.loc[steps_df['bucket'] == 'day', ['bucket_start', 'total_steps']]
+                .tail(10)
+                .assign(bucket_start=lambda df: df['bucket_start'].dt.strftime('%Y-%m-%d'))
+                .rename(columns={'bucket_start': 'Date', 'total_steps': 'Steps'})
+            )
+            st.dataframe(
+                recent_data,
+                column_config={'Steps': st.column_config.NumberColumn(format="localized")},
+                use_container_width=True,
+                hide_index=True
+            )
             
         else:
             st.info("No step data found for your account.")
@@ -1,69 +1,117 @@
 import streamlit as st
-from google.cloud import bigquery
 import pandas as pd
 import plotly.express as px
-from google.oauth2 import service_account
+import plotly.io as pio
+import pyarrow.compute as pc
+from datetime import timedelta
+from data.concurrency import fetch_concurrently
+from data.queries import (
+    utc_today,
+    league_data_version,
+    league_summary,
+    league_leaderboard,
+    league_neighbourhood,
+    latest_league_draw,
+)
 
-@st.cache_resource
-def init_bigquery_client():
-    """Initialize BigQuery client using service account from secrets"""
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    return bigquery.Client(
-        credentials=credentials,
-        project="my-project-1706650764881"
-    )
+# League leaderboard windows. Each maps today's date to an inclusive
+# (start, end) window. "All time" reads the league totals instead and
+# "Custom range" is picked with a date input
+LEAGUE_WINDOW_OPTIONS = {
+    "All time": None,
+    "Today": lambda today: (today, today),
+    "This week": lambda today: (today - timedelta(days=today.weekday()), today),
+    "This month": lambda today: (today.replace(day=1), today),
+    "Custom range": None,
+}
+
+# Members per leaderboard page, members either side of you in "Your
+# Position", and members given their own slice of the pie chart
+LEADERBOARD_PAGE_SIZE = 25
+NEIGHBOURHOOD_SIZE = 3
+PIE_CHART_MEMBERS = 10
+
+# Step columns stay numeric and are formatted with thousands separators in
+# the browser, so nothing is converted to strings row by row
+LEADERBOARD_COLUMN_CONFIG = {
+    'rank': st.column_config.NumberColumn("Rank", format="%d"),
+    'player_id': st.column_config.TextColumn("Member"),
+    'total_steps': st.column_config.NumberColumn("Total Steps", format="localized"),
+}
 
-def get_league_members(client, league_id, project_id, dataset_id):
-    """Get all members of a specific league"""
-    query = f"""
-    SELECT player_id
-    FROM `{project_id}.{dataset_id}.league_memberships`
-    WHERE league_id = @league_id
-    ORDER BY player_id
+# Built charts are kept as JSON per league, window and data version, so a
+# rerun with nothing new to show skips building the figure. Each render gets
+# its own Figure from the JSON, so no session shares a live Plotly object
+FIGURE_TTL = 3600
+FIGURE_CACHE_ENTRIES = 1000
+
+@st.cache_data(ttl=FIGURE_TTL, max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def distribution_figure_json(league_id, start_day, end_day, data_version, total_steps, _top_df):
     """
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("league_id", "STRING", league_id)
-        ]
-    )
-    
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
-    
-    # Convert to DataFrame
-    df = results.to_dataframe()
-    return df
+    Build the steps pie chart as JSON, once per league, window and data version
 
-def get_league_member_steps(client, league_id, project_id, dataset_id):
-    """Get total steps for each member in the league"""
-    query = f"""
-    SELECT 
-        lm.player_id,
-        COALESCE(SUM(us.steps), 0) as total_steps
-    FROM `{project_id}.{dataset_id}.league_memberships` lm
-    LEFT JOIN `{project_id}.{dataset_id}.user_steps` us ON lm.player_id = us.name
-    WHERE lm.league_id = @league_id
-    GROUP BY lm.player_id
-    ORDER BY total_steps DESC
+    The top members (leading underscore) are not hashed; the arguments
+    before them identify them.
     """
+    # The top members get their own slices and everyone else shares one
+    chart_data = _top_df.loc[_top_df['total_steps'] > 0, ['player_id', 'total_steps']]
+    others_steps = total_steps - chart_data['total_steps'].sum()
+    if others_steps > 0:
+        chart_data = pd.concat([
+            chart_data,
+            pd.DataFrame({'player_id': ['Everyone else'], 'total_steps': [others_steps]})
+        ], ignore_index=True)
+    
+    fig = px.pie(
+        chart_data, 
+        values='total_steps', 
+        names='player_id',
+        title='Total Steps by Member'
+    )
     
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("league_id", "STRING", league_id)
-        ]
+    fig.update_traces(
+        textposition='inside', 
+        textinfo='percent+label',
+        hovertemplate='<b>%{label}</b><br>Steps: %{value:,}<br>Percentage: %{percent}<extra></extra>'
     )
     
-    query_job = client.query(query, job_config=job_config)
-    results = query_job.result()
+    fig.update_layout(
+        height=400,
+        showlegend=True,
+        legend=dict(
+            orientation="v",
+            yanchor="middle",
+            y=0.5,
+            xanchor="left",
+            x=1.05
+        )
+    )
     
-    # Convert to DataFrame
-    df = results.to_dataframe()
-    return df
+    return fig.to_json()
 
-def show_league_page(league_id, project_id, dataset_id):
+def league_window(label):
+    """
+    Resolve the selected window to (start_day, end_day)
+
+    Returns (None, None) for all time, or None while a custom range is only
+    half picked.
+    """
+    today = utc_today()
+    if label == "Custom range":
+        selected = st.date_input(
+            "Date range:",
+            value=(today - timedelta(days=29), today),
+            max_value=today,
+            key="league_custom_range"
+        )
+        # The picker returns a single date until both ends have been chosen
+        if isinstance(selected, (tuple, list)) and len(selected) == 2:
+            return selected[0], selected[1]
+        return None
+    window = LEAGUE_WINDOW_OPTIONS[label]
+    return window(today) if window else (None, None)
+
+def show_league_page(league_id):
     """Display the league page for a specific league"""
     st.title(f"🏆 {league_id}")
     
@@ -74,31 +122,61 @@ def show_league_page(league_id, project_id, dataset_id):
     
     st.markdown("---")
     
+    window_label = st.selectbox("Period:", list(LEAGUE_WINDOW_OPTIONS), key="league_period")
+    window = league_window(window_label)
+    if window is None:
+        st.info("Pick an end date for the range.")
+        return
+    start_day, end_day = window
+    
     try:
-        # Initialize BigQuery client
-        client = init_bigquery_client()
+        # Each league keeps its own page, which the page picker below sets
+        page_key = f"league_leaderboard_page:{league_id}"
+        page = st.session_state.get(page_key, 1)
+        
+        # The version is read before the data, and keys both the window reads
+        # and the chart, so a chart is never cached under a newer version
+        # than the data it was built from
+        data_version = league_data_version(league_id, start_day)
+        
+        # Only the league's totals, the visible page, the top of the chart and
+        # the rows around you are fetched, side by side
+        results = fetch_concurrently(
+            summary=(league_summary, league_id, start_day, end_day, data_version),
+            leaderboard=(league_leaderboard, league_id, start_day, end_day,
+                         (page - 1) * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE, data_version),
+            top=(league_leaderboard, league_id, start_day, end_day, 0, PIE_CHART_MEMBERS, data_version),
+            neighbourhood=(league_neighbourhood, league_id, st.session_state.username,
+                           NEIGHBOURHOOD_SIZE, start_day, end_day, data_version),
+            draw=(latest_league_draw, league_id),
+        )
+        summary = results['summary']
+        draw_df = results['draw']
         
-        # Get league members
-        members_df = get_league_members(client, league_id, project_id, dataset_id)
+        # The members table and your position are rendered straight from
+        # Arrow; only the chart's few rows are converted for plotly
+        leaderboard_table = results['leaderboard']
+        neighbourhood_table = results['neighbourhood']
+        top_df = results['top'].to_pandas()
         
-        if members_df.empty:
+        if summary['members'] == 0:
             st.warning("This league has no members.")
             return
         
-        # Get member steps data
-        steps_df = get_league_member_steps(client, league_id, project_id, dataset_id)
+        my_rows = neighbourhood_table.filter(pc.equal(neighbourhood_table['player_id'], st.session_state.username))
+        my_rank = my_rows['rank'][0].as_py() if my_rows.num_rows else None
         
         # Display league stats
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Members", len(members_df))
+            st.metric("Total Members", f"{summary['members']:,}")
         with col2:
-            total_league_steps = steps_df['total_steps'].sum()
-            st.metric("Total League Steps", f"{int(total_league_steps):,}")
+            st.metric("Total League Steps", f"{int(summary['total_steps']):,}")
         with col3:
-            if len(steps_df) > 0:
-                avg_steps = steps_df['total_steps'].mean()
-                st.metric("Average Steps per Member", f"{int(avg_steps):,}")
+            avg_steps = summary['total_steps'] / summary['members']
+            st.metric("Average Steps per Member", f"{int(avg_steps):,}")
+        with col4:
+            st.metric("Your Rank", f"#{my_rank:,} of {summary['members']:,}" if my_rank else "-")
         
         st.markdown("---")
         
@@ -108,74 +186,87 @@ def show_league_page(league_id, project_id, dataset_id):
         with col1:
             st.subheader("👥 League Members")
             
-            # Display members with their step counts
-            if not steps_df.empty:
-                display_df = steps_df.copy()
-                display_df['total_steps'] = display_df['total_steps'].apply(lambda x: f"{int(x):,}")
-                display_df = display_df.rename(columns={
-                    'player_id': 'Member', 
-                    'total_steps': 'Total Steps'
-                })
-                st.dataframe(display_df, use_container_width=True, hide_index=True)
-            else:
-                # Just show member names if no step data
-                members_display = members_df.rename(columns={'player_id': 'Member'})
-                st.dataframe(members_display, use_container_width=True, hide_index=True)
+            # One page of members at a time, ranked server-side
+            st.dataframe(
+                leaderboard_table,
+                column_config=LEADERBOARD_COLUMN_CONFIG,
+                use_container_width=True,
+                hide_index=True
+            )
+            
+            page_count = max(-(-summary['members'] // LEADERBOARD_PAGE_SIZE), 1)
+            if page_count > 1:
+                # Members can leave between reruns, so keep the page in range
+                if page > page_count:
+                    st.session_state[page_key] = page_count
+                st.number_input(
+                    f"Page (of {page_count:,}):",
+                    min_value=1,
+                    max_value=page_count,
+                    key=page_key
+                )
+            
+            if neighbourhood_table.num_rows:
+                st.subheader("📍 Your Position")
+                st.dataframe(
+                    neighbourhood_table,
+                    column_config=LEADERBOARD_COLUMN_CONFIG,
+                    use_container_width=True,
+                    hide_index=True
+                )
         
         with col2:
             st.subheader("📊 Steps Distribution")
             
             # Create pie chart only if there are steps
-            if not steps_df.empty and steps_df['total_steps'].sum() > 0:
-                # Filter out members with 0 steps for a cleaner pie chart
-                chart_data = steps_df[steps_df['total_steps'] > 0].copy()
-                
-                if not chart_data.empty:
-                    fig = px.pie(
-                        chart_data, 
-                        values='total_steps', 
-                        names='player_id',
-                        title='Total Steps by Member'
-                    )
-                    
-                    fig.update_traces(
-                        textposition='inside', 
-                        textinfo='percent+label',
-                        hovertemplate='<b>%{label}</b><br>Steps: %{value:,}<br>Percentage: %{percent}<extra></extra>'
-                    )
-                    
-                    fig.update_layout(
-                        height=400,
-                        showlegend=True,
-                        legend=dict(
-                            orientation="v",
-                            yanchor="middle",
-                            y=0.5,
-                            xanchor="left",
-                            x=1.05
-                        )
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("No step data available for pie chart.")
+            if summary['total_steps'] > 0:
+                # Rebuilt only when the league's rankings or the window change
+                fig = pio.from_json(distribution_figure_json(
+                    league_id,
+                    start_day,
+                    end_day,
+                    data_version,
+                    summary['total_steps'],
+                    top_df
+                ))
+                st.plotly_chart(fig, use_container_width=True)
             else:
                 st.info("No step data available for this league yet.")
         
+        # Most recent lottery draw
+        st.markdown("---")
+        st.subheader("🎟️ Latest Draw")
+        
+        if draw_df.empty:
+            st.info("No draws yet. Every 1,000 steps in a week earns a ticket for that week's draw.")
+        else:
+            first = draw_df.iloc[0]
+            st.caption(
+                f"Week of {first['period_start']:%d %b} to {first['period_end']:%d %b %Y} · "
+                f"{int(first['total_tickets']):,} tickets from {int(first['entrants']):,} members · seed {first['seed']}"
+            )
+            for _, winner in draw_df.iterrows():
+                # Winners after the first are drawn from the tickets that are
+                # left, so this is each winner's share, not their chance of their rank
+                ticket_share = winner['winner_tickets'] / winner['total_tickets']
+                st.success(
+                    f"🏅 **#{int(winner['winner_rank'])}: {winner['winner_id']}** "
+                    f"with {int(winner['winner_tickets']):,} tickets ({ticket_share:.2%} of all tickets)"
+                )
+        
         # Additional league info
         st.markdown("---")
         st.subheader("ℹ️ League Information")
         
-        if not steps_df.empty:
+        if not top_df.empty:
             # Find top performer
-            top_performer = steps_df.loc[steps_df['total_steps'].idxmax()]
+            top_performer = top_df.iloc[0]
             if top_performer['total_steps'] > 0:
                 st.success(f"🥇 **Top Performer:** {top_performer['player_id']} with {int(top_performer['total_steps']):,} steps!")
             
             # Show some encouragement for members with no steps
-            no_steps_members = steps_df[steps_df['total_steps'] == 0]
-            if not no_steps_members.empty:
-                st.info(f"💪 **Get Moving:** {', '.join(no_steps_members['player_id'].tolist())} - Start tracking your steps to appear on the chart!")
+            if summary['zero_members'] > 0:
+                st.info(f"💪 **Get Moving:** {summary['zero_members']:,} members have no steps yet - start tracking your steps to appear on the chart!")
         
     except Exception as e:
         st.error(f"Error loading league data: {str(e)}")
@@ -1,19 +1,10 @@
 import streamlit as st
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from data.queries import user_step_entry_count, mark_user_has_steps
 
-@st.cache_resource
-def init_bigquery_client():
-    """Initialize BigQuery client using service account from secrets"""
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"]
-    )
-    return bigquery.Client(
-        credentials=credentials,
-        project="my-project-1706650764881"
-    )
+# The shortcut uploads the last 7 days, so a fresh sync always lands in this window
+SYNC_CHECK_LOOKBACK_DAYS = 30
 
-def show_setup_steps_page(project_id, dataset_id, table_id):
+def show_setup_steps_page():
     """Display the setup steps page for new users"""
     st.title("📱 Setup Your Step Tracking")
     
@@ -70,32 +61,16 @@ def show_setup_steps_page(project_id, dataset_id, table_id):
     
     if st.button("Check if Steps are Synced", type="secondary", use_container_width=True):
         try:
-            # Initialize BigQuery client
-            client = init_bigquery_client()
-            
             # Check if user has any steps
-            query = f"""
-            SELECT COUNT(*) as count
-            FROM `{project_id}.{dataset_id}.{table_id}`
-            WHERE name = @username
-            """
-            
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("username", "STRING", st.session_state.username)
-                ]
-            )
-            
-            query_job = client.query(query, job_config=job_config)
-            results = query_job.result()
+            count = user_step_entry_count(st.session_state.username, SYNC_CHECK_LOOKBACK_DAYS)
             
-            for row in results:
-                if row.count > 0:
-                    st.success(f"Great! We found {row.count} step entries for your account. Redirecting to homepage...")
-                    st.session_state.page = "homepage"
-                    st.rerun()
-                else:
-                    st.warning("No steps found yet. Please install and run the shortcut, then check again.")
+            if count > 0:
+                mark_user_has_steps(st.session_state.username)
+                st.success(f"Great! We found {count} step entries for your account. Redirecting to homepage...")
+                st.session_state.page = "homepage"
+                st.rerun()
+            else:
+                st.warning("No steps found yet. Please install and run the shortcut, then check again.")
                     
         except Exception as e:
             st.error(f"Error checking steps: {str(e)}")